@@ -0,0 +1,90 @@
+# agents/memory_jobs.py
+import uuid
+from typing import Any, Dict, List, Optional
+
+from core.gateway import background
+from core.tracing import detached
+from memory.graph_store import new_graph, apply_patch
+from memory.persistence import load_graph, update_graph
+from memory.update_queue import MemoryUpdateQueue, already_applied, mark_applied, idempotency_key
+from agents.subflows import ensure_pipeline_state, subflow_commit_plan
+
+# ============================================================
+# 记忆写入 job（在 memory.update_queue 的后台 worker 中执行）
+#
+# 每个 job 都基于磁盘上最新的图谱执行，而不是提交时的快照：
+# 同一用户的 job 串行执行，前一个的结果对后一个可见。
+# handler 运行在提交时的上下文副本里（拿得到请求注入的 cfg），span 不记到提交那一轮。
+# ============================================================
+
+JOB_COMMIT_PLAN = "commit_plan"
+JOB_APPLY_PATCH = "apply_patch"
+
+
+def _run_commit_plan(key: str, payload: Dict[str, Any]) -> None:
+    with detached():
+        _commit_plan(key, payload)
+
+
+def _commit_plan(key: str, payload: Dict[str, Any]) -> None:
+    path = payload["path"]
+    graph = load_graph(path, new_graph())
+    if already_applied(graph, key):
+        return
+
+    state = ensure_pipeline_state(payload.get("user_input", ""), graph)
+    state["task_frame"] = payload.get("task_frame") or {}
+    state["decision"] = payload.get("decision") or {}
+
+    # MemoryUpdater 是后台任务，排在交互请求后面；LLM 调用不占文件锁
+    with background():
+        state = subflow_commit_plan(state, [], payload.get("plan_text", ""), task_frame=payload.get("task_frame"))
+
+    # 产出的 patch 在锁内重放到最新图谱上（期间页面编辑等写入不会被覆盖）
+    _apply_patch(key, {"path": path, "patch_ops": state.get("memory_patch", [])})
+
+
+def _run_apply_patch(key: str, payload: Dict[str, Any]) -> None:
+    with detached():
+        _apply_patch(key, payload)
+
+
+def _apply_patch(key: str, payload: Dict[str, Any]) -> None:
+    def _apply(graph: Dict[str, Any]):
+        if already_applied(graph, key):
+            return None
+        updated = apply_patch(graph, payload.get("patch_ops", []))
+        mark_applied(updated, key)
+        return updated
+
+    # 文件锁内读-改-写（跨 worker 进程也不会丢更新）
+    update_graph(payload["path"], _apply, new_graph())
+
+
+def register_memory_jobs(q: MemoryUpdateQueue) -> None:
+    q.register(JOB_COMMIT_PLAN, _run_commit_plan)
+    q.register(JOB_APPLY_PATCH, _run_apply_patch)
+
+
+# ============================================================
+# 提交入口（agents.pipeline 用）
+# ============================================================
+def submit_commit_plan(q: MemoryUpdateQueue, path: str, state: Dict[str, Any],
+                       plan_text: str, task_frame: Dict[str, Any] = None,
+                       plan_id: Optional[str] = None) -> str:
+    payload = {
+        "path": path,
+        "user_input": state.get("user_input", ""),
+        "task_frame": task_frame or state.get("task_frame", {}),
+        # MemoryUpdater 只读 decision.final_plan，不必把整个 pipeline state 落盘
+        "decision": {"final_plan": (state.get("decision") or {}).get("final_plan", {})},
+        "plan_text": plan_text,
+    }
+    # 同一份待确认计划（plan_id = 生成它的那一轮）重复点“采纳”只写一次；
+    # 不按计划内容去重，之后重新生成、内容相同的计划仍会正常写入
+    key = idempotency_key(JOB_COMMIT_PLAN, path, plan_id or uuid.uuid4().hex)
+    return q.submit(JOB_COMMIT_PLAN, path, payload, key=key)
+
+
+def submit_patch(q: MemoryUpdateQueue, path: str, patch_ops: List[Dict[str, Any]], key: str) -> str:
+    return q.submit(JOB_APPLY_PATCH, path, {"path": path, "patch_ops": patch_ops}, key=key)
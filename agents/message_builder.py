@@ -41,6 +41,7 @@ def build_user_message_for_agent(name: str, state: Dict[str, Any]) -> str:
             "user_input": base["user_input"],
             "task_frame": base["task_frame"],
             "memory_retrieval": base["memory_retrieval"],
+            "kg_evidence": base["kg_evidence"],
         }
     elif name.startswith("KnowledgeRetriever"):
         payload = {
@@ -0,0 +1,375 @@
+# agents/pipeline.py
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from typing import Any, Dict, Iterator, Optional
+
+from core.config import get_cfg, load_cfg_from_env, use_cfg
+from core.tracing import start_turn, end_turn
+from core.resources import load_snapshot
+from memory.repository import DEFAULT_USER, MemoryRepository, get_repository, safe_id
+from memory.graph_store import new_graph
+from memory.persistence import graph_lock
+from memory.update_queue import MemoryUpdateQueue, get_update_queue, idempotency_key
+from agents.router import route
+from agents.subflows import (
+    ensure_pipeline_state,
+    subflow_faq_exercise, subflow_faq_food, subflow_query_memory,
+    subflow_log_update,
+    subflow_plan_full
+)
+from agents.response_generator import render_response
+from agents.memory_jobs import register_memory_jobs, submit_commit_plan, submit_patch
+
+# ============================================================
+# Headless Pipeline
+#
+# 与界面无关的一轮对话：route -> subflow -> render，记忆写入走后台队列。
+#   - handle_stream(user_id, message) 逐步 yield 事件（status / route / done），
+#     HTTP 前端按 NDJSON 流式转发，streamlit 用来刷新进度提示
+#   - handle(user_id, message) 只取最终的 done 事件
+#   - cfg 由调用方注入（use_cfg），不读 streamlit session
+#   - 会话状态（对话历史、待确认计划）：调用方可直接传一个 dict-like（如 st.session_state），
+#     否则从 SessionStore 按 user 读写磁盘，多个 worker 共享 DATA_DIR 即可接力
+# ============================================================
+
+DATA_DIR = os.getenv("DATA_DIR", "./data")
+MAX_TURN_TRACES = 20
+SESSION_MESSAGES_KEEP = 50        # 落盘的对话历史条数（Router 只看最近 15 条）
+
+PLAN_ROUTES = ("plan_workout", "plan_diet", "plan_both")
+
+
+def new_session() -> Dict[str, Any]:
+    return {"messages": [], "trace": [], "turn_traces": [], "pending_plan": None}
+
+
+# ============================================================
+# Session Store（headless 模式）
+# ============================================================
+class SessionStore:
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        # agent trace / span 只做调试展示，留在进程内不落盘
+        self._debug: Dict[str, Dict[str, list]] = defaultdict(lambda: {"trace": [], "turn_traces": []})
+
+    def path(self, user_id: str) -> str:
+        return os.path.join(self.root, f"{safe_id(user_id)}.json")
+
+    def load(self, user_id: str) -> Dict[str, Any]:
+        session = new_session()
+        path = self.path(user_id)
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            session["messages"] = data.get("messages", [])
+            session["pending_plan"] = data.get("pending_plan")
+        session.update(self._debug[user_id])
+        return session
+
+    def save(self, user_id: str, session: Dict[str, Any]) -> None:
+        self._debug[user_id] = {"trace": session["trace"], "turn_traces": session["turn_traces"]}
+        data = {
+            "messages": session["messages"][-SESSION_MESSAGES_KEEP:],
+            "pending_plan": session.get("pending_plan"),
+            "updated": int(time.time()),
+        }
+        fd, tmp = tempfile.mkstemp(prefix="tmp_", suffix=".json", dir=self.root)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, self.path(user_id))
+
+
+# ============================================================
+# Pipeline
+# ============================================================
+class Pipeline:
+    def __init__(
+        self,
+        cfg: Optional[dict] = None,
+        data_dir: str = DATA_DIR,
+        memory_queue: Optional[MemoryUpdateQueue] = None,
+        sessions: Optional[SessionStore] = None,
+        repository: Optional[MemoryRepository] = None,
+    ):
+        self.cfg = cfg if cfg is not None else load_cfg_from_env()
+        self.data_dir = data_dir
+        self.sessions = sessions or SessionStore(os.path.join(data_dir, "sessions"))
+        self.repository = repository or get_repository(data_dir)
+
+        self.memory_queue = memory_queue or get_update_queue(os.path.join(data_dir, "memory_jobs"))
+        register_memory_jobs(self.memory_queue)
+        self.memory_queue.start()
+
+    # ------------------------------------------------------------
+    # 本地 KG 快照（进程级共享，文件更新后自动重新加载）
+    # ------------------------------------------------------------
+    @property
+    def exercise_kg(self) -> Dict[str, Any]:
+        return load_snapshot(os.path.join(self.data_dir, "exercise_kg.json"), new_graph)
+
+    @property
+    def nutrition_kg(self) -> Dict[str, Any]:
+        return load_snapshot(os.path.join(self.data_dir, "nutrition_kg.json"), new_graph)
+
+    # ------------------------------------------------------------
+    # 用户记忆
+    # ------------------------------------------------------------
+    def graph_path(self, user_id: str) -> str:
+        return self.repository.path(user_id)
+
+    def load_user_graph(self, user_id: str) -> Dict[str, Any]:
+        return self.repository.load(user_id)
+
+    def memory_status(self, user_id: str) -> Dict[str, Any]:
+        path = self.graph_path(user_id)
+        return {
+            "version": self.memory_queue.version(path),
+            "pending": self.memory_queue.pending_count(path),
+            "error": self.memory_queue.last_error(path),
+        }
+
+    def _user_lock(self, user_id: str):
+        # 同一用户的请求串行（对话历史 / 待确认计划是读改写）：
+        # 进程内 RLock + 会话文件旁的 flock，多个 worker 进程共享 DATA_DIR 时同样互斥
+        return graph_lock(self.sessions.path(user_id))
+
+    # ------------------------------------------------------------
+    # 一轮对话
+    # ------------------------------------------------------------
+    def handle(self, user_id: str, message: str, **kwargs) -> Dict[str, Any]:
+        result = {}
+        for event in self.handle_stream(user_id, message, **kwargs):
+            if event["event"] == "done":
+                result = event
+        return result
+
+    def handle_stream(
+        self,
+        user_id: str,
+        message: str,
+        session: Optional[Dict[str, Any]] = None,
+        user_graph: Optional[Dict[str, Any]] = None,
+        cfg: Optional[dict] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        session / user_graph 不传时按 user_id 从磁盘读取；
+        cfg 不传时用构造时注入的配置。
+        """
+        with self._user_lock(user_id):
+            own_session = session is None
+            if own_session:
+                session = self.sessions.load(user_id)
+            if user_graph is None:
+                user_graph = self.load_user_graph(user_id)
+
+            with use_cfg(cfg if cfg is not None else self.cfg):
+                # 每轮一个 id：这一轮产生的记忆 job 以它做幂等键（同样的内容隔天再记也是新的一条）
+                turn_id = uuid.uuid4().hex
+                turns = session["turn_traces"]
+                turns.append(start_turn(message, user=user_id, turn_id=turn_id))
+                del turns[:-MAX_TURN_TRACES]
+                t0 = time.perf_counter()
+                try:
+                    for event in self._run(user_id, message, session, user_graph, turn_id):
+                        if event["event"] == "done":
+                            event["ms"] = round((time.perf_counter() - t0) * 1000, 2)
+                        yield event
+                finally:
+                    end_turn()
+                    if own_session:
+                        self.sessions.save(user_id, session)
+
+    def _run(self, user_id: str, message: str, session: Dict[str, Any],
+             user_graph: Dict[str, Any], turn_id: str) -> Iterator[Dict[str, Any]]:
+        messages = session["messages"]
+        trace = session["trace"]
+        session["pending_plan"] = None
+        messages.append({"role": "user", "content": message})
+
+        if not get_cfg().get("api_key"):
+            yield _done("other", "error", "请先配置 API Key")
+            return
+
+        yield _status("route", "Router 思考中...")
+        r = route(message, messages, user_graph, trace)
+
+        if r.get("need_clarify"):
+            qs = r.get("clarify_questions", [])
+            reply = "我还需要确认几件事：\n" + "\n".join([f"- {q}" for q in qs])
+            messages.append({"role": "assistant", "content": reply})
+            yield _done(r.get("route", "other"), "clarify", reply)
+            return
+
+        route_name = r.get("route", "other")
+        yield {"event": "route", "route": route_name}
+        state = ensure_pipeline_state(message, user_graph, user_id=user_id)
+
+        # === Subflows ===
+        if route_name == "faq_exercise":
+            yield _status("subflow", "正在检索动作知识图谱...")
+            state = subflow_faq_exercise(state, self.exercise_kg)
+
+        elif route_name == "faq_food":
+            yield _status("subflow", "正在检索营养数据库...")
+            state = subflow_faq_food(state, self.nutrition_kg)
+
+        elif route_name == "query_memory":
+            yield _status("subflow", "正在查询历史记忆...")
+            state = subflow_query_memory(state, trace)
+
+        elif route_name in PLAN_ROUTES:
+            # 1. 运行计划生成 (最耗时的部分)
+            yield _status("subflow", "正在规划方案 (Intent -> Retrieval -> Draft -> Reasoner)...")
+            try:
+                state = subflow_plan_full(
+                    state, trace,
+                    self.exercise_kg,
+                    self.nutrition_kg,
+                    route_name=route_name,
+                    chat_history=messages
+                )
+            except Exception as e:
+                print(f"[Error] Plan Gen: {e}")
+                yield _done(route_name, "error", f"💥 计划生成阶段出错: {str(e)}")
+                return
+
+            # 2. 生成回复文本 (渲染阶段)
+            yield _status("render", "渲染方案中...")
+            try:
+                reply = render_response(route_name, state, state.get("memory_summary", {}))
+            except Exception as e:
+                print(f"[Error] Render failed: {e}")
+                # 兜底回复，防止因为渲染失败导致整个流程断掉
+                reply = "✅ **计划已生成！** \n\n(注：由于方案过长，AI 总结文本渲染超时，但不影响计划数据的完整性。请直接确认下方详情。)"
+
+            # 3. 结果校验与状态流转
+            decision = state.get("decision", {})
+            # Case A: 成功生成了计划 -> 等用户确认（accept_plan）
+            if decision.get("final_plan") or state.get("draft_plan"):
+                reply = reply or "✅ 计划已就绪，请查阅。"
+                session["pending_plan"] = {
+                    # 采纳时的幂等键：同一份待确认计划只写一次，重新生成的计划是新的 id
+                    "plan_id": turn_id,
+                    # 只留 MemoryUpdater 需要的部分，便于落盘 / 跨 worker
+                    "state": {
+                        "user_input": message,
+                        "task_frame": state.get("task_frame", {}),
+                        "decision": {"final_plan": decision.get("final_plan", {})},
+                    },
+                    "text": reply,
+                    "task_frame": state.get("task_frame", {}),
+                }
+                messages.append({"role": "assistant", "content": reply})
+                yield _done(route_name, "plan", reply, state=state, pending_plan=True)
+            # Case B: 没有计划，但是有回复 (说明触发了追问/拦截逻辑)
+            elif decision.get("response"):
+                messages.append({"role": "assistant", "content": decision["response"]})
+                yield _done(route_name, "answer", decision["response"], state=state)
+            # Case C: 既没计划也没回复 (真正的失败)
+            else:
+                yield _done(route_name, "error", "😓 生成失败：模型未能产出有效的计划结构。", state=state)
+            return
+
+        elif route_name == "log_update":
+            yield _status("subflow", "正在分析饮食记录...")
+            state = subflow_log_update(state, trace, chat_history=messages)
+
+            # Case A: 成功写入 (有 graph 更新)；Case B 追问走下面的通用回复
+            if "user_memory_graph_updated" in state:
+                path = self.graph_path(user_id)
+                # 调用方可先用本地更新结果，落盘由后台队列基于最新图谱重放同一组 patch
+                job = submit_patch(
+                    self.memory_queue, path,
+                    state.get("memory_patch", []),
+                    key=idempotency_key("log", path, turn_id),
+                )
+                feedback = state.get("decision", {}).get("response", "已记录。")
+                messages.append({"role": "assistant", "content": feedback})
+                yield _done(route_name, "logged", feedback, state=state,
+                            graph=state["user_memory_graph_updated"], memory_job=job)
+                return
+
+        # === Final Reply Render (Non-Plan) ===
+        yield _status("render", "生成回复...")
+        reply = render_response(route_name, state, state.get("memory_summary", {}))
+        messages.append({"role": "assistant", "content": reply})
+        yield _done(route_name, "answer", reply, state=state)
+
+    # ------------------------------------------------------------
+    # 记忆写入
+    # ------------------------------------------------------------
+    def accept_plan(self, user_id: str, session: Optional[Dict[str, Any]] = None,
+                    cfg: Optional[dict] = None) -> Optional[str]:
+        """采纳待确认计划，MemoryUpdater 在后台执行；返回 job key（没有待确认计划 / 重复提交时为 None）"""
+        with self._user_lock(user_id):
+            own_session = session is None
+            if own_session:
+                session = self.sessions.load(user_id)
+            plan = session.get("pending_plan")
+            if not plan:
+                return None
+
+            with use_cfg(cfg if cfg is not None else self.cfg):
+                start_turn("commit_plan", route="commit_plan", user=user_id)
+                try:
+                    # 后台 job 复制当前上下文，拿到的是这里注入的 cfg
+                    key = submit_commit_plan(
+                        self.memory_queue, self.graph_path(user_id),
+                        plan["state"],
+                        plan["text"],
+                        task_frame=plan.get("task_frame"),
+                        plan_id=plan.get("plan_id"),
+                    )
+                finally:
+                    end_turn()
+
+            session["pending_plan"] = None
+            if own_session:
+                self.sessions.save(user_id, session)
+            return key
+
+    def log_event(self, user_id: str, event: Dict[str, Any]) -> Optional[str]:
+        """直接追加一条事件（如打卡），与其他记忆写入串行"""
+        path = self.graph_path(user_id)
+        return submit_patch(
+            self.memory_queue, path,
+            [{"op": "append_event", "event": event}],
+            key=idempotency_key("checkin", path, event),
+        )
+
+
+def _status(stage: str, message: str) -> Dict[str, Any]:
+    return {"event": "status", "stage": stage, "message": message}
+
+
+def _done(route_name: str, kind: str, reply: str, **extra) -> Dict[str, Any]:
+    """
+    kind: answer / clarify / plan / logged / error
+    state / graph 只给进程内调用方用，HTTP 前端不会序列化
+    """
+    event = {"event": "done", "route": route_name, "kind": kind, "reply": reply,
+             "pending_plan": False, "memory_job": None}
+    event.update(extra)
+    return event
+
+
+# ============================================================
+# 进程级单例（streamlit 每次 rerun 都会执行 app.py）
+# ============================================================
+_pipeline: Optional[Pipeline] = None
+_pipeline_lock = threading.Lock()
+
+
+def get_pipeline(data_dir: str = DATA_DIR, cfg: Optional[dict] = None) -> Pipeline:
+    global _pipeline
+    if _pipeline is None:
+        with _pipeline_lock:
+            if _pipeline is None:
+                _pipeline = Pipeline(cfg=cfg, data_dir=data_dir)
+    return _pipeline
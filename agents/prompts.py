@@ -101,6 +101,8 @@ REASONER_SYS = """你是推理决策智能体（Reasoner/Critic）。
 2. **审核时长**：用户要练 1 小时，草案只有 30 分钟？--> 修改 sets/reps 或增加动作，把时间填满。
 3. **审核器械**：用户无器械，草案里有哑铃？--> 删掉哑铃动作，换成徒手替代动作（或注明用矿泉水瓶）。
 4. **审核逻辑**：动作安排是否合理？（热身 -> 复合 -> 孤立 -> 拉伸）。
+5. **程序生成的草案**：workout_draft 带 schedule 时是程序按图谱和训练历史排好的一周计划（已避开伤病、器械和肌群疲劳），
+   没有违反上面几条就原样保留 sessions，只在 notes 里补充说明，不要重写。
 
 输出：
 - final_plan: 修正后的完美计划。
@@ -2,9 +2,11 @@
 import json
 from typing import Dict, Any
 from core.llm import chat
+from core.tracing import traced
 from core.json_utils import dumps
 from agents.prompts import RESPONSE_GENERATOR_SYS
 
+@traced("render_response", kind="stage")
 def render_response(route: str, state: Dict[str, Any], memory_summary: Dict[str, Any]) -> str:
     """
     输入：route + state（含 decision/evidence/memory_retrieval 等）
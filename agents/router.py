@@ -1,10 +1,12 @@
 # agents/router.py
 from typing import Dict, Any
 from agents.runner import run_agent
+from core.tracing import traced, set_turn_attrs
 from agents.prompts import ROUTER_SYS
 from memory.graph_store import summarize
 from agents.schemas import ROUTER_RESPONSE_FORMAT
 
+@traced("route", kind="stage")
 def route(user_input: str, messages: list, user_graph: Dict[str, Any], trace: list) -> Dict[str, Any]:
     # 给 Router 的上下文：最近几轮对话 + 记忆摘要
     recent = messages[-15:] if len(messages) > 15 else messages
@@ -13,4 +15,7 @@ def route(user_input: str, messages: list, user_graph: Dict[str, Any], trace: li
         "chat_context": recent,
         "memory_summary": summarize(user_graph),
     }
-    return run_agent("Router", ROUTER_SYS, state, trace, response_format=ROUTER_RESPONSE_FORMAT)
\ No newline at end of file
+    r = run_agent("Router", ROUTER_SYS, state, trace, response_format=ROUTER_RESPONSE_FORMAT)
+    # 本轮的 span / 指标都按 route 归类
+    set_turn_attrs(route=r.get("route", "other") if isinstance(r, dict) else "other")
+    return r
\ No newline at end of file
@@ -3,6 +3,7 @@ import time  # 新增
 from typing import Any, Dict, Optional
 from core.json_utils import safe_json_loads
 from core.llm import chat
+from core.tracing import span
 from agents.message_builder import build_user_message_for_agent
 
 def run_agent(
@@ -16,14 +17,15 @@ def run_agent(
     # 1. 开始计时
     start_ts = time.time()
     
-    user_message = build_user_message_for_agent(name, state)
+    with span(name, kind="agent") as agent_span:
+        user_message = build_user_message_for_agent(name, state)
 
-    out_text = chat(
-        instruction=instruction,
-        user_message=user_message,
-        model=state.get("cfg", {}).get("model", "gpt-4.1"),
-        response_format=response_format,
-    )
+        out_text = chat(
+            instruction=instruction,
+            user_message=user_message,
+            model=state.get("cfg", {}).get("model", "gpt-4.1"),
+            response_format=response_format,
+        )
 
     out = safe_json_loads(out_text)
     
@@ -38,7 +40,8 @@ def run_agent(
         "ms": duration_ms,       # 记录耗时
         "raw": out_text,
         "parsed": out,
-        "response_format": response_format
+        "response_format": response_format,
+        "span_id": agent_span.get("id"),  # 对应 tracing 里的 agent span
     })
     
     return out
\ No newline at end of file
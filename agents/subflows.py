@@ -5,14 +5,16 @@ from typing import Any, Dict, Tuple, List
 from datetime import datetime
 
 from agents.runner import run_agent
-from core.config import get_cfg
 from core.llm import chat
+from core.tracing import traced
+from core.resources import term_cache
+from core.metrics import record_cache
 
 # === 工具导入 ===
-from tools.exercise_recommender import recommend_exercise_tool
+from tools.exercise_recommender import recommend_exercise_tool, build_program_tool
 # [NEW] 引入新的饮食工具
-from tools.diet_tools.diet_recommender import diet_recommendation_tool
-from tools.diet_tools.query import DietKGQuery 
+from tools.diet_tools.diet_recommender import diet_day_recommendation_tool, diet_week_plan_tool
+from tools.kg_clients import get_exercise_kg, get_diet_kg
 
 from memory.graph_store import summarize, apply_patch
 from agents.prompts import (
@@ -38,12 +40,171 @@ VALID_BODY_PARTS = [
     'Hips', 'Should', 'Thigh', 'Back'
 ]
 GYM_PRESET = ["Barbell", "Dumbbell", "Cable", "Lever", "Smith Machine", "Sled", "Weighted", "Suspended"]
+NUTRIENT_NAMES = {"calories": "热量", "protein": "蛋白质", "carbs": "碳水", "fat": "脂肪"}
+# 饮食计划只问今天（"今天还能吃什么"）时排今天剩下的餐段，否则排一周
+TODAY_KEYWORDS = ("今天", "今日", "今晚", "today", "tonight")
 
 
 # ============================================================
 # Helpers
 # ============================================================
 
+def _workout_profile(state: Dict[str, Any]):
+    """本轮共用的训练历史特征（按用户 + 图谱版本缓存，见 history_profile.py）"""
+    from tools.exercise_tools.history_profile import get_history_profile
+    try:
+        return get_history_profile(state["user_memory_graph"], owner=state.get("user_id"))
+    except Exception as e:
+        print(f"[History] profile failed, fallback to raw history: {e}")
+        return None
+
+
+def _fmt_macros(macros: Dict[str, Any], targets: Dict[str, Any]) -> str:
+    return "，".join(
+        f"{m}:{v:.0f}g (目标 {targets[m][0]:.0f}-{targets[m][1]:.0f}g)"
+        for m, v in macros.items() if m in targets
+    )
+
+
+def _diet_day_evidence(day_plan: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """今天的方案 -> nutrition_kg evidence：总览 + 每道菜一条"""
+    meals = day_plan.get("meals", [])
+    evidence = [{
+        "evidence_id": "day_plan",
+        "name": "今天剩下的饮食方案",
+        "summary": (
+            f"【今天】全天目标 {day_plan.get('daily_target_calories', 0):.0f}kcal，"
+            f"已记录 {day_plan.get('eaten_calories', 0):.0f}kcal；"
+            f"剩下的餐段 {day_plan.get('actual_calories', 0):.0f}kcal (目标:{day_plan.get('target_calories', 0):.0f})，"
+            + _fmt_macros(day_plan.get("macros", {}), day_plan.get("macro_targets", {}))
+        ),
+        "fields": {
+            "meals": [p.get("meal_time") for p in meals],
+            "macros": day_plan.get("macros", {}),
+            "macro_targets": day_plan.get("macro_targets", {}),
+        },
+        "source": "Diet_Recommender"
+    }]
+    for plan in meals:
+        meal_time = plan.get("meal_time", "meal")
+        for r in plan.get("recipes", []):
+            evidence.append({
+                "evidence_id": r.get("recipe_name"), # 使用名称作为ID
+                "name": r.get("recipe_name"),
+                "summary": (
+                    f"【推荐理由】评分:{plan.get('score', 0):.2f}, 匹配餐段:{meal_time}。\n"
+                    f"热量:{r.get('calories', 0):.1f}kcal (目标:{plan.get('target_calories', 0):.0f})。"
+                ),
+                "fields": {
+                    "calories": r.get("calories"),
+                    "cuisine": r.get("cuisine_type"),
+                },
+                "source": "Diet_Recommender"
+            })
+    return evidence
+
+
+def _diet_week_evidence(week_plan: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """一周方案 -> nutrition_kg evidence：总览 + 每天一条 + 每道菜一条（首次出现的餐段）"""
+    days = week_plan.get("days", [])
+    evidence = [{
+        "evidence_id": "week_plan",
+        "name": "一周饮食方案",
+        "summary": (
+            f"【一周】{len(days)} 天，每天目标 {week_plan.get('target_calories', 0):.0f}kcal；"
+            f"同一道菜最多 {week_plan.get('max_repeats')} 次"
+        ),
+        "fields": {
+            "macro_targets": week_plan.get("macro_targets", {}),
+            "repeats": week_plan.get("repeats", {}),
+        },
+        "source": "Diet_Recommender"
+    }]
+
+    over_cap = week_plan.get("over_cap") or {}
+    if over_cap:
+        # week_planner 已经尽量替换过，剩下的是候选菜本身不够轮换，要如实告诉用户
+        evidence.insert(0, {
+            "source": "SYSTEM_NOTE",
+            "name": "Note",
+            "summary": (
+                f"【注意】符合忌口的候选菜不够一周轮换，以下菜超出每周 {week_plan.get('max_repeats')} 次的上限："
+                + "，".join(f"{n} {c} 次" for n, c in over_cap.items())
+                + "。请在方案中说明，并建议用户放宽忌口或自行替换同类菜。"
+            ),
+            "fields": {"over_cap": over_cap},
+        })
+
+    macro_gaps = week_plan.get("macro_gaps") or {}
+    if macro_gaps:
+        # 宏量只是软约束：候选菜凑不出来的天如实告诉用户，而不是让模型假装达标
+        lines = []
+        for nutrient, gaps in macro_gaps.items():
+            unit = "kcal" if nutrient == "calories" else "g"
+            low, high = gaps[0]["target"]
+            short = [g for g in gaps if g["actual"] < g["target"][0]]
+            over = [g for g in gaps if g["actual"] > g["target"][1]]
+            parts = [
+                f"第{'/'.join(str(g['day']) for g in group)}天{label}（{min(g['actual'] for g in group):.0f}"
+                f"–{max(g['actual'] for g in group):.0f}{unit}）"
+                for group, label in ((short, "偏低"), (over, "偏高")) if group
+            ]
+            lines.append(f"{NUTRIENT_NAMES.get(nutrient, nutrient)}（目标 {low:.0f}–{high:.0f}{unit}）：" + "，".join(parts))
+        evidence.insert(0, {
+            "source": "SYSTEM_NOTE",
+            "name": "Note",
+            "summary": (
+                "【注意】现有候选菜凑不出完全达标的每日营养："
+                + "；".join(lines)
+                + "。请在方案中说明差距，并给出补充建议（如加餐蛋白质来源）。"
+            ),
+            "fields": {"macro_gaps": macro_gaps},
+        })
+
+    seen = set()
+    recipe_items = []
+    for day in days:
+        meal_lines = []
+        for plan in day.get("meals", []):
+            meal_time = plan.get("meal_time", "meal")
+            names = [r.get("recipe_name") for r in plan.get("recipes", [])]
+            meal_lines.append(f"{meal_time}: {' + '.join(names)} ({plan.get('actual_calories', 0):.0f}kcal)")
+
+            for r in plan.get("recipes", []):
+                if r.get("recipe_name") in seen:
+                    continue
+                seen.add(r.get("recipe_name"))
+                recipe_items.append({
+                    "evidence_id": r.get("recipe_name"), # 使用名称作为ID
+                    "name": r.get("recipe_name"),
+                    "summary": (
+                        f"【推荐理由】评分:{plan.get('score', 0):.2f}, 匹配餐段:{meal_time}。\n"
+                        f"热量:{r.get('calories', 0):.1f}kcal (目标:{plan.get('target_calories', 0):.0f})。"
+                    ),
+                    "fields": {
+                        "calories": r.get("calories"),
+                        "cuisine": r.get("cuisine_type"),
+                    },
+                    "source": "Diet_Recommender"
+                })
+
+        evidence.append({
+            "evidence_id": f"week_day_{day.get('day')}",
+            "name": f"第{day.get('day')}天",
+            "summary": (
+                "；".join(meal_lines)
+                + f"。\n全天 {day.get('actual_calories', 0):.0f}kcal，"
+                + _fmt_macros(day.get("macros", {}), day.get("macro_targets", {}))
+            ),
+            "fields": {
+                "meals": [p.get("meal_time") for p in day.get("meals", [])],
+                "macros": day.get("macros", {}),
+            },
+            "source": "Diet_Recommender"
+        })
+    return evidence + recipe_items
+
+
 def _extract_patch_ops(agent_output: Any) -> List[Dict]:
     if isinstance(agent_output, dict) and "ops" in agent_output:
         return agent_output["ops"]
@@ -51,9 +212,11 @@ def _extract_patch_ops(agent_output: Any) -> List[Dict]:
         return agent_output
     return []
 
-def ensure_pipeline_state(user_input: str, user_graph: Dict[str, Any]) -> Dict[str, Any]:
+def ensure_pipeline_state(user_input: str, user_graph: Dict[str, Any],
+                          user_id: str = None) -> Dict[str, Any]:
     return {
         "user_input": user_input,
+        "user_id": user_id,
         "user_memory_graph": user_graph,
         "memory_summary": summarize(user_graph),
         "task_frame": {},
@@ -66,6 +229,7 @@ def ensure_pipeline_state(user_input: str, user_graph: Dict[str, Any]) -> Dict[s
         "memory_patch": []
     }
 
+@traced("extract_search_criteria", kind="phase")
 def _extract_search_criteria(user_text: str) -> dict:
     """提取运动搜索关键词"""
     valid_parts_str = ", ".join(VALID_BODY_PARTS)
@@ -139,30 +303,13 @@ def _construct_diet_user_profile(state: Dict[str, Any]) -> Dict[str, Any]:
     }
     
     # 4. 上下文 (Context)
-    # 获取当天的摄入记录
-    raw_events = state["user_memory_graph"].get("events", [])
-    today_intake = []
-    history = []
-    
+    # 当天摄入 / 最近历史从按天聚合的增量索引里取（见 intake_index.py），不再每轮扫全部事件
+    from tools.diet_tools.intake_index import get_intake_index, RECENT_DAYS
+
     now = datetime.now()
-    today_str = now.strftime("%Y-%m-%d")
-    
-    for e in raw_events:
-        if e.get("type") in ["DietLog", "MealLog"]:
-            props = e.get("props", {})
-            ts = e.get("ts", 0)
-            date_str = datetime.fromtimestamp(ts).strftime("%Y-%m-%d")
-            
-            item = {
-                "meal_time": props.get("meal_type", "snack"),
-                "calories": props.get("calories", 0),
-                "timestamp": datetime.fromtimestamp(ts).isoformat(),
-                "recipes": [{"recipe_name": props.get("summary", "Unknown")}]
-            }
-            
-            history.append(item)
-            if date_str == today_str:
-                today_intake.append(item)
+    intake = get_intake_index(state["user_memory_graph"], owner=state.get("user_id"))
+    today_intake = list(intake.today(now)["entries"])
+    history = intake.window(RECENT_DAYS, now)
 
     current_context = {
         "meal_time": "dinner", # 默认推荐晚餐，或者根据当前时间判断
@@ -181,7 +328,9 @@ def _construct_diet_user_profile(state: Dict[str, Any]) -> Dict[str, Any]:
         "activity": activity,
         "diet_profile": diet_profile,
         "current_context": current_context,
-        "history": history
+        "history": history,
+        # summary(小写) -> 衰减权重，recommend_meals 的历史惩罚直接查它
+        "recent_recipes": intake.recent_recipes(now)
     }
 
 
@@ -189,6 +338,7 @@ def _construct_diet_user_profile(state: Dict[str, Any]) -> Dict[str, Any]:
 # Subflows
 # ============================================================
 
+@traced("subflow_faq_exercise", kind="stage")
 def subflow_faq_exercise(state: Dict[str, Any], exercise_kg: Dict[str, Any]) -> Dict[str, Any]:
     """升级版 FAQ: 智能设备感知"""
     user_input = state["user_input"]
@@ -223,6 +373,7 @@ def subflow_faq_exercise(state: Dict[str, Any], exercise_kg: Dict[str, Any]) ->
                 "injury_body_part": user_injuries if user_injuries else [],
                 "available_equipment": current_equip_context,
                 "history": workout_history,
+                "history_profile": _workout_profile(state),
                 "topk": 5
             }
             recs = recommend_exercise_tool(tool_args)
@@ -253,6 +404,7 @@ def subflow_faq_exercise(state: Dict[str, Any], exercise_kg: Dict[str, Any]) ->
 
 # agents/subflows.py -> subflow_faq_food
 
+@traced("subflow_faq_food", kind="stage")
 def subflow_faq_food(state: Dict[str, Any], nutrition_kg: Dict[str, Any]) -> Dict[str, Any]:
     """
     [Upgrade] 升级版 FAQ Food: 意图提取 -> 翻译 -> 搜索
@@ -314,6 +466,7 @@ def subflow_faq_food(state: Dict[str, Any], nutrition_kg: Dict[str, Any]) -> Dic
     state["kg_evidence"]["nutrition_kg"] = evid
     return state
 
+@traced("subflow_query_memory", kind="stage")
 def subflow_query_memory(state: Dict[str, Any], trace: list) -> Dict[str, Any]:
     """
     [Fixed] 补充丢失的记忆查询流程
@@ -323,6 +476,7 @@ def subflow_query_memory(state: Dict[str, Any], trace: list) -> Dict[str, Any]:
         response_format=MEMORY_RETRIEVER_RESPONSE_FORMAT
     )
     return state
+@traced("subflow_plan_full", kind="stage")
 def subflow_plan_full(state: Dict[str, Any], trace: list,
                       exercise_kg: Dict[str, Any], nutrition_kg: Dict[str, Any],
                       route_name: str = "plan_both",
@@ -358,6 +512,11 @@ def subflow_plan_full(state: Dict[str, Any], trace: list,
     
     print(f"[Plan] Full Context: {context_text}")
 
+    # 饮食只看本轮输入：提到今天、没提一周时只排今天剩下的餐段
+    user_text = state["user_input"].lower()
+    diet_scope = "today" if (any(k in user_text for k in TODAY_KEYWORDS)
+                             and not any(k in user_text for k in ("一周", "每周", "week"))) else "week"
+
     # ============================================================
     # ★ Step 2.5: 主动预检索 (Pre-retrieval)
     # ============================================================
@@ -401,13 +560,15 @@ def subflow_plan_full(state: Dict[str, Any], trace: list,
         if not target_muscles:
             target_muscles = ["Chest", "Back", "Thigh"]
 
-        # 执行推荐
+        # 执行推荐（历史特征只算一次，各部位共用）
+        profile = _workout_profile(state)
         for muscle in target_muscles:
             args = {
                 "target_body_part": muscle,
                 "injury_body_part": task_frame.get("constraints", {}).get("injury", []),
                 "available_equipment": user_equip,
                 "history": workout_history,
+                "history_profile": profile,
                 "topk": 5
             }
             try:
@@ -418,6 +579,19 @@ def subflow_plan_full(state: Dict[str, Any], trace: list,
         
         state["kg_evidence"]["exercise_kg"] = recommended_candidates
 
+        # 确定性一周训练计划（program_builder.py）：LLM 只审核 / 补充说明
+        constraints = task_frame.get("constraints", {}) or {}
+        state["workout_program"] = build_program_tool({
+            "body_parts": target_muscles,
+            "days_per_week": constraints.get("days_per_week"),
+            "time_min": constraints.get("time_min"),
+            "goal": (task_frame.get("goals", {}) or {}).get("primary"),
+            "injury_body_part": constraints.get("injury", []),
+            "available_equipment": user_equip,
+            "history": workout_history,
+            "history_profile": profile,
+        })
+
     # --- B. [NEW] 饮食推荐 (Diet Recommendation) ---
     if need_diet:
         print("[Plan] Starting Diet Recommendation...")
@@ -425,39 +599,16 @@ def subflow_plan_full(state: Dict[str, Any], trace: list,
             # 1. 构造复杂 User Profile
             diet_user_profile = _construct_diet_user_profile(state)
             
-            # 2. 调用 Diet Recommender
-            # 这会返回 [ {meal_time: dinner, recipes: [...]}, ... ]
-            diet_plans = diet_recommendation_tool(diet_user_profile)
-            
-            # 3. 格式化为 Evidence 供 LLM 阅读
-            diet_evidence = []
-            for plan in diet_plans:
-                meal_time = plan.get("meal_time", "meal")
-                score = plan.get("score", 0)
-                cal_target = plan.get("target_calories", 0)
-                cal_actual = plan.get("actual_calories", 0)
-                
-                for r in plan.get("recipes", []):
-                    # 提取主要食材文本
-                    ings = r.get("ingredients", [])
-                    ing_text = ", ".join([i.get("text", i.get("name")) for i in ings[:5]])
-                    
-                    evidence_item = {
-                        "evidence_id": r.get("recipe_name"), # 使用名称作为ID
-                        "name": r.get("recipe_name"),
-                        "summary": (
-                            f"【推荐理由】评分:{score:.2f}, 匹配餐段:{meal_time}。\n"
-                            f"热量:{r.get('calories', 0):.1f}kcal (目标:{cal_target:.0f})。\n"
-                            f"主要食材: {ing_text}"
-                        ),
-                        "fields": {
-                            "calories": r.get("calories"),
-                            "cuisine": r.get("cuisine_type"),
-                            "nutrients": r.get("nutrients") # 包含详细营养素
-                        },
-                        "source": "Diet_Recommender"
-                    }
-                    diet_evidence.append(evidence_item)
+            # 2. 只问今天：排今天剩下的餐段（扣掉已记录的摄入）；
+            #    否则调用本地一周优化器（week_planner.py）。LLM 只负责讲解，不再自行编排菜单
+            if diet_scope == "today":
+                day_plan = diet_day_recommendation_tool(diet_user_profile)
+                state["diet_day_plan"] = day_plan
+                diet_evidence = _diet_day_evidence(day_plan)
+            else:
+                week_plan = diet_week_plan_tool(diet_user_profile)
+                state["diet_week_plan"] = week_plan
+                diet_evidence = _diet_week_evidence(week_plan)
             
             state["kg_evidence"]["nutrition_kg"] = diet_evidence
             print(f"[Plan] Diet Rec success. Generated {len(diet_evidence)} items.")
@@ -469,14 +620,40 @@ def subflow_plan_full(state: Dict[str, Any], trace: list,
     # ============================================================
     # 3. 生成草案 (PlanDraft)
     # ============================================================
-    task_instruction = "当前任务：生成综合方案。"
+    task_instruction = "当前任务：生成综合方案。饮食部分直接采用 Nutrition Evidence 中 week_day_* 的一周菜单。"
+    if need_diet and diet_scope == "today":
+        task_instruction = "当前任务：生成综合方案。饮食部分直接采用 Nutrition Evidence 中 day_plan 排好的今天剩下的餐段。"
     if route_name == "plan_workout":
         task_instruction = "当前任务：仅生成【训练计划】。"
+    elif route_name == "plan_diet" and diet_scope == "today":
+        task_instruction = (
+            "当前任务：仅生成【饮食计划】。Nutrition Evidence 里的 day_plan 已经按今天已记录的摄入"
+            "排好了剩下的餐段（热量 / 宏量已按剩余预算校验），"
+            "请照抄到 diet_draft，只补充说明，不要自行编排或替换菜品。"
+        )
     elif route_name == "plan_diet":
-        task_instruction = "当前任务：仅生成【饮食计划】。请优先使用 Nutrition Evidence 中的推荐食谱。"
+        task_instruction = (
+            "当前任务：仅生成【饮食计划】。Nutrition Evidence 里的 week_day_* 已经是排好的一周菜单"
+            "（热量 / 宏量 / 重复次数均已校验，校验不过的会在 SYSTEM_NOTE 里说明），"
+            "请照抄到 diet_draft，只补充说明，不要自行编排或替换菜品。"
+        )
     
-    current_prompt = PLAN_DRAFT_SYS + f"\n\n### 动态指令\n{task_instruction}"
-    state["draft_plan"] = run_agent("PlanDraft", current_prompt, state, trace, response_format=PLAN_DRAFT_RESPONSE_FORMAT)
+    program = state.get("workout_program") or {}
+    if program.get("sessions") and route_name == "plan_workout":
+        # 训练计划已由程序生成，跳过 PlanDraft，直接交给 Reasoner 审核
+        state["draft_plan"] = {
+            "workout_draft": program,
+            "diet_draft": {},
+            "kg_queries": {"exercise": [], "nutrition": []},
+            "draft_refs": [],
+        }
+    else:
+        if program.get("sessions"):
+            task_instruction += "训练部分已由程序生成（workout_draft 会被覆盖），workout_draft.sessions 输出空数组即可。"
+        current_prompt = PLAN_DRAFT_SYS + f"\n\n### 动态指令\n{task_instruction}"
+        state["draft_plan"] = run_agent("PlanDraft", current_prompt, state, trace, response_format=PLAN_DRAFT_RESPONSE_FORMAT)
+        if program.get("sessions") and isinstance(state["draft_plan"], dict):
+            state["draft_plan"]["workout_draft"] = program
 
     # ============================================================
     # 4. 补充知识检索 (Diet 部分已通过 Pre-retrieval 完成，这里主要补漏)
@@ -496,6 +673,7 @@ def subflow_plan_full(state: Dict[str, Any], trace: list,
 # ============================================================
 # Search Wrappers
 # ============================================================
+@traced("subflow_commit_plan", kind="stage")
 def subflow_commit_plan(state: Dict[str, Any], trace: list, accepted_plan_text: str, task_frame: Dict = None) -> Dict[str, Any]:
     """
     [Fixed] 接受 task_frame 参数，并在采纳计划时强制更新 User Profile 节点。
@@ -564,6 +742,7 @@ def subflow_log_update(state: Dict[str, Any], trace: list) -> Dict[str, Any]:
     state["user_memory_graph_updated"] = updated
     return state
 
+@traced("simple_neo4j_search", kind="phase")
 def _simple_neo4j_search(
     target_part: str,
     exercise_text: str = None,
@@ -575,20 +754,12 @@ def _simple_neo4j_search(
     1. target_part 作为硬约束（TrainingBodyPart）
     2. exercise_text 作为模糊匹配（name / muscle）
     """
-    from tools.exercise_tools.query import ExerciseKGQuery
-    from core.config import get_cfg
-
-    cfg = get_cfg()
     if excludes is None:
         excludes = []
 
-    kg = ExerciseKGQuery(
-        cfg["neo4j_uri"],
-        (cfg["neo4j_user"], cfg["neo4j_password"])
-    )
-
     try:
-        results = kg.search_exercises(
+        # 共享 driver，不再每次查询都新建 / 关闭连接
+        results = get_exercise_kg().search_exercises(
             target_part=target_part,
             exercise_text=exercise_text,
             excludes=excludes,
@@ -597,8 +768,6 @@ def _simple_neo4j_search(
     except Exception as e:
         print(f"[Neo4j Error] {e}")
         return []
-    finally:
-        kg.close()
 
     evidences = []
     for r in results:
@@ -620,23 +789,15 @@ def _simple_neo4j_search(
 
 # agents/subflows.py -> _simple_diet_search
 
+@traced("simple_diet_search", kind="phase")
 def _simple_diet_search(keyword: str, top_k: int = 5) -> List[Dict]:
     """
     [Fixed] 使用正确的 Diet KG 配置连接数据库
     """
-    cfg = get_cfg()
-    from tools.diet_tools.query import DietKGQuery 
-    
-    # ★★★ 关键修改：使用 diet_neo4j_xxx 配置 ★★★
-    # 如果 cfg 里没有 diet_ 配置，说明 config 还没更新，这里做个 fallback 防止报错
-    uri = cfg.get("diet_neo4j_uri", "neo4j+ssc://88f8ccae.databases.neo4j.io")
-    user = cfg.get("diet_neo4j_user", "neo4j")
-    pwd = cfg.get("diet_neo4j_password", "_BAD-vDc9fZjk17xTHjAUWaNPoxGxhh1X9oz2-fDffM")
-
-    kg = DietKGQuery(uri, (user, pwd))
-    
     try:
-        # 调用之前修好的 search_items
+        # 共享 driver，连接信息取 cfg 里的 diet_neo4j_*（见 tools.kg_clients）
+        kg = get_diet_kg()
+        # 菜名检索：查询变体由 schema_probe 预先选好（全文索引 / 扫描，name / recipe_name）
         records = kg.search_items(keyword=keyword, limit=top_k)
         
         evidences = []
@@ -654,13 +815,11 @@ def _simple_diet_search(keyword: str, top_k: int = 5) -> List[Dict]:
     except Exception as e:
         print(f"[Diet Search Error] {e}")
         return []
-    finally:
-        if hasattr(kg, "close"):
-            kg.close()
 # [Import needed] 确保引入了新定义的 Prompt 和 Schema
 from agents.prompts import DIET_LOGGER_SYS,LOG_INTENT_ANALYZER_SYS
 from agents.schemas import DIET_LOGGER_RESPONSE_FORMAT,LOG_INTENT_ANALYZER_RESPONSE_FORMAT
 
+@traced("subflow_log_update", kind="stage")
 def subflow_log_update(
     state: Dict[str, Any],
     trace: list,
@@ -837,6 +996,7 @@ def subflow_log_update(
 
 
 # [NEW] 简单的翻译辅助函数
+@traced("translate_keywords", kind="phase")
 def _translate_keywords(keywords: List[str]) -> List[str]:
     if not keywords: 
         return []
@@ -848,14 +1008,29 @@ def _translate_keywords(keywords: List[str]) -> List[str]:
         "Output JSON: {\"translated\": [\"item1_en\", \"item2_en\"]}"
     )
     
+    # 进程级词表：翻过的词直接复用，只把没见过的词发给 LLM
+    cache = term_cache("translation")
+    known = {k: cache.get(k) for k in keywords}
+    missing = [k for k, en in known.items() if en is None]
+    record_cache("translation", hit=not missing)
+    if not missing:
+        return [known[k] for k in keywords]
+
     try:
         resp = chat(
             instruction=sys_prompt, 
-            user_message=json.dumps(keywords, ensure_ascii=False), 
+            user_message=json.dumps(missing, ensure_ascii=False), 
             response_format={"type": "json_object"}
         )
         data = json.loads(resp)
-        return data.get("translated", [])
+        translated = data.get("translated", [])
     except Exception as e:
         print(f"[Translation Failed] {e}")
-        return keywords # 兜底返回原词
\ No newline at end of file
+        return keywords # 兜底返回原词
+
+    if len(translated) != len(missing):
+        # 对不上位置就不进缓存
+        return [en for en in known.values() if en is not None] + translated
+    for k, en in zip(missing, translated):
+        cache[k] = known[k] = en
+    return [known[k] for k in keywords]
@@ -6,41 +6,50 @@ import streamlit as st
 from core.config import get_cfg
 from typing import Dict, Any, List
 from datetime import datetime, date, timedelta, timezone
-from memory.persistence import load_graph, save_graph
-from memory.graph_store import new_graph, summarize
-from agents.router import route
-from agents.subflows import (
-    ensure_pipeline_state,
-    subflow_faq_exercise, subflow_faq_food, subflow_query_memory,
-    subflow_log_update,
-    subflow_plan_full, subflow_commit_plan
-)
-from agents.response_generator import render_response
+from memory.graph_store import summarize
+from agents.pipeline import DEFAULT_USER, get_pipeline
+from core import metrics
 
 TZ_CN = timezone(timedelta(hours=8))
 
 # 布局设置
 st.set_page_config(page_title="Multi-Agent Fitness", layout="wide")
 cfg = get_cfg()
+metrics.maybe_enable()  # HEALTHKG_METRICS=1 时在后台线程导出 /metrics
 
 DATA_DIR = os.getenv("DATA_DIR", "./data")
-PATH_USER = os.path.join(DATA_DIR, "user_memory_graph.json")
-PATH_EX = os.path.join(DATA_DIR, "exercise_kg.json")
-PATH_NU = os.path.join(DATA_DIR, "nutrition_kg.json")
+
+# === Headless pipeline（进程级单例：KG、记忆写入后台队列都在里面）===
+# 页面只负责展示；cfg 取本 session 设置页里的值，按轮注入
+pipeline = get_pipeline(DATA_DIR)
+memory_queue = pipeline.memory_queue
+
+# 每个浏览器会话一个用户：?user=<id>，不带参数时沿用单用户的默认图谱
+if "user_id" not in st.session_state:
+    st.session_state.user_id = st.query_params.get("user", DEFAULT_USER)
+USER_ID = st.session_state.user_id
+PATH_USER = pipeline.graph_path(USER_ID)
 
 # === Session Init ===
 if "messages" not in st.session_state:
     st.session_state.messages = []
 if "trace" not in st.session_state:
     st.session_state.trace = []
+if "turn_traces" not in st.session_state:
+    st.session_state.turn_traces = []  # core.tracing 的 span 记录，按轮次
 if "user_memory_graph" not in st.session_state:
-    st.session_state.user_memory_graph = load_graph(PATH_USER, new_graph())
-if "exercise_kg" not in st.session_state:
-    st.session_state.exercise_kg = load_graph(PATH_EX, new_graph())
-if "nutrition_kg" not in st.session_state:
-    st.session_state.nutrition_kg = load_graph(PATH_NU, new_graph())
+    st.session_state.user_memory_graph = pipeline.load_user_graph(USER_ID)
 if "pending_plan" not in st.session_state:
     st.session_state.pending_plan = None 
+if "memory_version" not in st.session_state:
+    st.session_state.memory_version = memory_queue.version(PATH_USER)
+
+# === 后台写入落地：重新加载记忆图谱 ===
+_mem_version = memory_queue.version(PATH_USER)
+if _mem_version != st.session_state.memory_version:
+    st.session_state.memory_version = _mem_version
+    st.session_state.user_memory_graph = pipeline.load_user_graph(USER_ID)
+    st.toast("🧠 记忆已更新")
 
 # ============================================================
 # Helper Functions
@@ -255,7 +264,8 @@ def render_right_panel(container):
                     if "events" not in updated_graph: updated_graph["events"] = []
                     updated_graph["events"].append(new_event)
                     st.session_state.user_memory_graph = updated_graph
-                    save_graph(PATH_USER, updated_graph)
+                    # 落盘交给后台队列（与其他记忆写入串行）
+                    pipeline.log_event(USER_ID, new_event)
                     
                     st.toast("打卡成功！")
                     time.sleep(1)
@@ -277,6 +287,22 @@ col_chat, col_info = st.columns([0.7, 0.3], gap="large")
 # 1. 渲染右侧面板
 render_right_panel(col_info)
 
+
+@st.fragment(run_every=2)
+def _memory_sync_watcher():
+    """后台记忆写入落地后触发整页 rerun（顶部会重新加载图谱并 toast）"""
+    if memory_queue.version(PATH_USER) != st.session_state.memory_version:
+        st.rerun()
+    if memory_queue.pending_count(PATH_USER):
+        st.caption("🧠 记忆后台更新中...")
+    err = memory_queue.last_error(PATH_USER)
+    if err:
+        st.caption(f"⚠️ 最近一次记忆写入失败：{err}")
+
+
+with col_info:
+    _memory_sync_watcher()
+
 with col_chat:
 # 2. 渲染左侧聊天记录
 # ============================================================
@@ -355,21 +381,9 @@ with col_chat:
         c1, c2 = st.columns([1, 4])
         with c1:
             if st.button("✅ 采纳此计划", type="primary", key="btn_accept_main"):
-                with st.spinner("正在写入记忆..."):
-                    print(plan_data)
-                    final_state = subflow_commit_plan(
-                        plan_data["state"], 
-                        plan_data["trace"], 
-                        plan_data["text"],
-                        task_frame=plan_data.get("task_frame")
-                    )
-                print(final_state['user_memory_graph_updated'])
-                if "user_memory_graph_updated" in final_state:
-                    st.session_state.user_memory_graph = final_state["user_memory_graph_updated"]
-                    save_graph(PATH_USER, final_state["user_memory_graph_updated"])
-                
-                st.session_state.pending_plan = None
-                st.success("已保存！右侧面板已更新。")
+                # MemoryUpdater 在后台执行，完成后页面自动刷新右侧面板
+                pipeline.accept_plan(USER_ID, session=st.session_state, cfg=cfg)
+                st.success("已采纳！记忆正在后台写入，右侧面板稍后自动更新。")
                 time.sleep(1)
                 st.rerun()
         with c2:
@@ -386,146 +400,52 @@ if user_text:
         st.error("请先配置 API Key")
         st.stop()
 
-    if st.session_state.pending_plan:
-        st.session_state.pending_plan = None
-    
-    st.session_state.messages.append({"role": "user", "content": user_text})
     with col_chat:
         with st.chat_message("user"):
             st.markdown(user_text)
 
-    trace = st.session_state.trace
-    user_graph = st.session_state.user_memory_graph
-
-    with st.spinner("Router 思考中..."):
-        r = route(user_text, st.session_state.messages, user_graph, trace)
+    # === 一轮对话交给 pipeline，这里只把事件画出来 ===
+    result = {}
+    with col_chat:
+        with st.status("Router 思考中...") as status:
+            for event in pipeline.handle_stream(
+                USER_ID, user_text,
+                session=st.session_state,
+                user_graph=st.session_state.user_memory_graph,
+                cfg=cfg,
+            ):
+                if event["event"] == "status":
+                    status.update(label=event["message"])
+                elif event["event"] == "done":
+                    result = event
+            status.update(label="完成", state="complete" if result.get("kind") != "error" else "error")
+
+    kind = result.get("kind")
+    reply = result.get("reply", "")
+
+    # Case A: 成功生成了计划 -> rerun 后显示确认按钮
+    if kind == "plan":
+        st.rerun()
+
+    # Case B: 记录已写入 -> 先用本地更新结果，落盘由后台队列完成
+    elif kind == "logged":
+        st.session_state.user_memory_graph = result["graph"]
+        # 1. 弹窗提示
+        st.toast(f"✅ {reply}")
+        # 2. 稍作停顿后刷新，让 Tab 里的记录更新
+        time.sleep(1.5)
+        st.rerun()
+
+    elif kind == "error":
+        st.error(reply)
+        state = result.get("state")
+        if state is not None:
+            with st.expander("查看调试详情"):
+                st.write("Decision:", state.get("decision", {}))
+                st.write("Draft:", state.get("draft_plan"))
 
-    if r.get("need_clarify"):
-        qs = r.get("clarify_questions", [])
-        reply = "我还需要确认几件事：\n" + "\n".join([f"- {q}" for q in qs])
-        st.session_state.messages.append({"role": "assistant", "content": reply})
+    # 回复 / 追问（pipeline 已写入 messages）
+    elif reply:
         with col_chat:
             with st.chat_message("assistant"):
                 st.markdown(reply)
-        st.stop()
-
-    route_name = r.get("route", "other")
-    state = ensure_pipeline_state(user_text, user_graph)
-
-    # === Subflows (ADDED SPINNERS HERE) ===
-    if route_name == "faq_exercise":
-        with st.spinner("正在检索动作知识图谱..."):
-            state = subflow_faq_exercise(state, st.session_state.exercise_kg)
-            
-    elif route_name == "faq_food":
-        with st.spinner("正在检索营养数据库..."):
-            state = subflow_faq_food(state, st.session_state.nutrition_kg)
-            
-    elif route_name == "query_memory":
-        with st.spinner("正在查询历史记忆..."):
-            state = subflow_query_memory(state, trace)
-            
-    elif route_name in ("plan_workout", "plan_diet", "plan_both"):
-        # 1. 运行计划生成 (最耗时的部分)
-        with st.spinner("正在规划方案 (Intent -> Retrieval -> Draft -> Reasoner)..."):
-            try:
-                state = subflow_plan_full(
-                    state, trace, 
-                    st.session_state.exercise_kg, 
-                    st.session_state.nutrition_kg, 
-                    route_name=route_name,
-                    chat_history=st.session_state.messages 
-                )
-            except Exception as e:
-                st.error(f"💥 计划生成阶段出错: {str(e)}")
-                print(f"[Error] Plan Gen: {e}")
-                st.stop()
-        
-        # 2. 生成回复文本 (渲染阶段)
-        reply = ""
-        with st.spinner("渲染方案中..."):
-            try:
-                reply = render_response(route_name, state, state.get("memory_summary", {}))
-            except Exception as e:
-                print(f"[Error] Render failed: {e}")
-                # 兜底回复，防止因为渲染失败导致整个流程断掉
-                reply = "✅ **计划已生成！** \n\n(注：由于方案过长，AI 总结文本渲染超时，但不影响计划数据的完整性。请直接确认下方详情。)"
-        
-        # 3. 结果校验与状态流转
-        decision = state.get("decision", {})
-        has_final_plan = decision.get("final_plan")
-        has_draft = state.get("draft_plan")
-        has_response = decision.get("response") # 模型生成的回复（可能是追问，也可能是闲聊）
-        
-        # === 修复逻辑 ===
-        # Case A: 成功生成了计划
-        if has_final_plan or has_draft:
-            if not reply:
-                reply = "✅ 计划已就绪，请查阅。"
-            
-            st.session_state.pending_plan = {
-                "state": state,
-                "trace": list(trace),
-                "text": reply,
-                "task_frame": state.get("task_frame", {})
-            }
-            st.rerun()
-            
-        # Case B: 没有计划，但是有回复 (说明触发了追问/拦截逻辑)
-        elif has_response:
-            # 直接显示模型的追问（比如“请问您有什么器械？”），不报错
-            st.session_state.messages.append({"role": "assistant", "content": has_response})
-            with st.chat_message("assistant"):
-                st.markdown(has_response)
-                
-        # Case C: 既没计划也没回复 (真正的失败)
-        else:
-            st.error("😓 生成失败：模型未能产出有效的计划结构。")
-            with st.expander("查看调试详情"):
-                st.write("Decision:", decision)
-                st.write("Draft:", has_draft)
-
-    # app.py
-
-    elif route_name == "log_update":
-        with st.spinner("正在分析饮食记录..."):
-            # ★★★ 修改：传入 chat_history ★★★
-            state = subflow_log_update(
-                state, 
-                trace, 
-                chat_history=st.session_state.messages
-            )
-        
-        # Case A: 成功写入 (有 graph 更新)
-        if "user_memory_graph_updated" in state:
-            updated = state["user_memory_graph_updated"]
-            st.session_state.user_memory_graph = updated
-            save_graph(PATH_USER, updated)
-            
-            # 获取 DietLogger 生成的反馈语
-            feedback = state.get("decision", {}).get("response", "已记录。")
-            
-            # 1. 弹窗提示
-            st.toast(f"✅ {feedback}")
-            
-            # 2. 写入聊天历史 (这样刷新后还在)
-            st.session_state.messages.append({"role": "assistant", "content": feedback})
-            
-            # 3. 稍作停顿后刷新，让 Tab 里的记录更新
-            time.sleep(1.5)
-            st.rerun()
-            
-        # Case B: 需要追问 (没有 graph 更新，但有 decision.response)
-        elif state.get("decision", {}).get("response"):
-            # 这是一个追问，直接显示给用户
-            # 代码会走到下面的 "if route_name not in ..." 块去渲染 response，所以这里不用做特殊处理
-            pass
-
-    # === Final Reply Render (Non-Plan) ===
-    if route_name not in ("plan_workout", "plan_diet", "plan_both"):
-        with st.spinner("生成回复..."):
-            reply = render_response(route_name, state, state.get("memory_summary", {}))
-        st.session_state.messages.append({"role": "assistant", "content": reply})
-        with col_chat:
-            with st.chat_message("assistant"):
-                st.markdown(reply)
\ No newline at end of file
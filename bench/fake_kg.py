@@ -0,0 +1,221 @@
+# bench/fake_kg.py
+"""In-memory stand-ins for ExerciseKGQuery / DietKGQuery.
+
+They return rows with the same keys and value shapes as the Cypher queries
+in tools/*/query.py, so the recommenders run unchanged without Neo4j.
+"""
+import ast
+import csv
+import json
+import os
+import sys
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXRX_SRC = os.path.join(ROOT, "data", "ExerciseKG", "src")
+EXRX_JSON = os.path.join(ROOT, "data", "ExerciseKG", "data", "exrx_full_dataset.json")
+RECIPES_CSV = os.path.join(ROOT, "bench", "fixtures", "recipes_sample.csv")
+
+if EXRX_SRC not in sys.path:
+    sys.path.insert(0, EXRX_SRC)
+from dataset_io import iter_records, make_exercise_id  # noqa: E402
+from tools.exercise_tools.equipment import equipment_mask, feasible_masks  # noqa: E402
+
+
+def _muscles(item: Dict[str, Any], key: str) -> List[str]:
+    values = item.get("Muscles", {}).get(key, []) or []
+    # 与 exercise_kg.py 一致：["None"] 不建关系
+    return [] if values == ["None"] else list(values)
+
+
+class InMemoryExerciseKG:
+    def __init__(self, json_file: str = EXRX_JSON):
+        self.by_body_part = defaultdict(list)
+        for item in iter_records(json_file):
+            ev = {
+                "id": make_exercise_id(item),
+                "name": item["exercise_name"],
+                "url": item.get("exercise_url"),
+                "instructions": item.get("Instructions"),
+                "utility": item.get("Utility"),
+                "mechanics": item.get("Mechanics"),
+                "force": item.get("Force"),
+                "body_part": item["body_part"],
+                "equipment": [item["training_type"]],
+                "equipment_mask": equipment_mask([item["training_type"]]),
+                "target_muscles": _muscles(item, "Target"),
+                "synergist_muscles": _muscles(item, "Synergists"),
+                "stabilizer_muscles": _muscles(item, "Stabilizers"),
+                "instruction_body_parts": item.get("Instruction_BodyPart", []) or [],
+            }
+            self.by_body_part[item["body_part"]].append(ev)
+
+    def close(self):
+        pass
+
+    def fetch_all_training_body_parts(self):
+        return sorted(self.by_body_part)
+
+    def fetch_instruction_body_parts(self, target_body_part):
+        return [{"id": ev["id"], "body_parts": ev["instruction_body_parts"]}
+                for ev in self.by_body_part.get(target_body_part, [])]
+
+    def fetch_candidates(self, target_body_part, injury_body_part, available_equipment,
+                         equipment_mask=None):
+        injuries = set(injury_body_part or [])
+        allowed = None if equipment_mask is None else set(feasible_masks(equipment_mask))
+        keys = ("id", "name", "url", "instructions", "utility", "mechanics", "force",
+                "equipment_mask", "equipment",
+                "target_muscles", "synergist_muscles", "stabilizer_muscles")
+        return [
+            {k: ev[k] for k in keys}
+            for ev in self.by_body_part.get(target_body_part, [])
+            if not injuries.intersection(ev["instruction_body_parts"])
+            and (allowed is None or ev["equipment_mask"] in allowed)
+        ]
+
+    def search_exercises(self, target_part, exercise_text=None, excludes=None, limit=5):
+        if not target_part:
+            return []
+        part = str(target_part).lower()
+        kw = (exercise_text or "").lower()
+        excludes = [e.lower() for e in (excludes or [])]
+
+        out = []
+        for bp, evs in self.by_body_part.items():
+            if bp.lower() != part:
+                continue
+            for ev in evs:
+                name = ev["name"].lower()
+                if kw and kw not in name:
+                    continue
+                if any(e in name for e in excludes):
+                    continue
+                out.append({
+                    "id": ev["id"],
+                    "name": ev["name"],
+                    "instructions": ev["instructions"],
+                    "utility": ev["utility"],
+                    "mechanics": ev["mechanics"],
+                    "body_part": bp,
+                    "target_muscles": ev["target_muscles"],
+                })
+                if len(out) >= limit:
+                    return out
+        return out
+
+
+def _parse(x: str, default):
+    try:
+        return json.loads(x)
+    except Exception:
+        try:
+            return ast.literal_eval(x)
+        except Exception:
+            return default
+
+
+class InMemoryDietKG:
+    def __init__(self, csv_file: str = RECIPES_CSV):
+        self.recipes = []
+        with open(csv_file, "r", encoding="utf-8-sig") as f:
+            for row in csv.DictReader(f):
+                nutrients = _parse(row["total_nutrients"], {})
+                daily_values = _parse(row["daily_values"], {})
+                self.recipes.append({
+                    "recipe_id": row["label"],
+                    "recipe_name": row["recipe_name"],
+                    "servings": float(row["servings"]),
+                    "calories": float(row["calories"]),
+                    # Neo4j 中这些字段以 str(list) 存储，保持一致
+                    "cuisine_type": row["cuisine_type"],
+                    "meal_type": row["meal_type"],
+                    "dish_type": row["dish_type"],
+                    "diet_labels": row["diet_labels"],
+                    "health_labels": row["health_labels"],
+                    "cautions": row["cautions"],
+                    "ingredients": [
+                        {
+                            "name": i.get("food"),
+                            "quantity": i.get("quantity"),
+                            "measure": i.get("measure"),
+                            "weight": i.get("weight"),
+                            "text": i.get("text"),
+                        }
+                        for i in _parse(row["ingredients"], [])
+                    ],
+                    "nutrients": [
+                        {"name": k, "label": v.get("label"), "unit": v.get("unit"), "quantity": v.get("quantity")}
+                        for k, v in nutrients.items()
+                    ],
+                    "daily_values": [
+                        {"name": k, "label": v.get("label"), "unit": v.get("unit"), "quantity": v.get("quantity")}
+                        for k, v in daily_values.items()
+                    ],
+                })
+
+    def close(self):
+        pass
+
+    def _match(self, r, meal_type, dish_types, diet_labels, forbidden_cautions) -> bool:
+        return (
+            meal_type in r["meal_type"]
+            and any(dt in r["dish_type"] for dt in dish_types)
+            and all(dl in r["diet_labels"] for dl in diet_labels)
+            and not any(fc in r["cautions"] for fc in forbidden_cautions)
+        )
+
+    def fetch_candidates(self, meal_type, dish_types, diet_labels, health_labels, forbidden_cautions):
+        keys = ("recipe_id", "recipe_name", "calories", "servings", "cuisine_type",
+                "meal_type", "dish_type", "diet_labels", "health_labels")
+        return [
+            {k: r[k] for k in keys}
+            for r in self.recipes
+            if self._match(r, meal_type, dish_types, diet_labels, forbidden_cautions)
+        ]
+
+    def fetch_candidates_with_detail(self, meal_type, dish_types, diet_labels, health_labels,
+                                     forbidden_cautions, limit=50):
+        keys = ("recipe_id", "recipe_name", "servings", "calories", "cuisine_type", "meal_type",
+                "dish_type", "diet_labels", "health_labels", "cautions",
+                "ingredients", "nutrients", "daily_values")
+        out = [
+            {k: r[k] for k in keys}
+            for r in self.recipes
+            if self._match(r, meal_type, dish_types, diet_labels, forbidden_cautions)
+        ]
+        return out[:limit]
+
+    def fetch_all_recipes_with_detail(self):
+        return self.fetch_candidates_with_detail("", [""], [], [], [], limit=len(self.recipes))
+
+    def get_recipe_full_detail_by_name(self, recipe_name: str) -> Optional[Dict[str, Any]]:
+        for r in self.recipes:
+            if r["recipe_name"] == recipe_name:
+                recipe = dict(r)
+                recipe["label"] = recipe.pop("recipe_id")
+                recipe["name"] = recipe.pop("recipe_name")
+                return recipe
+        return None
+
+    def search_items(self, keyword: str, limit: int = 5) -> List[Dict[str, Any]]:
+        kw = (keyword or "").strip().lower()
+        if not kw:
+            return []
+        hits = sorted((r for r in self.recipes if kw in r["recipe_name"].lower()),
+                      key=lambda r: len(r["recipe_name"]))
+        return [
+            {
+                "id": r["recipe_id"],
+                "name": r["recipe_name"],
+                "calories": r["calories"],
+                "servings": r["servings"],
+                "meal_type": r["meal_type"],
+                "diet_labels": r["diet_labels"],
+                "score": None,
+                "type": "Recipe",
+                "cal": round(r["calories"] / max(r["servings"] or 1, 1), 1),
+            }
+            for r in hits[:limit]
+        ]
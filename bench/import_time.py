@@ -0,0 +1,119 @@
+# bench/import_time.py
+"""Cold-start import benchmark based on ``python -X importtime``.
+
+Each target is imported in a fresh interpreter (several runs, median of the
+cumulative time). The check fails when a target exceeds its budget or pulls
+in a module that must stay lazy (neo4j / openai / numpy / pandas / streamlit
+are only loaded on first use).
+
+    python -m bench.import_time
+    python -m bench.import_time --runs 9 --json import_time.json
+    python -m bench.import_time --budget agents.pipeline=150
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# target -> 预算（ms，中位数）
+BUDGETS_MS = {
+    "agents.pipeline": 250.0,   # streamlit 页面 / server worker 的编排层
+    "server": 300.0,            # headless 入口（含 configure / metrics）
+    "core.llm": 120.0,
+    "memory.repository": 60.0,
+}
+
+# import 阶段不应加载的重模块（第一次用到时才 import）
+LAZY_MODULES = ("neo4j", "openai", "numpy", "pandas", "streamlit")
+
+
+def _parse(stderr: str) -> Tuple[Dict[str, int], List[str]]:
+    """返回 ({顶层模块: 累计 us}, 全部加载的模块名)"""
+    top: Dict[str, int] = {}
+    modules: List[str] = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        try:
+            _, cumulative, name = line[len("import time:"):].split("|", 2)
+            cumulative_us = int(cumulative.strip())
+        except ValueError:
+            continue  # 表头
+        stripped = name.strip()
+        modules.append(stripped)
+        if name.startswith(" ") and not name.startswith("  "):
+            top[stripped] = cumulative_us
+    return top, modules
+
+
+def measure(target: str, runs: int) -> Dict[str, object]:
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="0")
+    samples: List[float] = []
+    modules: List[str] = []
+    for i in range(runs + 1):
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {target}"],
+            cwd=ROOT, env=env, capture_output=True, text=True,
+        )
+        if proc.returncode != 0:
+            raise RuntimeError(f"import {target} failed:\n{proc.stderr[-2000:]}")
+        top, modules = _parse(proc.stderr)
+        if i == 0:
+            continue  # 第一轮可能在编译 .pyc，不计入
+        samples.append(top.get(target, 0) / 1000.0)
+
+    lazy_hits = sorted({m.split(".")[0] for m in modules if m.split(".")[0] in LAZY_MODULES})
+    return {
+        "median_ms": round(statistics.median(samples), 1),
+        "min_ms": round(min(samples), 1),
+        "max_ms": round(max(samples), 1),
+        "modules": len(modules),
+        "eager_heavy": lazy_hits,
+    }
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description="Cold-start import time budget check")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--targets", nargs="*", default=list(BUDGETS_MS))
+    parser.add_argument("--budget", action="append", default=[], metavar="MODULE=MS",
+                        help="覆盖某个 target 的预算")
+    parser.add_argument("--json", dest="json_out", default=None)
+    args = parser.parse_args(argv)
+
+    budgets = dict(BUDGETS_MS)
+    for item in args.budget:
+        name, _, ms = item.partition("=")
+        budgets[name] = float(ms)
+
+    results = {}
+    failed = False
+    header = f"{'target':<22}{'median ms':>11}{'min':>9}{'max':>9}{'budget':>9}{'mods':>7}  eager heavy imports"
+    print(header)
+    print("-" * len(header))
+    for target in args.targets:
+        r = measure(target, args.runs)
+        budget = budgets.get(target)
+        over = budget is not None and r["median_ms"] > budget
+        failed = failed or over or bool(r["eager_heavy"])
+        r["budget_ms"] = budget
+        results[target] = r
+        flag = " ✗" if over else ""
+        print(f"{target:<22}{r['median_ms']:>11.1f}{r['min_ms']:>9.1f}{r['max_ms']:>9.1f}"
+              f"{budget if budget is not None else '-':>9}{r['modules']:>7}  {', '.join(r['eager_heavy']) or '-'}{flag}")
+
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+    print("FAIL" if failed else "OK")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+# bench/json_stream.py
+"""Round-trip check for the streaming JSON-array reader in dataset_io.
+
+Every sample is serialized, then read back with ``iter_json_array`` at each
+chunk size from 1 to the document length (+1). Values that end exactly on a
+chunk boundary (``3.25`` split as ``3.`` / ``25``, ``1e5`` as ``1e`` / ``5``)
+must come back intact, and malformed input must still raise.
+
+    python -m bench.json_stream
+    python -m bench.json_stream --dataset      # also the full exrx dataset, a few chunk sizes
+"""
+import argparse
+import io
+import json
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXRX_SRC = os.path.join(ROOT, "data", "ExerciseKG", "src")
+EXRX_JSON = os.path.join(ROOT, "data", "ExerciseKG", "data", "exrx_full_dataset.json")
+
+if EXRX_SRC not in sys.path:
+    sys.path.insert(0, EXRX_SRC)
+from dataset_io import iter_json_array, iter_records  # noqa: E402
+
+SAMPLES = [
+    [{"w": 12.5}, 3.25, 1e5],
+    [],
+    [0, -1, 1.5e-3, -2.25E+10, 12345678901234567890, 0.0],
+    [True, False, None, "x", ""],
+    [{"a": [1, [2, [3]]], "b": {"c": None}}, [], {}],
+    ["逗号,和]括号", "esc \" \\ \n é", "😀"],
+    [{"Target": ["Pectoralis  Major, Clavicular"], "n": 3}, 7],
+]
+
+MALFORMED = ['[1 2]', '[1,', '[1e]', '{"a": 1}', '[3.]']
+
+
+def _roundtrip(text: str, expected, max_chunk: int) -> list:
+    """返回解析结果不一致的 chunk_size 列表"""
+    bad = []
+    for chunk in range(1, max_chunk + 1):
+        try:
+            got = list(iter_json_array(io.StringIO(text), chunk_size=chunk))
+        except ValueError:
+            got = None
+        if got != expected:
+            bad.append(chunk)
+    return bad
+
+
+def _raises(text: str, max_chunk: int) -> list:
+    """返回没有报错的 chunk_size 列表"""
+    ok = []
+    for chunk in range(1, max_chunk + 1):
+        try:
+            list(iter_json_array(io.StringIO(text), chunk_size=chunk))
+            ok.append(chunk)
+        except ValueError:
+            pass
+    return ok
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dataset", action="store_true", help="also round-trip the exrx dataset")
+    args = parser.parse_args(argv)
+
+    failed = False
+    for sample in SAMPLES:
+        for text in (json.dumps(sample), json.dumps(sample, indent=2, ensure_ascii=False)):
+            bad = _roundtrip(text, sample, len(text) + 1)
+            failed = failed or bool(bad)
+            print(f"{'✗' if bad else 'ok'}  {text[:40]!r:<46} bad chunk sizes: {bad[:10] or '-'}")
+
+    for text in MALFORMED:
+        accepted = _raises(text, len(text) + 1)
+        failed = failed or bool(accepted)
+        print(f"{'✗' if accepted else 'ok'}  malformed {text!r:<36} accepted at: {accepted[:10] or '-'}")
+
+    if args.dataset:
+        expected = list(iter_records(EXRX_JSON))
+        with open(EXRX_JSON, encoding="utf-8") as f:
+            text = f.read()
+        for chunk in (1, 7, 64, 4096, 1 << 16):
+            same = list(iter_json_array(io.StringIO(text), chunk_size=chunk)) == expected
+            failed = failed or not same
+            print(f"{'ok' if same else '✗'}  dataset chunk_size={chunk}")
+
+    print("FAIL" if failed else "OK")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,57 @@
+# bench/mock_llm.py
+"""Deterministic replacement for core.llm.chat.
+
+Outputs are replayed from a recordings file: structured agents are looked
+up by their response_format json_schema name, raw chat() calls by a
+substring of the system instruction, everything else gets default_text.
+"""
+import json
+import os
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, Optional
+
+RECORDINGS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "llm_recordings.json")
+
+
+class MockLLM:
+    def __init__(self, recordings_path: str = RECORDINGS, latency_ms: float = 0.0,
+                 latency_by_call: Optional[Dict[str, float]] = None):
+        with open(recordings_path, "r", encoding="utf-8") as f:
+            rec = json.load(f)
+        self.by_schema: Dict[str, Any] = rec.get("by_schema", {})
+        self.by_instruction = rec.get("by_instruction", [])
+        self.default_text: str = rec.get("default_text", "")
+        self.latency_ms = latency_ms
+        self.latency_by_call = latency_by_call or {}
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    def override(self, name: str, output: Any) -> None:
+        """替换某个 schema 的录制输出（例如按场景固定 Router 的 route）"""
+        self.by_schema[name] = output
+
+    def reset_counts(self) -> None:
+        with self._lock:
+            self.calls.clear()
+
+    def _resolve(self, instruction: str, response_format: Optional[dict]):
+        schema = ((response_format or {}).get("json_schema") or {}).get("name")
+        if schema and schema in self.by_schema:
+            return schema, self.by_schema[schema]
+        for entry in self.by_instruction:
+            if entry["match"] in (instruction or ""):
+                return entry["match"], entry["output"]
+        return "text", self.default_text
+
+    def chat(self, instruction, user_message, model="gpt-4.1", response_format=None):
+        name, output = self._resolve(instruction, response_format)
+        with self._lock:
+            self.calls[name] += 1
+        delay = self.latency_by_call.get(name, self.latency_ms)
+        if delay:
+            time.sleep(delay / 1000.0)
+        if isinstance(output, str):
+            return output
+        return json.dumps(output, ensure_ascii=False)
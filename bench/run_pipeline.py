@@ -0,0 +1,230 @@
+# bench/run_pipeline.py
+"""End-to-end pipeline benchmark: route -> subflow_* -> render_response.
+
+Runs fully offline: every chat() call is served by MockLLM and both KGs are
+replaced with the in-memory fakes from bench/fake_kg.py.
+
+    python -m bench.run_pipeline --iterations 20 --latency-ms 50
+    python -m bench.run_pipeline --routes plan_both log_update --json bench_output.json
+    python -m bench.run_pipeline --tables      # 先从 fake KG 物化候选表，推荐走表
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+from typing import Any, Callable, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from bench.fake_kg import InMemoryDietKG, InMemoryExerciseKG  # noqa: E402
+from bench.mock_llm import MockLLM  # noqa: E402
+
+USER_GRAPH = os.path.join(ROOT, "data", "user_memory_graph.json")
+
+SCENARIOS = {
+    "faq_exercise": "有什么练胸的动作推荐？不要杠铃的",
+    "faq_food": "番茄炒蛋的热量是多少？",
+    "query_memory": "我上周都练了什么？",
+    "plan_workout": "帮我制定一个每周三练的哑铃训练计划",
+    "plan_diet": "帮我制定一个减脂饮食计划",
+    "plan_both": "帮我做一个训练加饮食的综合方案，我有哑铃",
+    "log_update": "中午吃了宫保鸡丁和一碗米饭，下午做了哑铃弯举",
+}
+
+PLAN_ROUTES = ("plan_workout", "plan_diet", "plan_both")
+
+
+def install_fakes(llm: MockLLM, ex_kg: InMemoryExerciseKG, diet_kg: InMemoryDietKG) -> None:
+    """把 chat() 和两个 KG 客户端替换成离线实现（模块级名字都要替换）"""
+    # core.config 在 bare mode 下读 st.session_state 会刷 "missing ScriptRunContext" 警告，
+    # 取 KG 客户端时都会读，所以要在下面的 import 之前调低级别
+    # （config 是惰性解析的，解析完会按 logger.level 重置，所以先触发解析）
+    import streamlit.config
+    import streamlit.logger
+    streamlit.config.get_option("logger.level")
+    streamlit.logger.set_log_level("error")
+
+    import core.llm
+    import core.resources
+    import agents.runner
+    import agents.subflows
+    import agents.response_generator
+    import tools.exercise_recommender
+    import tools.exercise_tools.query
+    import tools.diet_tools.query
+
+    for mod in (core.llm, agents.runner, agents.subflows, agents.response_generator):
+        mod.chat = llm.chat
+
+    # tools.kg_clients 经模块属性构造客户端，替换构造函数后清掉已缓存的真实 driver
+    tools.exercise_tools.query.ExerciseKGQuery = lambda *a, **k: ex_kg
+    tools.diet_tools.query.DietKGQuery = lambda *a, **k: diet_kg
+    core.resources.invalidate("kg.")
+
+
+def _stages(route_name: str, user_text: str, graph: Dict[str, Any]) -> List[tuple]:
+    """与 app.py 的分发逻辑一致，拆成可单独计时的阶段"""
+    from agents.router import route
+    from agents.subflows import (
+        ensure_pipeline_state,
+        subflow_faq_exercise, subflow_faq_food, subflow_query_memory,
+        subflow_log_update, subflow_plan_full, subflow_commit_plan,
+    )
+    from agents.response_generator import render_response
+
+    trace: list = []
+    messages = [{"role": "user", "content": user_text}]
+    ctx: Dict[str, Any] = {}
+
+    def _route():
+        route(user_text, messages, graph, trace)
+        ctx["state"] = ensure_pipeline_state(user_text, graph)
+
+    def _subflow():
+        state = ctx["state"]
+        if route_name == "faq_exercise":
+            state = subflow_faq_exercise(state, {})
+        elif route_name == "faq_food":
+            state = subflow_faq_food(state, {})
+        elif route_name == "query_memory":
+            state = subflow_query_memory(state, trace)
+        elif route_name in PLAN_ROUTES:
+            state = subflow_plan_full(state, trace, {}, {}, route_name=route_name, chat_history=messages)
+        elif route_name == "log_update":
+            state = subflow_log_update(state, trace, chat_history=messages)
+        ctx["state"] = state
+
+    def _render():
+        state = ctx["state"]
+        render_response(route_name, state, state.get("memory_summary", {}))
+
+    def _commit():
+        state = ctx["state"]
+        subflow_commit_plan(state, trace, "bench plan", task_frame=state.get("task_frame", {}))
+
+    stages = [("route", _route), ("subflow", _subflow), ("render", _render)]
+    if route_name in PLAN_ROUTES:
+        stages.append(("commit", _commit))
+    return stages
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[k]
+
+
+def _run_stage(fn: Callable[[], None], verbose: bool):
+    if verbose:
+        fn()
+        return
+    with contextlib.redirect_stdout(io.StringIO()):
+        fn()
+
+
+def bench_route(route_name: str, llm: MockLLM, graph: Dict[str, Any], iterations: int,
+                trace_alloc: bool, verbose: bool) -> Dict[str, Any]:
+    llm.override("router", {
+        "route": route_name, "need_clarify": False, "clarify_questions": [],
+        "confidence": 0.9, "notes": "bench",
+    })
+
+    timings = defaultdict(list)
+    llm_calls = defaultdict(int)
+
+    for i in range(iterations):
+        random.seed(i)
+        for stage, fn in _stages(route_name, SCENARIOS[route_name], graph):
+            llm.reset_counts()
+            t0 = time.perf_counter()
+            _run_stage(fn, verbose)
+            timings[stage].append((time.perf_counter() - t0) * 1000)
+            llm_calls[stage] += sum(llm.calls.values())
+
+    # 分配统计单独跑一轮，避免 tracemalloc 的开销污染耗时
+    alloc = {}
+    if trace_alloc:
+        random.seed(0)
+        for stage, fn in _stages(route_name, SCENARIOS[route_name], graph):
+            tracemalloc.start()
+            _run_stage(fn, verbose)
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            alloc[stage] = {"peak_kb": round(peak / 1024, 1), "retained_kb": round(current / 1024, 1)}
+
+    return {
+        stage: {
+            "p50_ms": round(_percentile(vals, 50), 2),
+            "p95_ms": round(_percentile(vals, 95), 2),
+            "llm_calls_per_turn": round(llm_calls[stage] / iterations, 2),
+            **alloc.get(stage, {}),
+        }
+        for stage, vals in timings.items()
+    }
+
+
+def print_report(results: Dict[str, Dict[str, Any]]) -> None:
+    header = f"{'route':<14}{'stage':<9}{'p50 ms':>10}{'p95 ms':>10}{'llm':>6}{'peak KB':>11}{'kept KB':>10}"
+    print(header)
+    print("-" * len(header))
+    for route_name, stages in results.items():
+        for stage, m in stages.items():
+            print(
+                f"{route_name:<14}{stage:<9}{m['p50_ms']:>10.2f}{m['p95_ms']:>10.2f}"
+                f"{m['llm_calls_per_turn']:>6.1f}{m.get('peak_kb', 0):>11.1f}{m.get('retained_kb', 0):>10.1f}"
+            )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline end-to-end pipeline benchmark")
+    parser.add_argument("--routes", nargs="*", default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="每次 mock LLM 调用的固定延迟")
+    parser.add_argument("--recordings", default=None, help="替换 bench/fixtures/llm_recordings.json")
+    parser.add_argument("--no-alloc", action="store_true", help="跳过 tracemalloc 分配统计")
+    parser.add_argument("--json", dest="json_out", default=None, help="结果另存为 JSON")
+    parser.add_argument("--verbose", action="store_true", help="保留 pipeline 内部的 print 输出")
+    parser.add_argument("--tables", action="store_true",
+                        help="从 fake KG 构建候选物化表（tools/candidate_tables.py）后再跑")
+    args = parser.parse_args(argv)
+
+    from memory.persistence import load_graph
+    from memory.graph_store import new_graph
+
+    llm = MockLLM(**({"recordings_path": args.recordings} if args.recordings else {}), latency_ms=args.latency_ms)
+    ex_kg, diet_kg = InMemoryExerciseKG(), InMemoryDietKG()
+    install_fakes(llm, ex_kg, diet_kg)
+    if args.tables:
+        import tempfile
+        from tools.candidate_tables import build_tables
+        os.environ["CANDIDATE_TABLES_DIR"] = tempfile.mkdtemp(prefix="healthkg_tables_")
+        build_tables(os.environ["CANDIDATE_TABLES_DIR"], exercise_kg=ex_kg, diet_kg=diet_kg)
+    else:
+        # 不受本地 data/materialized 影响，默认测 KG 查询路径
+        os.environ["CANDIDATE_TABLES_DIR"] = "off"
+    graph = load_graph(USER_GRAPH, new_graph())
+
+    results = {
+        r: bench_route(r, llm, graph, args.iterations, not args.no_alloc, args.verbose)
+        for r in args.routes
+    }
+
+    print_report(results)
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -1,41 +1,81 @@
 # core/config.py
 import os
-import streamlit as st
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
 
 DEFAULT_BASE_URL = "https://api.ai-gaochao.cn/v1"
 DEFAULT_MODEL = "gpt-5"
 
+# ============================================================
+# 配置来源（按优先级）：
+#   1️⃣ use_cfg() 绑定到当前上下文的配置（Pipeline 每次请求注入）
+#   2️⃣ configure() 设置的进程级配置（headless 服务启动时注入）
+#   3️⃣ streamlit session_state（设置页可修改，首次从环境变量初始化）
+# streamlit 只在走到 3️⃣ 时才 import，headless 服务完全不加载它
+# ============================================================
+_cfg_var: ContextVar[Optional[dict]] = ContextVar("healthkg_cfg", default=None)
+_process_cfg: Optional[dict] = None
+
+
+def load_cfg_from_env() -> dict:
+    # LLM Config
+    api_key = os.getenv("OPENAI_API_KEY", "")
+    base_url = os.getenv("OPENAI_BASE_URL", DEFAULT_BASE_URL)
+    model = os.getenv("OPENAI_MODEL", DEFAULT_MODEL)
+
+    # === 1. 运动图谱配置 (Exercise KG) ===
+    ex_uri = os.environ.get("NEO4J_URI", "exercise neo4j url")
+    ex_user = os.environ.get("NEO4J_USER", "neo4j")
+    ex_pass = os.environ.get("NEO4J_PASSWORD", "password")
+
+    # === 2. 饮食图谱配置 (Diet KG) ===
+    diet_uri = os.environ.get("DIET_NEO4J_URI", "diet neo4j url")
+    diet_user = os.environ.get("DIET_NEO4J_USER", "neo4j")
+    diet_pass = os.environ.get("DIET_NEO4J_PASSWORD", "password")
+
+    return {
+        "api_key": api_key,
+        "base_url": base_url,
+        "model": model,
+
+        # 运动图谱 (默认)
+        "neo4j_uri": ex_uri,
+        "neo4j_user": ex_user,
+        "neo4j_password": ex_pass,
+
+        # 饮食图谱 (专用)
+        "diet_neo4j_uri": diet_uri,
+        "diet_neo4j_user": diet_user,
+        "diet_neo4j_password": diet_pass,
+    }
+
+
+def configure(cfg: Optional[dict]) -> None:
+    """进程级注入（不依赖 streamlit）；传 None 取消"""
+    global _process_cfg
+    _process_cfg = cfg
+
+
+@contextmanager
+def use_cfg(cfg: Optional[dict]):
+    """块内（含 contextvars 传递到的后台任务）get_cfg() 返回 cfg"""
+    token = _cfg_var.set(cfg)
+    try:
+        yield cfg
+    finally:
+        _cfg_var.reset(token)
+
+
 def get_cfg() -> dict:
+    cfg = _cfg_var.get()
+    if cfg is not None:
+        return cfg
+    if _process_cfg is not None:
+        return _process_cfg
+
+    import streamlit as st
+
     if "cfg" not in st.session_state:
-        # LLM Config
-        api_key = os.getenv("OPENAI_API_KEY", "")
-        base_url = os.getenv("OPENAI_BASE_URL", DEFAULT_BASE_URL)
-        model = os.getenv("OPENAI_MODEL", DEFAULT_MODEL)
-
-        # === 1. 运动图谱配置 (Exercise KG) ===
-        ex_uri = os.environ.get("NEO4J_URI", "exercise neo4j url")
-        ex_user = os.environ.get("NEO4J_USER", "neo4j")
-        ex_pass = os.environ.get("NEO4J_PASSWORD", "password")
-
-        # === 2. 饮食图谱配置 (Diet KG) ===
-        diet_uri = os.environ.get("DIET_NEO4J_URI", "diet neo4j url")
-        diet_user = os.environ.get("DIET_NEO4J_USER", "neo4j")
-        diet_pass = os.environ.get("DIET_NEO4J_PASSWORD", "password")
-
-        st.session_state.cfg = {
-            "api_key": api_key,
-            "base_url": base_url,
-            "model": model,
-            
-            # 运动图谱 (默认)
-            "neo4j_uri": ex_uri,
-            "neo4j_user": ex_user,
-            "neo4j_password": ex_pass,
-            
-            # 饮食图谱 (专用)
-            "diet_neo4j_uri": diet_uri,
-            "diet_neo4j_user": diet_user,
-            "diet_neo4j_password": diet_pass,
-        }
-
-    return st.session_state.cfg
\ No newline at end of file
+        st.session_state.cfg = load_cfg_from_env()
+    return st.session_state.cfg
@@ -0,0 +1,236 @@
+# core/gateway.py
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from core.metrics import record_llm_coalesced, record_llm_queue_wait
+
+# ============================================================
+# LLM Gateway
+#
+# 进程内所有 chat() 都经过这里（streamlit 多个 session 是同一进程的不同线程）：
+#   1️⃣ singleflight：同一时刻完全相同的请求（账号 + model + prompt + response_format）只发一次
+#      账号 = (api_key, base_url) 的摘要：不同用户的 key / 端点不共享结果
+#   2️⃣ 每个 model 一个并发上限（每次尝试单独占位，重试前的 backoff 不占并发）
+#   3️⃣ 每个 model 一个 token-per-minute 预算（令牌桶，按估算预扣，返回后按实际用量校正）
+#   4️⃣ 排队时 interactive 优先于 background（后台记忆更新用 background() 包起来）
+# ============================================================
+
+MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+TPM_LIMIT = int(os.getenv("LLM_TPM", "0"))              # 0 = 不限
+COMPLETION_TOKENS_ESTIMATE = 512
+ADMIT_POLL_S = 0.25                                     # 等预算回填时的轮询间隔
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BACKGROUND: "background"}
+
+_priority_var: ContextVar[int] = ContextVar("llm_priority", default=PRIORITY_INTERACTIVE)
+
+
+@contextmanager
+def background():
+    """块内的 chat() 以低优先级排队（记忆更新等不阻塞回复的任务）"""
+    token = _priority_var.set(PRIORITY_BACKGROUND)
+    try:
+        yield
+    finally:
+        _priority_var.reset(token)
+
+
+def estimate_tokens(*texts: str) -> int:
+    # 中英混合文本粗估：约 3 字符 / token，再加上补全的预估
+    return sum(len(t or "") for t in texts) // 3 + COMPLETION_TOKENS_ESTIMATE
+
+
+def account_key(api_key: str, base_url: str) -> str:
+    """凭据 + 端点的摘要（不把明文 key 留在 in-flight 表里）"""
+    return hashlib.sha256(f"{api_key}\x00{base_url}".encode("utf-8")).hexdigest()[:16]
+
+
+def request_key(account: str, model: str, instruction: str, user_message: str,
+                response_format: Optional[dict]) -> str:
+    payload = json.dumps([account, model, instruction, user_message, response_format],
+                         ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+# ============================================================
+# Per-model lane：并发 + TPM + 优先级
+# ============================================================
+class ModelLane:
+    def __init__(self, max_concurrency: int = MAX_CONCURRENCY, tpm: int = TPM_LIMIT):
+        self.max_concurrency = max_concurrency
+        self.tpm = tpm
+        self.active = 0
+        self.tokens = float(tpm)
+        self.updated = time.monotonic()
+        self._cond = threading.Condition()
+        self._waiters = []            # heap of (priority, seq)
+        self._seq = itertools.count()
+
+    def _refill(self) -> None:
+        if not self.tpm:
+            return
+        now = time.monotonic()
+        self.tokens = min(self.tpm, self.tokens + (now - self.updated) * self.tpm / 60.0)
+        self.updated = now
+
+    def _can_admit(self, ticket, est: int) -> bool:
+        if self._waiters[0] != ticket or self.active >= self.max_concurrency:
+            return False
+        if not self.tpm:
+            return True
+        self._refill()
+        # 单个请求估算超过整桶时，只要桶是满的就放行，避免永远饿死
+        return self.tokens >= min(est, self.tpm)
+
+    def acquire(self, priority: int, est: int) -> None:
+        with self._cond:
+            ticket = (priority, next(self._seq))
+            heapq.heappush(self._waiters, ticket)
+            try:
+                while not self._can_admit(ticket, est):
+                    self._cond.wait(ADMIT_POLL_S if self.tpm else None)
+            except BaseException:
+                self._waiters.remove(ticket)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+                raise
+            heapq.heappop(self._waiters)
+            self.active += 1
+            if self.tpm:
+                self.tokens -= est
+            self._cond.notify_all()
+
+    def try_acquire(self, est: int) -> bool:
+        """不排队：有空位、没人在等、TPM 够时立即占上，否则返回 False"""
+        with self._cond:
+            if self._waiters or self.active >= self.max_concurrency:
+                return False
+            if self.tpm:
+                self._refill()
+                if self.tokens < min(est, self.tpm):
+                    return False
+                self.tokens -= est
+            self.active += 1
+            return True
+
+    def release(self, est: int, actual: Optional[int]) -> None:
+        with self._cond:
+            self.active -= 1
+            if self.tpm and actual is not None:
+                self._refill()
+                self.tokens = min(self.tpm, self.tokens + est - actual)
+            self._cond.notify_all()
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+# ============================================================
+# Gateway
+# ============================================================
+class LLMGateway:
+    def __init__(self, max_concurrency: int = MAX_CONCURRENCY, tpm: int = TPM_LIMIT):
+        self.max_concurrency = max_concurrency
+        self.tpm = tpm
+        self._lanes: Dict[str, ModelLane] = {}
+        self._flights: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+
+    def lane(self, model: str) -> ModelLane:
+        with self._lock:
+            lane = self._lanes.get(model)
+            if lane is None:
+                lane = self._lanes[model] = ModelLane(self.max_concurrency, self.tpm)
+            return lane
+
+    def call(
+        self,
+        account: str,
+        model: str,
+        instruction: str,
+        user_message: str,
+        response_format: Optional[dict],
+        fn: Callable[[], Any],
+    ) -> Tuple[Any, bool]:
+        """
+        fn() 真正发请求（含重试），每次尝试用 slot() 占一个并发位。
+        返回 (结果, 是否复用了别人的 in-flight 请求)
+        """
+        key = request_key(account, model, instruction, user_message, response_format)
+
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            record_llm_coalesced(model)
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+
+        try:
+            flight.result = fn()
+            return flight.result, False
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    @contextmanager
+    def slot(self, model: str, est: int):
+        """
+        一次请求尝试占用的并发位 + TPM 预扣；块内把实际用量写进 usage["actual"]，退出时按实际校正
+        """
+        priority = _priority_var.get()
+        lane = self.lane(model)
+        t0 = time.perf_counter()
+        lane.acquire(priority, est)
+        record_llm_queue_wait(model, PRIORITY_NAMES.get(priority, str(priority)), time.perf_counter() - t0)
+        usage: Dict[str, Optional[int]] = {"actual": None}
+        try:
+            yield usage
+        finally:
+            lane.release(est, usage["actual"])
+
+    def try_slot(self, model: str, est: int) -> Optional[Callable[[Optional[int]], None]]:
+        """
+        非阻塞占位（hedged request 用）：占到返回 release(actual)，调用方在请求结束时调用；
+        占不到返回 None（不为了 hedge 去排队，也不超出并发 / TPM）
+        """
+        lane = self.lane(model)
+        if not lane.try_acquire(est):
+            return None
+        return lambda actual=None: lane.release(est, actual)
+
+
+_gateway: Optional[LLMGateway] = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway() -> LLMGateway:
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                _gateway = LLMGateway()
+    return _gateway
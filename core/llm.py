@@ -1,34 +1,283 @@
 # core/llm.py
-from openai import OpenAI
+import os
+import random
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from email.utils import parsedate_to_datetime
+from typing import TYPE_CHECKING, Any, Dict, Optional, Tuple
+
 from core.config import get_cfg
+from core.tracing import span, set_attrs, record_usage
+from core.metrics import record_llm_retry, record_llm_hedge
+from core.gateway import get_gateway, account_key, estimate_tokens
+
+if TYPE_CHECKING:
+    from openai import OpenAI  # SDK 本身约 0.6s，第一次 get_client() 时才 import
+
+# ============================================================
+# Transport Config
+# ============================================================
+MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "5"))
+BACKOFF_BASE_S = float(os.getenv("LLM_BACKOFF_BASE_S", "0.5"))
+BACKOFF_MAX_S = float(os.getenv("LLM_BACKOFF_MAX_S", "20"))
+RETRY_AFTER_MAX_S = 60.0        # 服务端给的 Retry-After 也不无限等
+REQUEST_TIMEOUT_S = float(os.getenv("LLM_TIMEOUT_S", "120"))
+
+# Hedged requests：第一个请求超过该模型近期 p95 仍未返回时，再发一个，取先返回的
+HEDGE_ENABLED = os.getenv("LLM_HEDGE", "0") == "1"
+HEDGE_PERCENTILE = 95
+HEDGE_MIN_SAMPLES = 20          # 样本不够时用默认阈值
+HEDGE_DEFAULT_AFTER_S = float(os.getenv("LLM_HEDGE_AFTER_S", "15"))
+HEDGE_MIN_AFTER_S = 1.0
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
 
-def get_client() -> OpenAI:
+# ============================================================
+# Client（按 api_key + base_url 缓存，复用 httpx 连接池）
+# ============================================================
+_clients: Dict[Tuple[str, str], "OpenAI"] = {}
+_clients_lock = threading.Lock()
+
+
+def get_client() -> "OpenAI":
     cfg = get_cfg()
     if not cfg["api_key"]:
         raise RuntimeError("Missing API key. Please set it in Settings page.")
-    return OpenAI(api_key=cfg["api_key"], base_url=cfg["base_url"])
+    key = (cfg["api_key"], cfg["base_url"])
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                from openai import OpenAI
 
-def chat(instruction, user_message, model="gpt-4.1", response_format=None):
-    client = get_client()
+                # SDK 自带的重试关掉，统一走下面的 backoff 逻辑
+                client = OpenAI(
+                    api_key=cfg["api_key"],
+                    base_url=cfg["base_url"],
+                    max_retries=0,
+                    timeout=REQUEST_TIMEOUT_S,
+                )
+                _clients[key] = client
+    return client
+
+
+# ============================================================
+# 错误分类 + Backoff
+# ============================================================
+def _retry_after_s(e: Exception) -> Optional[float]:
+    response = getattr(e, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+
+    ms = headers.get("retry-after-ms")
+    if ms:
+        try:
+            return float(ms) / 1000.0
+        except ValueError:
+            pass
+
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def classify_error(e: Exception) -> Tuple[bool, str]:
+    """返回 (是否值得重试, 原因标签)"""
+    openai = sys.modules.get("openai")
+    if openai is None:
+        # SDK 还没加载过，异常不可能来自它
+        return True, type(e).__name__
+    if isinstance(e, openai.APITimeoutError):
+        return True, "timeout"
+    if isinstance(e, openai.APIConnectionError):
+        return True, "connection"
+    if isinstance(e, openai.RateLimitError):
+        return True, "rate_limit"
+    if isinstance(e, openai.APIStatusError):
+        status = e.status_code
+        if status in RETRYABLE_STATUS or status >= 500:
+            return True, f"http_{status}"
+        # 400 / 401 / 403 / 404 / 422 ... 重试也不会成功
+        return False, f"http_{status}"
+    if isinstance(e, openai.OpenAIError):
+        return False, type(e).__name__
+    # 非 SDK 异常（例如响应结构异常）保持原来的重试行为
+    return True, type(e).__name__
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    """full jitter 指数退避；有 Retry-After 时至少等到服务端要求的时间"""
+    delay = random.uniform(0, min(BACKOFF_MAX_S, BACKOFF_BASE_S * (2 ** attempt)))
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, RETRY_AFTER_MAX_S))
+    return delay
+
+
+# ============================================================
+# Hedged requests
+# ============================================================
+_latencies: Dict[str, deque] = defaultdict(lambda: deque(maxlen=200))
+_latencies_lock = threading.Lock()
+_hedge_pool: Optional[ThreadPoolExecutor] = None
+
+
+def _record_latency(model: str, seconds: float) -> None:
+    with _latencies_lock:
+        _latencies[model].append(seconds)
+
+
+def hedge_after_s(model: str) -> float:
+    with _latencies_lock:
+        samples = sorted(_latencies[model])
+    if len(samples) < HEDGE_MIN_SAMPLES:
+        return HEDGE_DEFAULT_AFTER_S
+    k = min(len(samples) - 1, int(len(samples) * HEDGE_PERCENTILE / 100))
+    return max(HEDGE_MIN_AFTER_S, samples[k])
+
+
+def _get_hedge_pool() -> ThreadPoolExecutor:
+    global _hedge_pool
+    if _hedge_pool is None:
+        with _clients_lock:
+            if _hedge_pool is None:
+                _hedge_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="llm-hedge")
+    return _hedge_pool
+
+
+def _create(client: "OpenAI", **kwargs) -> Any:
+    t0 = time.perf_counter()
+    resp = client.chat.completions.create(**kwargs)
+    _record_latency(kwargs["model"], time.perf_counter() - t0)
+    return resp
+
+
+def _total_tokens(fut) -> Optional[int]:
+    if fut.exception() is not None:
+        return None
+    return getattr(getattr(fut.result(), "usage", None), "total_tokens", None)
+
+
+def _create_hedged(client: "OpenAI", **kwargs) -> Any:
+    """
+    主请求超过 p95 未返回就补发一个，取先成功的那个。
+    落后的请求无法中断（同步 HTTP），在后台线程里自然结束，结果丢弃。
+    补发的请求也要向 gateway 占位（不排队：没有空位 / TPM 不够就不补发，只等主请求）；
+    调用方的 slot 随返回释放，补发占的位等两个请求都结束才释放，在途请求数不会超过占位数
+    """
+    model = kwargs["model"]
+    pool = _get_hedge_pool()
+    primary = pool.submit(_create, client, **kwargs)
+    done, _ = wait([primary], timeout=hedge_after_s(model))
+    if done:
+        return primary.result()
+
+    est = estimate_tokens(*(m["content"] for m in kwargs["messages"]))
+    release = get_gateway().try_slot(model, est)
+    if release is None:
+        set_attrs(hedge_skipped=True)
+        return primary.result()
+
+    hedge = pool.submit(_create, client, **kwargs)
+    set_attrs(hedged=True)
+
+    # 后结束的那个按它自己的实际用量校正补发占位的 TPM 预扣
+    remaining = [2]
+    remaining_lock = threading.Lock()
+
+    def _on_done(fut) -> None:
+        with remaining_lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            release(_total_tokens(fut))
+
+    primary.add_done_callback(_on_done)
+    hedge.add_done_callback(_on_done)
+
+    pending = {primary, hedge}
+    last_e = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for fut in done:
+            if fut.exception() is None:
+                record_llm_hedge(model, won=fut is hedge)
+                return fut.result()
+            last_e = fut.exception()
+    raise last_e
+
+
+# ============================================================
+# Chat
+# ============================================================
+def _chat_with_retries(client: "OpenAI", instruction, user_message, model, response_format):
+    """
+    返回 content。每次尝试单独向 gateway 申请并发位，backoff 期间不占位
+    """
     messages = [
         {"role": "system", "content": instruction},
         {"role": "user", "content": user_message},
     ]
+    kwargs = {}
+    if response_format is not None:
+        kwargs["response_format"] = response_format  # OpenAI chat.completions 支持
+    create = _create_hedged if HEDGE_ENABLED else _create
+    gateway = get_gateway()
+    est = estimate_tokens(instruction, user_message)
+
     last_e = None
-    for _ in range(5):
+    for attempt in range(MAX_ATTEMPTS):
         try:
-            kwargs = {}
-            if response_format is not None:
-                kwargs["response_format"] = response_format  # OpenAI chat.completions 支持
-            resp = client.chat.completions.create(
-                model=model,
-                messages=messages,
-                temperature=0,
-                **kwargs
-            )
+            with gateway.slot(model, est) as slot:
+                resp = create(
+                    client,
+                    model=model,
+                    messages=messages,
+                    temperature=0,
+                    **kwargs
+                )
+                usage = getattr(resp, "usage", None)
+                slot["actual"] = getattr(usage, "total_tokens", None)
+            record_usage(usage)
+            set_attrs(attempts=attempt + 1)
             return resp.choices[0].message.content
         except Exception as e:
             last_e = e
-            continue
+            retryable, reason = classify_error(e)
+            if not retryable or attempt == MAX_ATTEMPTS - 1:
+                set_attrs(attempts=attempt + 1, error_class=reason)
+                break
+            record_llm_retry(model, reason)
+            delay = backoff_delay(attempt, _retry_after_s(e))
+            print(f"[LLM] {reason} on attempt {attempt + 1}/{MAX_ATTEMPTS}, retrying in {delay:.1f}s")
+            time.sleep(delay)
     print(instruction)
-    raise RuntimeError(f"LLM request failed after retries: {last_e}")
\ No newline at end of file
+    raise RuntimeError(f"LLM request failed after retries: {last_e}") from last_e
+
+
+def chat(instruction, user_message, model="gpt-4.1", response_format=None):
+    with span("llm.chat", kind="llm", model=model):
+        cfg = get_cfg()
+        client = get_client()
+        # 经 gateway 排队：相同账号的相同 in-flight 请求合并、按 model 限并发 / TPM、interactive 优先
+        content, coalesced = get_gateway().call(
+            account_key(cfg["api_key"], cfg["base_url"]),
+            model, instruction, user_message, response_format,
+            lambda: _chat_with_retries(client, instruction, user_message, model, response_format),
+        )
+        if coalesced:
+            set_attrs(coalesced=True)
+        return content
@@ -0,0 +1,230 @@
+# core/metrics.py
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple
+
+from core import tracing
+
+# ============================================================
+# 进程内指标 + Prometheus text 导出
+#
+#   HEALTHKG_METRICS=1            开启（默认关闭，关闭时所有 inc/observe 只做一次 bool 判断）
+#   HEALTHKG_METRICS_PORT=9108    /metrics 端口
+#
+# 延迟类指标来自 core.tracing 的 span（stage / agent / llm / kg / turn），
+# 计数类指标（缓存命中、LLM 重试）由调用方直接 inc。
+# ============================================================
+
+ENABLED = os.getenv("HEALTHKG_METRICS", "0") == "1"
+PORT = int(os.getenv("HEALTHKG_METRICS_PORT", "9108"))
+
+# 单位：秒。LLM 调用常见 1–20s，KG 查询常见 10ms–1s
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _fmt_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    body = ",".join(
+        '{}="{}"'.format(k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in pairs
+    )
+    return "{" + body + "}"
+
+
+def _fmt_float(v: float) -> str:
+    return "+Inf" if v == float("inf") else repr(float(v))
+
+
+class Counter:
+    def __init__(self, name: str, doc: str):
+        self.name = name
+        self.doc = doc
+        self._values: Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, v in sorted(self._values.items()):
+                lines.append(f"{self.name}{_fmt_labels(key)} {_fmt_float(v)}")
+        return "\n".join(lines)
+
+
+class Histogram:
+    def __init__(self, name: str, doc: str, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.doc = doc
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # key -> [bucket counts..., sum, count]
+        self._values: Dict[LabelKey, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    row[i] += 1
+                    break
+            row[-2] += value
+            row[-1] += 1
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, row in sorted(self._values.items()):
+                cum = 0
+                for b, n in zip(self.buckets, row):
+                    cum += n
+                    lines.append(f"{self.name}_bucket{_fmt_labels(key, ('le', _fmt_float(b)))} {cum}")
+                lines.append(f"{self.name}_sum{_fmt_labels(key)} {_fmt_float(row[-2])}")
+                lines.append(f"{self.name}_count{_fmt_labels(key)} {row[-1]}")
+        return "\n".join(lines)
+
+
+# ============================================================
+# Registry
+# ============================================================
+ROUTE_SECONDS = Histogram("healthkg_route_seconds", "End-to-end latency of one user turn, by route.")
+STAGE_SECONDS = Histogram("healthkg_stage_seconds", "Latency of pipeline stages (route / subflow / render), by route.")
+AGENT_SECONDS = Histogram("healthkg_agent_seconds", "Latency of run_agent calls, by agent.")
+LLM_SECONDS = Histogram("healthkg_llm_seconds", "Latency of chat() calls including retries, by model.")
+KG_SECONDS = Histogram("healthkg_kg_query_seconds", "Latency of Neo4j queries (run + consume), by query.")
+ERRORS = Counter("healthkg_errors_total", "Spans that ended with an exception, by kind and name.")
+LLM_RETRIES = Counter("healthkg_llm_retries_total", "LLM request attempts that failed and were retried, by model and reason.")
+LLM_QUEUE_SECONDS = Histogram("healthkg_llm_queue_seconds", "Time spent waiting for an LLM gateway slot / token budget, by model and priority.")
+LLM_COALESCED = Counter("healthkg_llm_coalesced_total", "chat() calls served by an identical in-flight request, by model.")
+LLM_HEDGES = Counter("healthkg_llm_hedges_total", "Hedged LLM requests, by model and which request won.")
+CACHE_REQUESTS = Counter("healthkg_cache_requests_total", "Cache lookups, by cache and result (hit / miss).")
+
+REGISTRY = [
+    ROUTE_SECONDS, STAGE_SECONDS, AGENT_SECONDS, LLM_SECONDS, KG_SECONDS,
+    LLM_QUEUE_SECONDS, ERRORS, LLM_RETRIES, LLM_HEDGES, LLM_COALESCED, CACHE_REQUESTS,
+]
+
+
+def render() -> str:
+    return "\n".join(m.render() for m in REGISTRY) + "\n"
+
+
+# ============================================================
+# 直接埋点（关闭时只有一次 bool 判断）
+# ============================================================
+def record_cache(cache: str, hit: bool) -> None:
+    if ENABLED:
+        CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def record_llm_retry(model: str, reason: str = "error") -> None:
+    if ENABLED:
+        LLM_RETRIES.inc(model=model, reason=reason)
+
+
+def record_llm_queue_wait(model: str, priority: str, seconds: float) -> None:
+    if ENABLED:
+        LLM_QUEUE_SECONDS.observe(seconds, model=model, priority=priority)
+
+
+def record_llm_coalesced(model: str) -> None:
+    if ENABLED:
+        LLM_COALESCED.inc(model=model)
+
+
+def record_llm_hedge(model: str, won: bool) -> None:
+    if ENABLED:
+        LLM_HEDGES.inc(model=model, winner="hedge" if won else "primary")
+
+
+# ============================================================
+# tracing listener：span 结束 -> histogram
+# ============================================================
+def _on_span(s: Dict[str, Any], turn: Optional[Dict[str, Any]]) -> None:
+    kind = s["kind"]
+    seconds = (s["ms"] or 0) / 1000.0
+    route = (turn or {}).get("attrs", {}).get("route", "unknown")
+
+    if kind == "turn":
+        ROUTE_SECONDS.observe(seconds, route=route)
+    elif kind == "stage":
+        STAGE_SECONDS.observe(seconds, stage=s["name"], route=route)
+    elif kind == "agent":
+        AGENT_SECONDS.observe(seconds, agent=s["name"])
+    elif kind == "llm":
+        LLM_SECONDS.observe(seconds, model=s["attrs"].get("model", "unknown"))
+    elif kind == "kg":
+        KG_SECONDS.observe(seconds, query=s["name"])
+
+    if s.get("error"):
+        ERRORS.inc(kind=kind, name=s["name"])
+
+
+# ============================================================
+# HTTP /metrics
+# ============================================================
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server: Optional[ThreadingHTTPServer] = None
+_server_lock = threading.Lock()
+
+
+def start_http_server(port: int = PORT, addr: str = "0.0.0.0") -> Optional[ThreadingHTTPServer]:
+    """后台 daemon 线程提供 /metrics；重复调用只启动一次（streamlit 每次 rerun 都会执行 app.py）"""
+    global _server
+    with _server_lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer((addr, port), _MetricsHandler)
+            except OSError as e:
+                # 端口被占用（例如同机多个实例）时只采集不导出，不影响主流程
+                print(f"[Metrics] Failed to bind {addr}:{port}: {e}")
+                return None
+            threading.Thread(target=_server.serve_forever, name="healthkg-metrics", daemon=True).start()
+            print(f"[Metrics] Serving Prometheus metrics on http://{addr}:{port}/metrics")
+    return _server
+
+
+def enable(port: Optional[int] = PORT, addr: str = "0.0.0.0") -> None:
+    """开启指标采集；port 为 None 时只采集不起 HTTP 线程"""
+    global ENABLED
+    ENABLED = True
+    tracing.add_listener(_on_span)
+    if port is not None:
+        start_http_server(port, addr)
+
+
+def maybe_enable() -> None:
+    """按 HEALTHKG_METRICS 环境变量决定是否开启"""
+    if ENABLED:
+        enable(PORT)
@@ -0,0 +1,148 @@
+# core/resources.py
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+# ============================================================
+# 进程级资源缓存（与 st.cache_resource 同语义，但不依赖 streamlit，headless 服务同样适用）
+#
+#   get_resource(name, key, factory, close=None)
+#       同一个 (name, key) 只构造一次，所有 session / 线程共享；
+#       key 里放构造参数（如连接串），参数变了自然得到新实例
+#   invalidate(name=None)
+#       丢弃缓存（name 可以是前缀，如 "kg."），有 close 的资源会被关闭，
+#       再调用 on_invalidate 注册的钩子
+#
+# 命名约定：kg.exercise / kg.diet（Neo4j driver）、snapshot.<path>（本地 KG JSON）、
+#           terms.<name>（词表 / 翻译缓存）
+# ============================================================
+
+_resources: Dict[Tuple[str, Hashable], Tuple[Any, Optional[Callable[[Any], None]]]] = {}
+_building: Dict[Tuple[str, Hashable], threading.Lock] = {}
+_lock = threading.Lock()
+_hooks: Dict[str, List[Callable[[], None]]] = {}
+
+
+def get_resource(name: str, key: Hashable, factory: Callable[[], Any],
+                 close: Optional[Callable[[Any], None]] = None, exclusive: bool = False) -> Any:
+    """
+    exclusive=True：同名只保留一个 key，构造新实例时关闭旧的
+    （如配置改了连接串 / 快照文件更新了）
+    """
+    k = (name, key)
+    hit = _resources.get(k)
+    if hit is not None:
+        return hit[0]
+
+    # 每个 key 单独一把构造锁：慢的 driver 初始化不阻塞其他资源
+    with _lock:
+        build_lock = _building.setdefault(k, threading.Lock())
+    with build_lock:
+        hit = _resources.get(k)
+        if hit is not None:
+            return hit[0]
+        value = factory()
+        with _lock:
+            stale = [(o, _resources.pop(o)) for o in list(_resources) if exclusive and o[0] == name]
+            _resources[k] = (value, close)
+        for _, (old, old_close) in stale:
+            if old_close is not None:
+                try:
+                    old_close(old)
+                except Exception as e:
+                    print(f"[Resources] close {name} failed: {e}")
+        return value
+
+
+def set_resource(name: str, key: Hashable, value: Any) -> None:
+    """直接放入一个实例（测试 / bench 用来替换真实客户端）"""
+    with _lock:
+        _resources[(name, key)] = (value, None)
+
+
+def invalidate(name: Optional[str] = None) -> int:
+    """返回丢弃的资源数"""
+    with _lock:
+        victims = [k for k in _resources if name is None or k[0] == name or k[0].startswith(name)]
+        dropped = [(k, _resources.pop(k)) for k in victims]
+    for (res_name, _), (value, close) in dropped:
+        if close is not None:
+            try:
+                close(value)
+            except Exception as e:
+                print(f"[Resources] close {res_name} failed: {e}")
+
+    for hook_name, hooks in list(_hooks.items()):
+        if name is None or hook_name == name or hook_name.startswith(name):
+            for fn in hooks:
+                try:
+                    fn()
+                except Exception as e:
+                    print(f"[Resources] invalidate hook {hook_name} failed: {e}")
+    return len(dropped)
+
+
+def on_invalidate(name: str, fn: Callable[[], None]) -> None:
+    """invalidate(name) 时额外回调（用于清理不经 get_resource 管理的派生缓存）"""
+    hooks = _hooks.setdefault(name, [])
+    if fn not in hooks:
+        hooks.append(fn)
+
+
+def stats() -> Dict[str, int]:
+    out: Dict[str, int] = {}
+    for name, _ in list(_resources):
+        out[name] = out.get(name, 0) + 1
+    return out
+
+
+# ============================================================
+# 词表类缓存（如中->英关键词翻译）：线程安全的 LRU dict
+# ============================================================
+class LRUDict:
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._data
+
+    def __setitem__(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+def term_cache(name: str, maxsize: int = 4096) -> LRUDict:
+    """invalidate("terms.") 即清空"""
+    return get_resource(f"terms.{name}", maxsize, lambda: LRUDict(maxsize))
+
+
+# ============================================================
+# 本地 KG 快照（data/*.json）：按文件 mtime 缓存，文件更新后自动换新
+# ============================================================
+def load_snapshot(path: str, default_factory: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+    """返回共享对象，调用方只读"""
+    from memory.persistence import load_graph
+
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        mtime = None
+    return get_resource(f"snapshot.{os.path.abspath(path)}", mtime,
+                        lambda: load_graph(path, default_factory()), exclusive=True)
@@ -0,0 +1,223 @@
+# core/tracing.py
+import functools
+import itertools
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional
+
+# ============================================================
+# Span-based tracing
+#
+# 一轮对话 = 一个 turn：{"name", "ts", "spans": [...]}
+# 每个 span：{"id", "parent", "name", "kind", "start_ms", "ms", "attrs", "error"}
+#   - start_ms 相对 turn 开始，ms 为耗时（未结束时为 None）
+#   - kind: turn / stage / agent / llm / kg / phase
+#
+# 没有活动 turn 时 span 不会被记录；若也没有 listener（如 core.metrics），
+# span() 直接 yield 一个临时 dict，不做任何计时。
+# ============================================================
+
+_turn_var: ContextVar[Optional[Dict[str, Any]]] = ContextVar("healthkg_turn", default=None)
+_span_var: ContextVar[Optional[Dict[str, Any]]] = ContextVar("healthkg_span", default=None)
+_ids = itertools.count(1)
+
+# span 结束时回调 fn(span, turn)；turn 可能为 None
+_listeners: List[Callable[[Dict[str, Any], Optional[Dict[str, Any]]], None]] = []
+
+
+def add_listener(fn: Callable[[Dict[str, Any], Optional[Dict[str, Any]]], None]) -> None:
+    if fn not in _listeners:
+        _listeners.append(fn)
+
+
+def _notify(s: Dict[str, Any], turn: Optional[Dict[str, Any]]) -> None:
+    for fn in _listeners:
+        try:
+            fn(s, turn)
+        except Exception as e:
+            print(f"[Tracing] listener failed: {e}")
+
+
+def start_turn(name: str, **attrs) -> Dict[str, Any]:
+    """开启新一轮 trace；之后当前上下文中的 span 都记到这个 turn 下"""
+    turn = {
+        "name": name,
+        "ts": time.time(),
+        "t0": time.perf_counter(),
+        "attrs": dict(attrs),
+        "spans": [],
+    }
+    _turn_var.set(turn)
+    _span_var.set(None)
+    return turn
+
+
+def current_turn() -> Optional[Dict[str, Any]]:
+    return _turn_var.get()
+
+
+def set_turn_attrs(**attrs) -> None:
+    turn = _turn_var.get()
+    if turn is not None:
+        turn["attrs"].update(attrs)
+
+
+def end_turn() -> None:
+    """
+    结束当前 turn，记录总耗时并以 kind="turn" 通知 listener。
+    st.rerun / st.stop 之前也要调用（它们会直接中断脚本）
+    """
+    turn = _turn_var.get()
+    if turn is None:
+        return
+    _turn_var.set(None)
+    _span_var.set(None)
+    turn["ms"] = round((time.perf_counter() - turn["t0"]) * 1000, 2)
+    _notify({"name": turn["name"], "kind": "turn", "ms": turn["ms"], "attrs": turn["attrs"], "error": None}, turn)
+
+
+@contextmanager
+def detached():
+    """块内不再记到外层 turn 下（后台任务复制了提交时的上下文，但不属于那一轮）"""
+    turn_token = _turn_var.set(None)
+    span_token = _span_var.set(None)
+    try:
+        yield
+    finally:
+        _span_var.reset(span_token)
+        _turn_var.reset(turn_token)
+
+
+@contextmanager
+def span(name: str, kind: str = "phase", **attrs):
+    turn = _turn_var.get()
+    if turn is None and not _listeners:
+        yield {"attrs": {}}
+        return
+
+    parent = _span_var.get()
+    t0 = time.perf_counter()
+    s = {
+        "id": next(_ids),
+        "parent": parent["id"] if parent else None,
+        "name": name,
+        "kind": kind,
+        "start_ms": round((t0 - turn["t0"]) * 1000, 2) if turn else 0.0,
+        "ms": None,
+        "attrs": dict(attrs),
+        "error": None,
+    }
+    # 开始时就登记，st.rerun / st.stop 打断时已完成的部分仍然可见
+    if turn is not None:
+        turn["spans"].append(s)
+    token = _span_var.set(s)
+    try:
+        yield s
+    except Exception as e:
+        s["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        s["ms"] = round((time.perf_counter() - t0) * 1000, 2)
+        _span_var.reset(token)
+        if _listeners:
+            _notify(s, turn)
+
+
+def traced(name: Optional[str] = None, kind: str = "phase"):
+    """装饰器版本的 span()"""
+    def deco(fn):
+        span_name = name or fn.__qualname__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _turn_var.get() is None and not _listeners:
+                return fn(*args, **kwargs)
+            with span(span_name, kind=kind):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+def record_span(name: str, t0: float, t1: Optional[float] = None, kind: str = "phase", **attrs) -> None:
+    """
+    事后补记一个已结束的阶段（t0/t1 为 time.perf_counter()），
+    用于循环体较大、不方便整体包进 with span() 的地方
+    """
+    turn = _turn_var.get()
+    if turn is None and not _listeners:
+        return
+    t1 = time.perf_counter() if t1 is None else t1
+    parent = _span_var.get()
+    s = {
+        "id": next(_ids),
+        "parent": parent["id"] if parent else None,
+        "name": name,
+        "kind": kind,
+        "start_ms": round((t0 - turn["t0"]) * 1000, 2) if turn else 0.0,
+        "ms": round((t1 - t0) * 1000, 2),
+        "attrs": dict(attrs),
+        "error": None,
+    }
+    if turn is not None:
+        turn["spans"].append(s)
+    _notify(s, turn)
+
+
+def set_attrs(**attrs) -> None:
+    """给当前 span 补充属性"""
+    s = _span_var.get()
+    if s is not None:
+        s["attrs"].update(attrs)
+
+
+def record_usage(usage: Any) -> None:
+    """记录 OpenAI 响应里的 token 用量（resp.usage）"""
+    if usage is None:
+        return
+    set_attrs(
+        prompt_tokens=getattr(usage, "prompt_tokens", None),
+        completion_tokens=getattr(usage, "completion_tokens", None),
+        total_tokens=getattr(usage, "total_tokens", None),
+    )
+
+
+# ============================================================
+# Neo4j
+# ============================================================
+def run_query(session, name: str, query: str, **params) -> List[Dict[str, Any]]:
+    """
+    session.run + 取数 + consume，记录服务端的 available_after / consumed_after
+    （没有活动 turn 时行为与 [r.data() for r in session.run(...)] 相同）
+    """
+    with span(name, kind="kg"):
+        result = session.run(query, **params)
+        rows = [r.data() for r in result]
+        summary = result.consume()
+        set_attrs(
+            rows=len(rows),
+            available_after_ms=summary.result_available_after,
+            consumed_after_ms=summary.result_consumed_after,
+        )
+        return rows
+
+
+# ============================================================
+# 汇总（给 trace 页面 / 日志用）
+# ============================================================
+def turn_total_ms(turn: Dict[str, Any]) -> float:
+    if turn.get("ms") is not None:
+        return turn["ms"]
+    spans = turn.get("spans", [])
+    ends = [s["start_ms"] + (s["ms"] or 0) for s in spans]
+    return round(max(ends), 2) if ends else 0.0
+
+
+def turn_token_usage(turn: Dict[str, Any]) -> Dict[str, int]:
+    out = {"prompt_tokens": 0, "completion_tokens": 0}
+    for s in turn.get("spans", []):
+        if s["kind"] != "llm":
+            continue
+        for k in out:
+            out[k] += s["attrs"].get(k) or 0
+    return out
@@ -1,8 +1,13 @@
-import json
 import time
+import argparse
+import asyncio
+import hashlib
+import os
+import random
 import cloudscraper
 from bs4 import BeautifulSoup
-from urllib.parse import urljoin
+from urllib.parse import urljoin, urlparse
+from dataset_io import RecordWriter
 
 # ====================================================
 # 参数配置
@@ -14,6 +19,15 @@ BODY_PARTS = [
 ]
 OUTPUT_JSON = "../data/exrx_full_dataset.json"
 
+# 异步模式配置
+OUTPUT_JSONL = "../data/exrx_full_dataset.jsonl"
+CACHE_DIR = "../data/html_cache"
+PER_HOST_CONCURRENCY = 4   # 单个 host 同时在途的请求数
+REQUESTS_PER_SEC = 2.0     # token bucket 平均速率
+BURST = 4                  # token bucket 容量
+MAX_RETRIES = 4
+BACKOFF_BASE = 1.0         # 指数退避基数（秒）
+
 # 初始化 Scraper（模拟真实浏览器）
 scraper = cloudscraper.create_scraper(
     browser={"browser": "chrome", "platform": "windows", "mobile": False}
@@ -62,11 +76,15 @@ def parse_exercise_detail(url):
     """解析单个动作详情页"""
     print(f"   🔍 解析动作页面: {url}")
     html = safe_get(url)
-    data = {"exercise_url": url}
     if not html:
         print("   ⚠️ 页面访问失败")
-        return data
+        return {"exercise_url": url}
+    return parse_exercise_html(url, html)
+
 
+def parse_exercise_html(url, html):
+    """从详情页 HTML 中抽取字段（与抓取方式无关，缓存页面可直接复用）"""
+    data = {"exercise_url": url}
     soup = BeautifulSoup(html, "html.parser")
 
     # ---------- Classification ----------
@@ -130,13 +148,21 @@ def parse_exercise_detail(url):
 # ====================================================
 def parse_bodypart_page(body_part):
     """解析某个部位页面的所有动作"""
-    part_url = f"{BASE_URL}/Lists/ExList/{body_part}Wt"
+    part_url = bodypart_url(body_part)
     print(f"\n🦾 抓取部位页面: {part_url}")
     html = safe_get(part_url)
     if not html:
         print(f"❌ 无法访问 {body_part} 页面，跳过")
         return []
+    return parse_bodypart_html(body_part, html)
+
+
+def bodypart_url(body_part):
+    return f"{BASE_URL}/Lists/ExList/{body_part}Wt"
 
+
+def parse_bodypart_html(body_part, html):
+    """从部位列表页 HTML 中抽取动作链接"""
     soup = BeautifulSoup(html, "html.parser")
     results = []
 
@@ -182,27 +208,200 @@ def parse_bodypart_page(body_part):
 # ====================================================
 # 主流程
 # ====================================================
-def crawl_all_bodyparts():
-    all_data = []
-
+def iter_bodypart_exercises():
     for part in BODY_PARTS:
         exercises = parse_bodypart_page(part)
         print(f"✅ {part}: 找到 {len(exercises)} 个动作")
         for ex in exercises:
             print(f"\n 动作: {ex['exercise_name']} ({ex['training_type']})")
             detail = parse_exercise_detail(ex["exercise_url"])
-            combined = {**ex, **detail}
-            all_data.append(combined)
+            yield {**ex, **detail}
             time.sleep(0.5)  # 控制速率，防止封禁
 
-    with open(OUTPUT_JSON, "w", encoding="utf-8") as f:
-        json.dump(all_data, f, ensure_ascii=False, indent=2)
 
-    print(f"\n 全部完成，共收集 {len(all_data)} 条动作记录 → {OUTPUT_JSON}")
+def crawl_all_bodyparts():
+    with RecordWriter(OUTPUT_JSON) as writer:
+        for record in iter_bodypart_exercises():
+            writer.write(record)
+
+    print(f"\n 全部完成，共收集 {writer.count} 条动作记录 → {OUTPUT_JSON}")
+
+
+# ====================================================
+# 异步模式：限速 + 退避 + HTML 缓存 + 增量 JSONL
+# ====================================================
+class TokenBucket:
+    """asyncio token bucket：平均 rate 次/秒，最多突发 capacity 次"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class HtmlCache:
+    """按 URL 的 sha1 存储原始 HTML，重复抓取时直接读盘"""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, url):
+        return os.path.join(self.cache_dir, hashlib.sha1(url.encode("utf-8")).hexdigest() + ".html")
+
+    def get(self, url):
+        path = self._path(url)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read()
+
+    def put(self, url, html):
+        path = self._path(url)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(html)
+        os.replace(tmp, path)
+
+
+class AsyncFetcher:
+    """
+    cloudscraper 本身是同步的，这里把请求丢到线程里执行，
+    由事件循环负责并发控制：
+    - 每个 host 一个 Semaphore（并发上限）
+    - 全局 TokenBucket（速率上限）
+    - 429 / 5xx / 网络异常 → 指数退避 + 抖动（优先遵守 Retry-After）
+    """
+
+    RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+    def __init__(self, cache, per_host=PER_HOST_CONCURRENCY, rate=REQUESTS_PER_SEC,
+                 burst=BURST, retries=MAX_RETRIES, refresh=False):
+        self.cache = cache
+        self.per_host = per_host
+        self.bucket = TokenBucket(rate, burst)
+        self.retries = retries
+        self.refresh = refresh
+        self._host_sems = {}
+        self.stats = {"cache_hit": 0, "fetched": 0, "failed": 0}
+
+    def _sem(self, url):
+        host = urlparse(url).netloc
+        if host not in self._host_sems:
+            self._host_sems[host] = asyncio.Semaphore(self.per_host)
+        return self._host_sems[host]
+
+    async def get(self, url):
+        if not self.refresh:
+            html = self.cache.get(url)
+            if html is not None:
+                self.stats["cache_hit"] += 1
+                return html
+
+        async with self._sem(url):
+            for i in range(self.retries):
+                await self.bucket.acquire()
+                retry_after = None
+                try:
+                    r = await asyncio.to_thread(scraper.get, url, headers=HEADERS, timeout=25)
+                    if r.status_code == 200:
+                        self.cache.put(url, r.text)
+                        self.stats["fetched"] += 1
+                        return r.text
+                    if r.status_code not in self.RETRYABLE_STATUS:
+                        print(f"⚠️ 状态码 {r.status_code}，不重试: {url}")
+                        break
+                    retry_after = r.headers.get("Retry-After")
+                    print(f"⚠️ 状态码 {r.status_code}，重试中 ({i+1}/{self.retries}): {url}")
+                except Exception as e:
+                    print(f"❌ 请求异常 {i+1}/{self.retries}: {e}")
+
+                if i + 1 < self.retries:
+                    delay = BACKOFF_BASE * (2 ** i) + random.uniform(0, BACKOFF_BASE)
+                    if retry_after and str(retry_after).isdigit():
+                        delay = max(delay, float(retry_after))
+                    await asyncio.sleep(delay)
+
+        self.stats["failed"] += 1
+        return None
+
+
+async def crawl_all_bodyparts_async(
+    output_jsonl=OUTPUT_JSONL,
+    cache_dir=CACHE_DIR,
+    per_host=PER_HOST_CONCURRENCY,
+    rate=REQUESTS_PER_SEC,
+    refresh=False,
+):
+    """
+    异步抓取：部位页并发 → 详情页并发，每解析完一个动作就追加一行 JSONL。
+    已缓存的页面直接从磁盘重新解析，不会再次请求。
+    """
+    fetcher = AsyncFetcher(HtmlCache(cache_dir), per_host=per_host, rate=rate, refresh=refresh)
+
+    async def _bodypart(part):
+        html = await fetcher.get(bodypart_url(part))
+        if not html:
+            print(f"❌ 无法访问 {part} 页面，跳过")
+            return []
+        exercises = parse_bodypart_html(part, html)
+        print(f"✅ {part}: 找到 {len(exercises)} 个动作")
+        return exercises
+
+    async def _detail(ex):
+        html = await fetcher.get(ex["exercise_url"])
+        detail = parse_exercise_html(ex["exercise_url"], html) if html else {"exercise_url": ex["exercise_url"]}
+        return {**ex, **detail}
+
+    part_lists = await asyncio.gather(*[_bodypart(p) for p in BODY_PARTS])
+    exercises = [ex for part in part_lists for ex in part]
+
+    with RecordWriter(output_jsonl, atomic=False) as writer:
+        for fut in asyncio.as_completed([_detail(ex) for ex in exercises]):
+            writer.write(await fut)
+            writer.flush()
+
+    print(f"\n 全部完成，共收集 {writer.count} 条动作记录 → {output_jsonl} ({fetcher.stats})")
 
 
 # ====================================================
 # 执行入口
 # ====================================================
 if __name__ == "__main__":
-    crawl_all_bodyparts()
+    parser = argparse.ArgumentParser(description="Crawl ExRx exercise pages")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="异步限速抓取 + HTML 缓存 + JSONL 输出")
+    parser.add_argument("--base-url", default=BASE_URL, help="可指向本地 fixture 服务器做离线测试")
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument("--per-host", type=int, default=PER_HOST_CONCURRENCY)
+    parser.add_argument("--rate", type=float, default=REQUESTS_PER_SEC)
+    parser.add_argument("--refresh", action="store_true", help="忽略缓存，强制重新抓取")
+    cli = parser.parse_args()
+
+    BASE_URL = cli.base_url.rstrip("/")
+
+    if cli.use_async:
+        asyncio.run(crawl_all_bodyparts_async(
+            output_jsonl=cli.output or OUTPUT_JSONL,
+            cache_dir=cli.cache_dir,
+            per_host=cli.per_host,
+            rate=cli.rate,
+            refresh=cli.refresh,
+        ))
+    else:
+        if cli.output:
+            OUTPUT_JSON = cli.output
+        crawl_all_bodyparts()
@@ -1,11 +1,55 @@
 import json
 from openai import OpenAI
 from tqdm import tqdm
+import argparse
+import hashlib
 import os
 import re
-client = OpenAI(
-    api_key="",
-    base_url="https://api.deepseek.com")
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataset_io import iter_records, write_records, make_exercise_id
+
+# ============================================================
+# LLM Config（任意 OpenAI 兼容接口，本地 stub 也可以）
+# ============================================================
+BASE_URL = os.getenv("LLM_BASE_URL", "https://api.deepseek.com")
+API_KEY = os.getenv("LLM_API_KEY", "")
+MODEL = os.getenv("LLM_MODEL", "deepseek-chat")
+
+MAX_WORKERS = 8          # 并发请求数上限
+REQUESTS_PER_SEC = 5.0   # 全局请求速率上限
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> OpenAI:
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = OpenAI(api_key=API_KEY or "EMPTY", base_url=BASE_URL)
+    return _client
+
+
+class RateLimiter:
+    """线程安全的最小间隔限速器：保证整体请求速率不超过 rate 次/秒"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate and rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next, now)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
 
 TOP_BODY_PARTS = [
     "Arm", "Back", "Calf", "Chest",
@@ -89,8 +133,8 @@ def extract_body_parts(instructions: str):
         instructions=instructions
     )
 
-    response = client.chat.completions.create(
-        model="deepseek-chat",
+    response = get_client().chat.completions.create(
+        model=MODEL,
         messages=[
             {"role": "system", "content": "You are a helpful assistant"},
             {"role": "user", "content": prompt},
@@ -120,23 +164,147 @@ def extract_body_parts(instructions: str):
     }
 
 
-def process_dataset(input_path, output_path):
-    with open(input_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
+# ============================================================
+# Checkpoint（JSONL，一行一个 exercise，支持断点续跑）
+# ============================================================
+def instruction_hash(instructions: str) -> str:
+    normalized = " ".join((instructions or "").split())
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+
+def load_checkpoint(path):
+    done = {}
+    if not path or not os.path.exists(path):
+        return done
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                rec = json.loads(line)
+            except Exception:
+                continue  # 崩溃时可能留下半行，直接忽略
+            done[rec["id"]] = rec
+    return done
+
+
+def process_dataset(
+    input_path,
+    output_path,
+    checkpoint_path=None,
+    max_workers=MAX_WORKERS,
+    requests_per_sec=REQUESTS_PER_SEC,
+):
+    """
+    1️⃣ 读取 checkpoint，跳过已完成的 exercise
+    2️⃣ 按 instruction 文本去重，相同文本只调用一次 LLM
+    3️⃣ 线程池并发 + 全局限速，每完成一个文本立即追加写 checkpoint
+    4️⃣ 再流式读一遍 input，合并结果写出 output
 
-    for item in tqdm(data, desc="Extracting instruction body parts"):
-        instructions = item.get("Instructions", "")
-        result = extract_body_parts(instructions)
-        item["Instruction_BodyPart"] = result["involved_body_parts"]
+    input / output 都走 dataset_io，支持 JSON 数组、JSONL、压缩与分片，
+    不会把整个数据集读进内存。
+    """
+    if checkpoint_path is None:
+        checkpoint_path = output_path + ".ckpt.jsonl"
 
-    with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    done = load_checkpoint(checkpoint_path)
+
+    # 已有结果按文本复用（例如同一动作出现在多个部位页面）
+    text_results = {rec["text_hash"]: rec["involved_body_parts"] for rec in done.values()}
+
+    total = 0
+    pending = {}  # text_hash -> (instructions, [exercise_id, ...])
+    for item in iter_records(input_path):
+        total += 1
+        eid = make_exercise_id(item)
+        if eid in done:
+            continue
+        instructions = item.get("Instructions", "")
+        h = instruction_hash(instructions)
+        pending.setdefault(h, (instructions, []))[1].append(eid)
+
+    print(f"Total {total}, done {len(done)}, unique texts to label {len(pending)}")
+
+    def _record(ckpt, eids, h, parts):
+        for eid in eids:
+            rec = {"id": eid, "text_hash": h, "involved_body_parts": parts}
+            ckpt.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            done[eid] = rec
+        ckpt.flush()
+
+    limiter = RateLimiter(requests_per_sec)
+
+    def _label(instructions):
+        limiter.wait()
+        return extract_body_parts(instructions)
+
+    with open(checkpoint_path, "a", encoding="utf-8") as ckpt:
+        # 缓存命中 / 空文本不需要请求模型
+        to_call = {}
+        for h, (instructions, eids) in pending.items():
+            if h in text_results:
+                _record(ckpt, eids, h, text_results[h])
+            elif not instructions.strip():
+                _record(ckpt, eids, h, [])
+            else:
+                to_call[h] = (instructions, eids)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = {
+                pool.submit(_label, instructions): h
+                for h, (instructions, _) in to_call.items()
+            }
+            for fut in tqdm(as_completed(futures), total=len(futures), desc="Extracting instruction body parts"):
+                h = futures[fut]
+                try:
+                    result = fut.result()
+                except Exception as e:
+                    # 不写 checkpoint，下次运行会自动重试
+                    print(f"⚠️ LLM failed for {to_call[h][1][0]}: {e}")
+                    continue
+                if not result["parse_success"]:
+                    # 回复不是合法 JSON 也可能是偶发的，同样不写 checkpoint，下次重试
+                    print(f"⚠️ Unparseable LLM reply for {to_call[h][1][0]}, will retry on next run")
+                    continue
+                _record(ckpt, to_call[h][1], h, result["involved_body_parts"])
+
+    missing = sum(1 for _, eids in pending.values() for eid in eids if eid not in done)
+    if missing:
+        print(f"⚠️ {missing} exercises still unlabeled, re-run to resume from {checkpoint_path}")
+        return
+
+    write_records(output_path, iter_labeled(input_path, done))
 
     print(f"✅ Saved to {output_path}")
 
 
+def iter_labeled(input_path, done):
+    for item in iter_records(input_path):
+        rec = done.get(make_exercise_id(item))
+        if rec is not None:
+            item["Instruction_BodyPart"] = rec["involved_body_parts"]
+        yield item
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Label instruction body parts with an OpenAI-compatible LLM")
+    parser.add_argument("--input", default="../data/exrx_full_dataset.json")
+    parser.add_argument("--output", default="../data/exrx_final.json")
+    parser.add_argument("--checkpoint", default=None, help="默认 <output>.ckpt.jsonl")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS)
+    parser.add_argument("--rps", type=float, default=REQUESTS_PER_SEC)
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--model", default=MODEL)
+    cli = parser.parse_args()
+
+    BASE_URL = cli.base_url
+    MODEL = cli.model
+
     process_dataset(
-        input_path="../data/exrx_full_dataset.json",
-        output_path="../data/exrx_final.json"
+        input_path=cli.input,
+        output_path=cli.output,
+        checkpoint_path=cli.checkpoint,
+        max_workers=cli.workers,
+        requests_per_sec=cli.rps,
     )
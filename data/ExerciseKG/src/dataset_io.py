@@ -0,0 +1,207 @@
+import bz2
+import glob
+import gzip
+import json
+import lzma
+import os
+from typing import Any, Dict, Iterable, Iterator
+
+# ============================================================
+# 共享数据集 I/O：所有 ingest 阶段都以迭代器读写，内存占用与数据集大小无关
+#
+# 支持：
+#   - JSON 数组（exrx_full_dataset.json 这类）：流式解析，不整体 json.load
+#   - JSONL / NDJSON：一行一条
+#   - .gz / .bz2 / .xz 压缩
+#   - 分片：目录或 glob（如 "../data/shards/*.jsonl.gz"），按文件名排序依次读取
+# ============================================================
+
+CHUNK_SIZE = 1 << 16
+
+_OPENERS = {
+    ".gz": gzip.open,
+    ".bz2": bz2.open,
+    ".xz": lzma.open,
+}
+
+_decoder = json.JSONDecoder()
+_NUMBER_TAIL = frozenset("0123456789+-.eE")
+
+
+def make_exercise_id(item: Dict[str, Any]) -> str:
+    """ExerciseVariant 的唯一 id（KG 导入、checkpoint 共用）"""
+    targets = "_".join(item.get("Muscles", {}).get("Target", []))
+    return f"{item['exercise_name']}__{item['body_part']}__{item['training_type']}__{targets}"
+
+
+def _split_ext(path: str):
+    """返回 (数据格式后缀, 压缩后缀)，如 a.jsonl.gz -> (".jsonl", ".gz")"""
+    base, ext = os.path.splitext(path)
+    if ext in _OPENERS:
+        return os.path.splitext(base)[1].lower(), ext
+    return ext.lower(), ""
+
+
+def open_text(path: str, mode: str = "r"):
+    _, comp = _split_ext(path)
+    opener = _OPENERS.get(comp, open)
+    return opener(path, mode + "t" if comp else mode, encoding="utf-8")
+
+
+def expand_paths(path: str):
+    """单文件 / 目录 / glob → 排好序的分片列表"""
+    if os.path.isdir(path):
+        return sorted(
+            os.path.join(path, name) for name in os.listdir(path)
+            if _split_ext(name)[0] in (".json", ".jsonl", ".ndjson")
+        )
+    if glob.has_magic(path):
+        return sorted(glob.glob(path))
+    return [path]
+
+
+# ============================================================
+# Readers
+# ============================================================
+def iter_json_array(fp, chunk_size: int = CHUNK_SIZE) -> Iterator[Any]:
+    """
+    流式解析顶层 JSON 数组，逐个 yield 元素。
+    缓冲区只保留当前尚未解析完的元素，已 yield 的部分立即丢弃。
+    """
+    buf = ""
+    pos = 0
+    eof = False
+
+    def _fill():
+        nonlocal buf, pos, eof
+        chunk = fp.read(chunk_size)
+        if not chunk:
+            eof = True
+        buf = buf[pos:] + chunk
+        pos = 0
+
+    def _skip_ws():
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos].isspace():
+                pos += 1
+            if pos < len(buf) or eof:
+                return
+            _fill()
+
+    _skip_ws()
+    if pos >= len(buf):
+        return
+    if buf[pos] != "[":
+        raise ValueError("Expected a top-level JSON array")
+    pos += 1
+
+    while True:
+        _skip_ws()
+        if pos >= len(buf):
+            raise ValueError("Unexpected end of JSON array")
+        if buf[pos] == "]":
+            return
+
+        while True:
+            try:
+                value, end = _decoder.raw_decode(buf, pos)
+                # 数字恰好落在缓冲区末尾时会被截断解析（"3." -> 3，"1e" -> 1）：
+                # 后面紧跟的不是 , / ]、而且剩下的还可能是数字的一部分，就继续读再解析
+                nxt = end
+                while nxt < len(buf) and buf[nxt].isspace():
+                    nxt += 1
+                if eof or (nxt < len(buf) and buf[nxt] in ",]") or not _NUMBER_TAIL.issuperset(buf[nxt:]):
+                    break
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            _fill()
+
+        pos = end
+        yield value
+
+        _skip_ws()
+        if pos < len(buf) and buf[pos] == ",":
+            pos += 1
+        elif pos < len(buf) and buf[pos] == "]":
+            return
+        else:
+            raise ValueError(f"Malformed JSON array near offset {pos}")
+
+
+def iter_jsonl(fp) -> Iterator[Any]:
+    for line in fp:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def iter_records(path: str) -> Iterator[Any]:
+    """按后缀自动选择 JSON 数组 / JSONL 读取，支持压缩与分片"""
+    for shard in expand_paths(path):
+        fmt, _ = _split_ext(shard)
+        with open_text(shard) as fp:
+            if fmt in (".jsonl", ".ndjson"):
+                yield from iter_jsonl(fp)
+            else:
+                yield from iter_json_array(fp)
+
+
+# ============================================================
+# Writers
+# ============================================================
+class RecordWriter:
+    """
+    增量写出：.jsonl 一行一条；.json 写成合法 JSON 数组（逐条追加，不在内存里攒整个列表）。
+    atomic=True 时先写临时文件，close 时再原子替换，避免中途崩溃留下半个文件；
+    atomic=False 直接写目标文件（配合 flush 让下游实时看到增量结果）。
+    """
+
+    def __init__(self, path: str, atomic: bool = True):
+        self.path = path
+        self.fmt, comp = _split_ext(path)
+        self.count = 0
+        self._tmp = f"{path}.tmp{comp}" if atomic else path
+        self._fp = open_text(self._tmp, "w")
+        if self.fmt == ".json":
+            self._fp.write("[")
+
+    def write(self, record: Any) -> None:
+        if self.fmt == ".json":
+            self._fp.write(",\n" if self.count else "\n")
+            self._fp.write(json.dumps(record, ensure_ascii=False))
+        else:
+            self._fp.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.count += 1
+
+    def flush(self) -> None:
+        self._fp.flush()
+
+    def close(self) -> None:
+        if self._fp.closed:
+            return
+        if self.fmt == ".json":
+            self._fp.write("\n]\n")
+        self._fp.close()
+        if self._tmp != self.path:
+            os.replace(self._tmp, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._fp.close()
+            if self._tmp != self.path:
+                os.remove(self._tmp)
+        return False
+
+
+def write_records(path: str, records: Iterable[Any]) -> int:
+    with RecordWriter(path) as w:
+        for r in records:
+            w.write(r)
+    return w.count
@@ -1,6 +1,16 @@
+import os
+import sys
+
 from neo4j import GraphDatabase
-import json
 from tqdm import tqdm
+from dataset_io import iter_records, make_exercise_id
+
+# 器械位掩码与线上推荐共用同一份词表（tools/exercise_tools/equipment.py）
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", ".."))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+from tools.exercise_tools.equipment import equipment_mask  # noqa: E402
+from tools.kg_cache import bump_kg_version  # noqa: E402
 
 
 # ============================================================
@@ -11,25 +21,19 @@ AUTH = ("neo4j", "password")
 INPUT_JSON = "../data/exrx_final.json"
 
 
-# ============================================================
-# Utility: build exercise_id
-# ============================================================
-def make_exercise_id(item):
-    targets = "_".join(item.get("Muscles", {}).get("Target", []))
-    return f"{item['exercise_name']}__{item['body_part']}__{item['training_type']}__{targets}"
-
-
 # ============================================================
 # Cypher: core ExerciseVariant
 # ============================================================
 BASE_QUERY = """
 MERGE (ev:ExerciseVariant {id: $exercise_id})
 SET ev.name = $exercise_name,
+    ev.url = $exercise_url,
     ev.instructions = $instructions,
     ev.utility = $utility,
     ev.mechanics = $mechanics,
     ev.force = $force,
-    ev.comments = $comments
+    ev.comments = $comments,
+    ev.equipment_mask = $equipment_mask
 
 MERGE (tbp:TrainingBodyPart {name: $body_part})
 MERGE (ev)-[:TRAINS_BODY_PART]->(tbp)
@@ -69,11 +73,8 @@ MERGE (ev)-[:INVOLVES_BODY_PART]->(ibp)
 def load_to_neo4j(uri, auth, json_file):
     driver = GraphDatabase.driver(uri, auth=auth)
 
-    with open(json_file, "r", encoding="utf-8") as f:
-        data = json.load(f)
-
     with driver.session() as session:
-        for item in tqdm(data, desc="Importing ExerciseVariants"):
+        for item in tqdm(iter_records(json_file), desc="Importing ExerciseVariants"):
 
             exercise_id = make_exercise_id(item)
             muscles = item.get("Muscles", {})
@@ -83,6 +84,7 @@ def load_to_neo4j(uri, auth, json_file):
                 BASE_QUERY,
                 exercise_id=exercise_id,
                 exercise_name=item["exercise_name"],
+                exercise_url=item.get("exercise_url"),
                 instructions=item.get("Instructions"),
                 utility=item.get("Utility"),
                 mechanics=item.get("Mechanics"),
@@ -90,6 +92,7 @@ def load_to_neo4j(uri, auth, json_file):
                 comments=item.get("Comments"),
                 body_part=item["body_part"],
                 training_type=item["training_type"],
+                equipment_mask=equipment_mask([item["training_type"]]),
             )
 
             # Step 2: muscles
@@ -115,6 +118,9 @@ def load_to_neo4j(uri, auth, json_file):
                     body_parts=instr_bps
                 )
 
+        # 线上的候选缓存按版本失效
+        bump_kg_version(session, "exercise")
+
     driver.close()
     print("🎉 ExerciseVariant Knowledge Graph imported successfully!")
 
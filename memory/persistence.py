@@ -2,7 +2,24 @@
 import json
 import os
 import tempfile
-from typing import Any, Dict
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+try:
+    import fcntl  # POSIX 上用 flock 做跨进程互斥
+except ImportError:  # Windows：只有进程内的锁
+    fcntl = None
+
+
+class VersionConflict(Exception):
+    """save_graph 时磁盘上的版本已经不是读出来时的版本（期间有别的写入）"""
+    def __init__(self, path: str, expected: int, actual: int):
+        super().__init__(f"{path}: expected version {expected}, found {actual}")
+        self.path = path
+        self.expected = expected
+        self.actual = actual
+
 
 def ensure_graph(g: Dict[str, Any]) -> Dict[str, Any]:
     if not isinstance(g, dict):
@@ -12,6 +29,85 @@ def ensure_graph(g: Dict[str, Any]) -> Dict[str, Any]:
     g.setdefault("events", [])
     return g
 
+
+def graph_version(g: Dict[str, Any]) -> int:
+    """每次 save_graph 落盘加一；旧文件没有该字段视为 0"""
+    return int(g.get("version", 0) or 0)
+
+
+# ============================================================
+# 每个图谱文件一把锁：进程内 RLock + <path>.lock 上的 flock
+# 同一线程可重入（update_graph 里再调 save_graph）
+# ============================================================
+class _PathLock:
+    def __init__(self, path: str):
+        self.lock_path = path + ".lock"
+        self._rlock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def acquire(self) -> None:
+        self._rlock.acquire()
+        self._depth += 1
+        if self._depth == 1 and fcntl is not None:
+            try:
+                os.makedirs(os.path.dirname(self.lock_path) or ".", exist_ok=True)
+                self._fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            except BaseException:
+                self._close()
+                self._depth -= 1
+                self._rlock.release()
+                raise
+
+    def release(self) -> None:
+        self._depth -= 1
+        if self._depth == 0:
+            self._close()
+        self._rlock.release()
+
+    def _close(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)  # 关闭即释放 flock
+            self._fd = None
+
+
+_path_locks: Dict[str, _PathLock] = {}
+_path_locks_guard = threading.Lock()
+
+
+def _reset_locks_after_fork() -> None:
+    # fork 出来的 worker 不继承父进程里其他线程持有的锁；
+    # 继承来的 flock fd 与父进程共享同一个锁，子进程里要关掉，否则父进程释放后锁仍被占着
+    global _path_locks, _path_locks_guard
+    for lock in _path_locks.values():
+        if lock._fd is not None:
+            try:
+                os.close(lock._fd)
+            except OSError:
+                pass
+    _path_locks = {}
+    _path_locks_guard = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_locks_after_fork)
+
+
+@contextmanager
+def graph_lock(path: str):
+    key = os.path.abspath(path)
+    with _path_locks_guard:
+        lock = _path_locks.get(key)
+        if lock is None:
+            lock = _path_locks[key] = _PathLock(key)
+    lock.acquire()
+    try:
+        yield
+    finally:
+        lock.release()
+
+
 def load_graph(path: str, default: Dict[str, Any]) -> Dict[str, Any]:
     if not path or not os.path.exists(path):
         return ensure_graph(default)
@@ -19,19 +115,57 @@ def load_graph(path: str, default: Dict[str, Any]) -> Dict[str, Any]:
         data = json.load(f)
     return ensure_graph(data)
 
-def save_graph(path: str, graph: Dict[str, Any]) -> None:
+
+def _disk_version(path: str) -> int:
+    if not os.path.exists(path):
+        return 0
+    with open(path, "r", encoding="utf-8") as f:
+        return graph_version(json.load(f))
+
+
+def save_graph(path: str, graph: Dict[str, Any], expected_version: Optional[int] = None) -> int:
+    """
+    expected_version: 传入读取时的版本号（graph_version(graph)）即做乐观并发检查，
+    磁盘上已被别人改过时抛 VersionConflict；不传则直接覆盖（last writer wins）。
+    返回写入后的版本号（graph["version"] 同步更新）。
+    """
     os.makedirs(os.path.dirname(path), exist_ok=True)
     graph = ensure_graph(graph)
 
-    # atomic write: write temp then replace
-    fd, tmp_path = tempfile.mkstemp(prefix="tmp_", suffix=".json", dir=os.path.dirname(path))
-    try:
-        with os.fdopen(fd, "w", encoding="utf-8") as f:
-            json.dump(graph, f, ensure_ascii=False, indent=2)
-        os.replace(tmp_path, path)
-    finally:
-        if os.path.exists(tmp_path):
-            try:
-                os.remove(tmp_path)
-            except Exception:
-                pass
\ No newline at end of file
+    with graph_lock(path):
+        if expected_version is not None:
+            current = _disk_version(path)
+            if current != expected_version:
+                raise VersionConflict(path, expected_version, current)
+            graph["version"] = current + 1
+        else:
+            graph["version"] = graph_version(graph) + 1
+
+        # atomic write: write temp then replace
+        fd, tmp_path = tempfile.mkstemp(prefix="tmp_", suffix=".json", dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(graph, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                try:
+                    os.remove(tmp_path)
+                except Exception:
+                    pass
+    return graph["version"]
+
+
+def update_graph(path: str, fn: Callable[[Dict[str, Any]], Optional[Dict[str, Any]]],
+                 default: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """
+    加锁的读-改-写：fn 拿到磁盘上最新的图谱，返回要写入的图谱；返回 None 表示不写。
+    锁内不会有并发写入，版本检查只防住不走锁的写入者。
+    """
+    with graph_lock(path):
+        graph = load_graph(path, default if default is not None else {})
+        updated = fn(graph)
+        if updated is None:
+            return None
+        save_graph(path, updated, expected_version=graph_version(graph))
+        return updated
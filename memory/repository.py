@@ -0,0 +1,150 @@
+# memory/repository.py
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from copy import deepcopy
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from memory.graph_store import new_graph
+from memory.persistence import graph_lock, graph_version, load_graph, save_graph, update_graph
+
+# ============================================================
+# 按用户划分的记忆图谱仓库
+#
+# - 存储：<root>/<sha1(user)[:2]>/<safe_id>.json，256 个分片目录，单目录不会堆上万个文件；
+#   DEFAULT_USER 沿用单用户时代的 data/user_memory_graph.json
+# - 并发：写入都走 memory.persistence 的文件锁（进程内 + flock，多 worker 共享目录也安全），
+#   save() 默认带乐观版本检查，读出来之后被别人写过就抛 VersionConflict 而不是覆盖
+# - 缓存：最近访问的 CACHE_SIZE 个用户图谱留在内存（LRU），按文件 mtime/size 校验，
+#   其他进程写入后自动失效
+# ============================================================
+
+DEFAULT_USER = "default"
+SHARD_CHARS = 2
+CACHE_SIZE = int(os.getenv("MEMORY_CACHE_SIZE", "256"))
+
+
+def safe_id(user_id: str) -> str:
+    safe = re.sub(r"[^0-9A-Za-z_.-]", "_", user_id)[:64]
+    if safe != user_id:
+        # 清洗后可能撞名，补一段原始 id 的哈希
+        safe += "-" + hashlib.sha1(user_id.encode("utf-8")).hexdigest()[:8]
+    return safe
+
+
+def _stamp(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+class MemoryRepository:
+    def __init__(self, root: str, aliases: Optional[Dict[str, str]] = None, cache_size: int = CACHE_SIZE):
+        self.root = root
+        self.aliases = dict(aliases or {})
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, Tuple[Tuple[int, int], Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # ------------------------------------------------------------
+    # 路径
+    # ------------------------------------------------------------
+    def path(self, user_id: str) -> str:
+        if user_id in self.aliases:
+            return self.aliases[user_id]
+        shard = hashlib.sha1(user_id.encode("utf-8")).hexdigest()[:SHARD_CHARS]
+        return os.path.join(self.root, shard, f"{safe_id(user_id)}.json")
+
+    # ------------------------------------------------------------
+    # 读
+    # ------------------------------------------------------------
+    def peek(self, user_id: str) -> Dict[str, Any]:
+        """返回缓存里的对象本身，只读（要修改请用 load）"""
+        path = self.path(user_id)
+        stamp = _stamp(path)
+        if stamp is None:
+            return new_graph()
+
+        with self._lock:
+            hit = self._cache.get(user_id)
+            if hit is not None and hit[0] == stamp:
+                self._cache.move_to_end(user_id)
+                self.hits += 1
+                return hit[1]
+            self.misses += 1
+
+        graph = load_graph(path, new_graph())
+        self._put(user_id, stamp, graph)
+        return graph
+
+    def load(self, user_id: str) -> Dict[str, Any]:
+        """可修改的副本；改完用 save() 写回（带版本检查）"""
+        return deepcopy(self.peek(user_id))
+
+    def version(self, user_id: str) -> int:
+        return graph_version(self.peek(user_id))
+
+    # ------------------------------------------------------------
+    # 写
+    # ------------------------------------------------------------
+    def save(self, user_id: str, graph: Dict[str, Any], check_version: bool = True) -> int:
+        """
+        check_version=True：graph 必须基于磁盘上的最新版本（load 之后没人写过），
+        否则抛 memory.persistence.VersionConflict
+        """
+        path = self.path(user_id)
+        with graph_lock(path):
+            version = save_graph(path, graph, expected_version=graph_version(graph) if check_version else None)
+            self._put(user_id, _stamp(path), deepcopy(graph))
+        return version
+
+    def update(self, user_id: str, fn: Callable[[Dict[str, Any]], Optional[Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+        """加锁读-改-写，fn 拿到最新图谱，返回要写入的图谱（None 不写）"""
+        path = self.path(user_id)
+        with graph_lock(path):
+            updated = update_graph(path, fn, new_graph())
+            if updated is not None:
+                self._put(user_id, _stamp(path), deepcopy(updated))
+        return updated
+
+    def invalidate(self, user_id: Optional[str] = None) -> None:
+        with self._lock:
+            if user_id is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(user_id, None)
+
+    # ------------------------------------------------------------
+    # 内部
+    # ------------------------------------------------------------
+    def _put(self, user_id: str, stamp: Optional[Tuple[int, int]], graph: Dict[str, Any]) -> None:
+        if stamp is None:
+            return
+        with self._lock:
+            self._cache[user_id] = (stamp, graph)
+            self._cache.move_to_end(user_id)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+
+_repos: Dict[str, MemoryRepository] = {}
+_repos_lock = threading.Lock()
+
+
+def get_repository(data_dir: str) -> MemoryRepository:
+    """进程级单例（按 data_dir）"""
+    key = os.path.abspath(data_dir)
+    with _repos_lock:
+        repo = _repos.get(key)
+        if repo is None:
+            repo = _repos[key] = MemoryRepository(
+                os.path.join(data_dir, "users"),
+                aliases={DEFAULT_USER: os.path.join(data_dir, "user_memory_graph.json")},
+            )
+        return repo
@@ -0,0 +1,345 @@
+# memory/update_queue.py
+import contextvars
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+import traceback
+from typing import Any, Callable, Dict, Optional
+
+try:
+    import fcntl  # POSIX 上用 flock 选出执行 job 的进程
+except ImportError:  # Windows：只支持单进程，本进程直接执行
+    fcntl = None
+
+# ============================================================
+# 记忆更新后台队列
+#
+# - 持久化：每个 job 先落盘到 <root>/pending/<seq>-<key>.json 再入内存队列，
+#   完成后把 key 追加到 done.jsonl 并删除 pending 文件；进程重启时按 seq 重放 pending。
+# - 顺序：同一个 user（= 记忆文件路径）固定落在同一个 worker 线程，保证按提交顺序执行。
+# - 幂等：相同 idempotency key 的 job（pending 中或已完成）重复提交直接忽略；
+#   handler 拿到 key，可在写入结果里记录（见 mark_applied），崩溃重放时跳过已落地的 job。
+# - 通知：每个 user 维护一个已完成计数 version()，页面 rerun 时对比即可知道有新结果落地。
+# - 上下文：submit 时复制当前 contextvars（注入的 cfg 等），handler 在其中执行；
+#   重放的 job / 其他进程提交的 job 没有提交时的上下文，按进程级配置执行。
+# - 多进程（多个 server worker 共享 DATA_DIR）：<root>/owner.lock 上的 flock 选出唯一的 owner，
+#   只有 owner 执行 job。所有进程的 submit 都只写 pending 文件；owner 在 submit / 轮询时
+#   按 seq 顺序扫描 pending 目录入队（同一 user 的轮次由 pipeline 的跨进程用户锁串行，seq 即提交顺序）。
+#   owner 退出后锁释放，其他进程的轮询线程接手。各进程 tail done.jsonl 更新自己提交的 job 的状态。
+# ============================================================
+
+NUM_WORKERS = 2
+MAX_ATTEMPTS = 3
+RETRY_BACKOFF_S = 2.0
+POLL_S = 0.5                 # 扫描 pending / done.jsonl、争取 owner 的间隔
+
+Handler = Callable[[str, Dict[str, Any]], None]   # (job key, payload)
+APPLIED_KEYS_KEEP = 200
+
+
+def idempotency_key(*parts: Any) -> str:
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:20]
+
+
+def already_applied(graph: Dict[str, Any], key: str) -> bool:
+    return key in graph.get("applied_jobs", [])
+
+
+def mark_applied(graph: Dict[str, Any], key: str) -> None:
+    """把 job key 记进图谱本身，与图谱在同一次原子写入中落盘"""
+    keys = graph.setdefault("applied_jobs", [])
+    keys.append(key)
+    del keys[:-APPLIED_KEYS_KEEP]
+
+
+class MemoryUpdateQueue:
+    def __init__(self, root: str, num_workers: int = NUM_WORKERS):
+        self.root = root
+        self.pending_dir = os.path.join(root, "pending")
+        self.failed_dir = os.path.join(root, "failed")
+        self.done_path = os.path.join(root, "done.jsonl")
+        self.owner_lock_path = os.path.join(root, "owner.lock")
+        os.makedirs(self.pending_dir, exist_ok=True)
+        os.makedirs(self.failed_dir, exist_ok=True)
+
+        self._handlers: Dict[str, Handler] = {}
+        self._lock = threading.Lock()
+        self._scan_lock = threading.Lock()
+        self._seq = time.time_ns()
+        self._num_workers = num_workers
+        self._queues = [queue.Queue() for _ in range(num_workers)]
+        self._pending_keys = set()
+        self._pending_by_user: Dict[str, int] = {}
+        self._enqueued = set()                          # owner：已放进内存队列的 key
+        self._contexts: Dict[str, contextvars.Context] = {}
+        self._done_keys = set()
+        self._done_offset = 0
+        self._versions: Dict[str, int] = {}
+        self._last_error: Dict[str, str] = {}
+        self._owner_fd = None
+        self.is_owner = False
+        self._started = False
+        self._tail_done()
+
+    # ------------------------------------------------------------
+    # 注册 / 启动
+    # ------------------------------------------------------------
+    def register(self, kind: str, handler: Handler) -> None:
+        self._handlers[kind] = handler
+
+    def start(self) -> None:
+        """争取成为 owner（是则启动 worker 并重放 pending），并启动轮询线程"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+
+        self._try_own()
+        threading.Thread(target=self._poll, name="memory-update-poll", daemon=True).start()
+
+    def _try_own(self) -> bool:
+        if self.is_owner:
+            return True
+        if fcntl is not None:
+            fd = os.open(self.owner_lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                return False
+            self._owner_fd = fd      # 进程存活期间一直持有
+        self.is_owner = True
+        print(f"[MemoryQueue] pid {os.getpid()} owns {self.root}")
+
+        for i, q in enumerate(self._queues):
+            threading.Thread(target=self._worker, args=(q,), name=f"memory-update-{i}", daemon=True).start()
+        self._scan_pending()
+        return True
+
+    def _poll(self) -> None:
+        while True:
+            time.sleep(POLL_S)
+            try:
+                if self._try_own():
+                    self._scan_pending()
+                self._tail_done()
+            except Exception as e:
+                print(f"[MemoryQueue] poll error: {e}")
+
+    # ------------------------------------------------------------
+    # 提交
+    # ------------------------------------------------------------
+    def submit(self, kind: str, user: str, payload: Dict[str, Any], key: Optional[str] = None) -> Optional[str]:
+        """
+        user: 记忆图谱文件路径（同一 user 的 job 严格有序）
+        返回 job key；同 key 已提交过时返回 None
+        """
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown memory job kind: {kind}")
+        key = key or idempotency_key(kind, user, payload)
+
+        with self._lock:
+            if key in self._pending_keys or key in self._done_keys:
+                return None
+            self._pending_keys.add(key)
+            self._pending_by_user[user] = self._pending_by_user.get(user, 0) + 1
+            self._seq = max(self._seq + 1, time.time_ns())
+            seq = self._seq
+            self._contexts[key] = contextvars.copy_context()
+
+        job = {"seq": seq, "key": key, "kind": kind, "user": user, "payload": payload, "attempts": 0}
+        path = os.path.join(self.pending_dir, f"{seq:020d}-{key}.json")
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(job, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+        # 不直接入队：和其他进程提交的 job 一起按 seq 排序后入队
+        self._scan_pending()
+        return key
+
+    # ------------------------------------------------------------
+    # 状态查询（页面轮询用）
+    # ------------------------------------------------------------
+    def version(self, user: str) -> int:
+        """本进程提交（owner 还包括其他进程提交）的该 user 已落地的 job 数，变化即说明记忆文件已更新"""
+        return self._versions.get(user, 0)
+
+    def pending_count(self, user: Optional[str] = None) -> int:
+        if user is None:
+            return len(self._pending_keys)
+        return self._pending_by_user.get(user, 0)
+
+    def last_error(self, user: str) -> Optional[str]:
+        return self._last_error.get(user)
+
+    def wait_idle(self, timeout: Optional[float] = None) -> bool:
+        deadline = None if timeout is None else time.time() + timeout
+        while self._pending_keys:
+            if deadline is not None and time.time() > deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    # ------------------------------------------------------------
+    # 内部
+    # ------------------------------------------------------------
+    def _shard(self, user: str) -> queue.Queue:
+        h = int(hashlib.md5(user.encode("utf-8")).hexdigest(), 16)
+        return self._queues[h % len(self._queues)]
+
+    def _scan_pending(self) -> None:
+        """owner：把 pending 目录里还没入队的 job 按 seq 入队"""
+        if not self.is_owner:
+            return
+        with self._scan_lock:
+            for name in sorted(os.listdir(self.pending_dir)):
+                if not name.endswith(".json"):
+                    continue
+                key = name[:-len(".json")].split("-", 1)[-1]
+                if key in self._enqueued:
+                    continue
+                path = os.path.join(self.pending_dir, name)
+                if key in self._done_keys:
+                    self._remove_pending(path)      # 完成后没删掉的残留
+                    continue
+                try:
+                    with open(path, "r", encoding="utf-8") as f:
+                        job = json.load(f)
+                except FileNotFoundError:
+                    continue
+                except Exception as e:
+                    print(f"[MemoryQueue] Skip unreadable job {name}: {e}")
+                    continue
+
+                with self._lock:
+                    if job["key"] not in self._pending_keys:
+                        # 其他进程提交的 / 上次进程没做完的
+                        self._pending_keys.add(job["key"])
+                        self._pending_by_user[job["user"]] = self._pending_by_user.get(job["user"], 0) + 1
+                    job["_ctx"] = self._contexts.pop(job["key"], None)
+                    self._enqueued.add(key)
+                job["_path"] = path
+                self._shard(job["user"]).put(job)
+
+    def _tail_done(self) -> None:
+        """读 done.jsonl 新增的完整行（owner 写入），结算本进程还在等的 job"""
+        if not os.path.exists(self.done_path):
+            return
+        with open(self.done_path, "rb") as f:
+            f.seek(self._done_offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1
+        if not end:
+            return
+        self._done_offset += end
+        for line in data[:end].decode("utf-8", errors="replace").splitlines():
+            try:
+                record = json.loads(line)
+                record["key"]
+            except Exception:
+                continue
+            with self._lock:
+                if record["key"] not in self._done_keys:
+                    self._settle(record)
+
+    def _settle(self, record: Dict[str, Any]) -> None:
+        """调用方持有 self._lock"""
+        key, user = record["key"], record.get("user")
+        self._done_keys.add(key)
+        self._enqueued.discard(key)
+        self._contexts.pop(key, None)
+        if key not in self._pending_keys:
+            return
+        self._pending_keys.discard(key)
+        self._pending_by_user[user] = self._pending_by_user.get(user, 1) - 1
+        if record.get("status") == "ok":
+            self._versions[user] = self._versions.get(user, 0) + 1
+            self._last_error.pop(user, None)
+        else:
+            self._last_error[user] = record.get("error") or "failed"
+
+    def _mark_done(self, job: Dict[str, Any], status: str, error: Optional[str] = None) -> None:
+        record = {"key": job["key"], "kind": job["kind"], "user": job["user"],
+                  "status": status, "ts": int(time.time())}
+        if error:
+            record["error"] = error
+        with self._lock:
+            with open(self.done_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._settle(record)
+
+    def _worker(self, q: queue.Queue) -> None:
+        while True:
+            job = q.get()
+            try:
+                self._run_job(job)
+            except Exception as e:
+                # 兜底：worker 线程不能退出，否则落在这个分片上的用户后续 job 全部卡住
+                print(f"[MemoryQueue] worker error on {job.get('kind')} {job.get('key')}: {e}")
+                traceback.print_exc()
+                try:
+                    self._mark_done(job, "failed", f"{type(e).__name__}: {e}")
+                except Exception:
+                    traceback.print_exc()
+            finally:
+                q.task_done()
+
+    def _run_job(self, job: Dict[str, Any]) -> None:
+        path = job.pop("_path")
+        ctx = job.pop("_ctx", None) or contextvars.Context()
+        while True:
+            job["attempts"] += 1
+            try:
+                ctx.run(self._handlers[job["kind"]], job["key"], job["payload"])
+            except Exception as e:
+                print(f"[MemoryQueue] {job['kind']} {job['key']} failed (attempt {job['attempts']}): {e}")
+                traceback.print_exc()
+                if job["attempts"] >= MAX_ATTEMPTS:
+                    self._move_to_failed(path)
+                    self._mark_done(job, "failed", f"{type(e).__name__}: {e}")
+                    return
+                # 同一 user 后面的 job 必须等这个结束，原地重试保证顺序
+                time.sleep(RETRY_BACKOFF_S * job["attempts"])
+                continue
+
+            # handler 已成功：清理 pending 文件不属于重试范围，文件不在了也算完成
+            self._remove_pending(path)
+            self._mark_done(job, "ok")
+            return
+
+    @staticmethod
+    def _remove_pending(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            # 留下的文件会被扫描时按 done 跳过；重启后重放时 handler 按 applied_jobs 跳过
+            print(f"[MemoryQueue] Could not remove {path}: {e}")
+
+    def _move_to_failed(self, path: str) -> None:
+        try:
+            os.replace(path, os.path.join(self.failed_dir, os.path.basename(path)))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"[MemoryQueue] Could not move {path} to failed/: {e}")
+
+
+_queue: Optional[MemoryUpdateQueue] = None
+_queue_lock = threading.Lock()
+
+
+def get_update_queue(root: str) -> MemoryUpdateQueue:
+    """进程级单例（streamlit 每次 rerun 都会执行 app.py）"""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = MemoryUpdateQueue(root)
+    return _queue
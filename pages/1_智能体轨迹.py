@@ -1,9 +1,98 @@
 # pages/1_Trace.py
+import altair as alt
+import pandas as pd
 import streamlit as st
+from datetime import datetime
 from core.json_utils import dumps
+from core.tracing import turn_total_ms, turn_token_usage
 
 st.title("Multi-Agent Trace")
 
+# ============================================================
+# 1️⃣ Span 瀑布图（core.tracing，按轮次）
+# ============================================================
+KIND_COLORS = {
+    "stage": "#4C78A8",
+    "agent": "#F58518",
+    "llm": "#E45756",
+    "kg": "#54A24B",
+    "phase": "#B279A2",
+}
+
+
+def _span_rows(turn):
+    spans = sorted(turn.get("spans", []), key=lambda s: (s["start_ms"], s["id"]))
+    depth = {}
+    rows = []
+    for i, s in enumerate(spans):
+        d = depth.get(s["parent"], -1) + 1
+        depth[s["id"]] = d
+        ms = s["ms"] if s["ms"] is not None else 0.0
+        attrs = s.get("attrs", {})
+        rows.append({
+            "order": i,
+            "span": f"{i:02d} " + "  " * d + s["name"],
+            "kind": s["kind"],
+            "start_ms": s["start_ms"],
+            "end_ms": s["start_ms"] + ms,
+            "ms": ms,
+            "tokens": (attrs.get("prompt_tokens") or 0) + (attrs.get("completion_tokens") or 0),
+            "attrs": dumps(attrs) if attrs else "",
+            "error": s.get("error") or "",
+        })
+    return rows
+
+
+turns = st.session_state.get("turn_traces", [])
+
+st.subheader("⏱️ Span Waterfall")
+if not turns:
+    st.info("暂无 span 记录。先去主页面聊一句。")
+else:
+    labels = [
+        f"#{i + 1} {datetime.fromtimestamp(t['ts']).strftime('%H:%M:%S')} · {t['name'][:30]}"
+        for i, t in enumerate(turns)
+    ]
+    idx = st.selectbox("选择轮次", range(len(turns)), index=len(turns) - 1, format_func=lambda i: labels[i])
+    turn = turns[idx]
+    rows = _span_rows(turn)
+
+    if not rows:
+        st.info("该轮没有记录到 span。")
+    else:
+        df = pd.DataFrame(rows)
+        usage = turn_token_usage(turn)
+
+        c1, c2, c3, c4 = st.columns(4)
+        c1.metric("总耗时", f"{turn_total_ms(turn) / 1000:.2f} s")
+        c2.metric("LLM", f"{df[df.kind == 'llm'].ms.sum() / 1000:.2f} s · {int((df.kind == 'llm').sum())} 次")
+        c3.metric("Neo4j", f"{df[df.kind == 'kg'].ms.sum() / 1000:.2f} s · {int((df.kind == 'kg').sum())} 次")
+        c4.metric("Tokens", f"{usage['prompt_tokens']} / {usage['completion_tokens']}", help="prompt / completion")
+
+        chart = alt.Chart(df).mark_bar().encode(
+            x=alt.X("start_ms:Q", title="ms"),
+            x2="end_ms:Q",
+            y=alt.Y("span:N", sort=alt.SortField("order"), title=None),
+            color=alt.Color(
+                "kind:N",
+                scale=alt.Scale(domain=list(KIND_COLORS), range=list(KIND_COLORS.values())),
+            ),
+            tooltip=["span", "kind", "start_ms", "ms", "tokens", "attrs", "error"],
+        ).properties(height=max(120, 22 * len(df)))
+        st.altair_chart(chart, width='stretch')
+
+        with st.expander("Span 明细"):
+            st.dataframe(
+                df[["span", "kind", "start_ms", "ms", "tokens", "attrs", "error"]],
+                width='stretch',
+                hide_index=True,
+            )
+
+# ============================================================
+# 2️⃣ Agent 输出（run_agent 写入的 trace）
+# ============================================================
+st.subheader("🧩 Agent Steps")
+
 # 获取 session 中的 trace
 trace = st.session_state.get("trace", [])
 
@@ -16,12 +105,12 @@ else:
         step = item.get("step", "?")
         agent = item.get("agent", "Unknown Agent")
         ms = item.get("ms", 0)
-        
+
         # 关键修正：这里要取 "parsed"
-        content_to_show = item.get("parsed") 
+        content_to_show = item.get("parsed")
         if content_to_show is None:
              # 如果解析失败或者旧数据只有 raw，就取 raw
             content_to_show = item.get("raw", "No content")
 
         with st.expander(f"Step {step} - {agent} ({ms} ms)"):
-            st.code(dumps(content_to_show), language="json")
\ No newline at end of file
+            st.code(dumps(content_to_show), language="json")
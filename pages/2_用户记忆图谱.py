@@ -5,12 +5,15 @@ import json
 import os
 import time
 from datetime import datetime, timezone, timedelta
-from memory.persistence import load_graph, save_graph
-from memory.graph_store import new_graph, summarize
+from memory.persistence import VersionConflict
+from memory.repository import DEFAULT_USER, get_repository
+from memory.graph_store import summarize
 
 # === Config ===
 DATA_DIR = os.getenv("DATA_DIR", "./data")
-PATH_USER = os.path.join(DATA_DIR, "user_memory_graph_base.json")
+# 与主页同一个用户（主页按 ?user= 写入 session）
+repo = get_repository(DATA_DIR)
+USER_ID = st.session_state.get("user_id") or st.query_params.get("user", DEFAULT_USER)
 
 # ★★★ 定义东八区时区 ★★★
 TZ_CN = timezone(timedelta(hours=8))
@@ -43,7 +46,7 @@ def update_node_prop(graph, node_id, new_props, merge=True):
 
 # === Load Data ===
 if "user_memory_graph" not in st.session_state:
-    st.session_state.user_memory_graph = load_graph(PATH_USER, new_graph())
+    st.session_state.user_memory_graph = repo.load(USER_ID)
 
 ug = st.session_state.user_memory_graph
 mem_sum = summarize(ug)
@@ -101,7 +104,13 @@ with tab_profile:
             eq_list = [x.strip() for x in new_equips_str.replace("，", ",").split(",") if x.strip()]
             update_node_prop(ug, "constraint:equipment", {"items": eq_list})
             
-            save_graph(PATH_USER, ug)
+            try:
+                # 乐观检查：页面打开后后台记忆写入已落盘时不覆盖，重新加载后再改
+                repo.save(USER_ID, ug)
+            except VersionConflict:
+                st.session_state.user_memory_graph = repo.load(USER_ID)
+                st.warning("⚠️ 记忆刚被后台更新过，已重新加载，请确认后再保存一次。")
+                st.stop()
             st.session_state.user_memory_graph = ug
             st.toast("✅ 档案已更新！")
             time.sleep(1)
@@ -1,5 +1,6 @@
 import streamlit as st
 from core.config import get_cfg
+from core import resources
 
 st.title("Settings（前端填写）")
 cfg = get_cfg()
@@ -10,4 +11,11 @@ cfg["model"] = st.text_input("Model", value=cfg.get("model","gpt-4.1"))
 
 if st.button("保存设置"):
     st.session_state.cfg = cfg
-    st.success("已保存到本次会话（session）")
\ No newline at end of file
+    st.success("已保存到本次会话（session）")
+
+st.divider()
+st.caption(f"进程内共享缓存：{resources.stats() or '空'}")
+if st.button("重新加载 KG 连接 / 本地快照 / 词表缓存"):
+    # 下次使用时按当前配置重建（其他 session 也会跟着重建）
+    n = resources.invalidate()
+    st.success(f"已清空 {n} 项缓存")
\ No newline at end of file
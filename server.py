@@ -0,0 +1,277 @@
+# server.py
+"""Headless HTTP front-end for agents.pipeline.Pipeline (no streamlit UI).
+
+    python server.py --port 8080                 # stdlib ThreadingHTTPServer
+    uvicorn server:asgi_app --workers 4          # 任意 ASGI server
+
+多个 worker 共享同一个 DATA_DIR（会话 + 记忆图谱都在里面），前面挂负载均衡即可：
+同一用户的请求按文件锁跨进程串行，记忆 job 由持有 memory_jobs/owner.lock 的 worker 统一执行。
+
+    POST /v1/chat           {"user_id", "message", "stream": true}
+                            stream=true 时返回 NDJSON（每行一个事件，最后一行 event=done）
+    POST /v1/plan/accept    {"user_id"}
+    GET  /v1/memory?user_id=...
+    GET  /healthz
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from core.config import configure, load_cfg_from_env
+from core import metrics
+
+from agents.pipeline import DEFAULT_USER, get_pipeline
+from memory.graph_store import summarize
+
+# cfg 由环境变量注入（后台记忆 job 重放时也用这份）
+configure(load_cfg_from_env())
+
+NDJSON = "application/x-ndjson; charset=utf-8"
+JSON = "application/json; charset=utf-8"
+MAX_BODY_BYTES = 1 << 20
+
+# 只给进程内调用方的字段，不出网
+_PRIVATE_FIELDS = ("state", "graph")
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def _public(event: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v for k, v in event.items() if k not in _PRIVATE_FIELDS}
+
+
+def _ndjson(event: Dict[str, Any]) -> bytes:
+    return (json.dumps(_public(event), ensure_ascii=False, default=str) + "\n").encode("utf-8")
+
+
+def _user_id(data: Dict[str, Any]) -> str:
+    user_id = str(data.get("user_id") or DEFAULT_USER).strip()
+    if not user_id:
+        raise HTTPError(400, "user_id is required")
+    return user_id
+
+
+# ============================================================
+# 路由（两种前端共用）
+# 返回 (status, content_type, body)；body 是 bytes 或逐块产出 bytes 的迭代器
+# ============================================================
+def dispatch(method: str, target: str, body: bytes) -> Tuple[int, str, Any]:
+    url = urlparse(target)
+    pipeline = get_pipeline()
+
+    if method == "GET" and url.path == "/healthz":
+        return 200, JSON, b'{"ok": true}'
+
+    if method == "GET" and url.path == "/v1/memory":
+        user_id = _user_id({k: v[0] for k, v in parse_qs(url.query).items()})
+        data = {
+            "user_id": user_id,
+            "summary": summarize(pipeline.load_user_graph(user_id)),
+            "status": pipeline.memory_status(user_id),
+        }
+        return 200, JSON, json.dumps(data, ensure_ascii=False, default=str).encode("utf-8")
+
+    if method != "POST":
+        raise HTTPError(404, f"{method} {url.path} not found")
+
+    try:
+        data = json.loads(body or b"{}")
+    except ValueError:
+        raise HTTPError(400, "body must be JSON")
+    if not isinstance(data, dict):
+        raise HTTPError(400, "body must be a JSON object")
+
+    if url.path == "/v1/chat":
+        user_id = _user_id(data)
+        message = str(data.get("message") or "").strip()
+        if not message:
+            raise HTTPError(400, "message is required")
+        if data.get("stream", True):
+            return 200, NDJSON, (_ndjson(e) for e in pipeline.handle_stream(user_id, message))
+        result = pipeline.handle(user_id, message)
+        return 200, JSON, json.dumps(_public(result), ensure_ascii=False, default=str).encode("utf-8")
+
+    if url.path == "/v1/plan/accept":
+        user_id = _user_id(data)
+        key = pipeline.accept_plan(user_id)
+        if key is None:
+            raise HTTPError(409, "no pending plan (or already accepted)")
+        return 202, JSON, json.dumps({"user_id": user_id, "memory_job": key}).encode("utf-8")
+
+    raise HTTPError(404, f"{method} {url.path} not found")
+
+
+def _error_body(status: int, message: str) -> bytes:
+    return json.dumps({"error": message, "status": status}, ensure_ascii=False).encode("utf-8")
+
+
+def _safe_dispatch(method: str, target: str, body: bytes) -> Tuple[int, str, Any]:
+    try:
+        return dispatch(method, target, body)
+    except HTTPError as e:
+        return e.status, JSON, _error_body(e.status, str(e))
+    except Exception as e:
+        print(f"[Server] {method} {target} failed: {e}")
+        return 500, JSON, _error_body(500, f"{type(e).__name__}: {e}")
+
+
+def _stream_errors(chunks: Iterator[bytes]) -> Iterator[bytes]:
+    """流已经开始后出错，只能以一条 error 事件收尾"""
+    try:
+        yield from chunks
+    except Exception as e:
+        print(f"[Server] stream failed: {e}")
+        yield _ndjson({"event": "error", "message": f"{type(e).__name__}: {e}"})
+
+
+# ============================================================
+# stdlib 前端
+# ============================================================
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # chunked 需要 1.1
+
+    def _handle(self, method: str) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY_BYTES:
+            status, ctype, body = 413, JSON, _error_body(413, "body too large")
+        else:
+            status, ctype, body = _safe_dispatch(method, self.path, self.rfile.read(length) if length else b"")
+
+        self.send_response(status)
+        self.send_header("Content-Type", ctype)
+        if isinstance(body, bytes):
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        self.send_header("Transfer-Encoding", "chunked")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        try:
+            for chunk in _stream_errors(body):
+                self.wfile.write(f"{len(chunk):X}\r\n".encode("ascii") + chunk + b"\r\n")
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端断开：关掉生成器，pipeline 的 finally（end_turn / 保存会话）照常执行
+            body.close()
+            self.close_connection = True
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(host: str = "127.0.0.1", port: int = 8080) -> None:
+    get_pipeline()  # 启动时就加载 KG / 拉起记忆队列，而不是第一个请求
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    print(f"[Server] HealthKG pipeline listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+# ============================================================
+# ASGI 前端（pipeline 是同步的，放到线程里跑，逐个事件转发）
+# ============================================================
+_SENTINEL = object()
+
+
+async def asgi_app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await asyncio.to_thread(get_pipeline)
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    if scope["type"] != "http":
+        return
+
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if len(body) > MAX_BODY_BYTES:
+            await _asgi_send(send, 413, JSON, _error_body(413, "body too large"))
+            return
+        if not message.get("more_body"):
+            break
+
+    target = scope["path"] + ("?" + scope["query_string"].decode("latin-1") if scope.get("query_string") else "")
+    status, ctype, payload = await asyncio.to_thread(_safe_dispatch, scope["method"], target, body)
+    if isinstance(payload, bytes):
+        await _asgi_send(send, status, ctype, payload)
+        return
+
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", ctype.encode()), (b"cache-control", b"no-cache")]})
+    # 生成器内部设置了 contextvars（cfg / trace turn），必须在同一个线程里从头跑到尾，
+    # 不能每步 to_thread（每次都是新的上下文副本）
+    loop = asyncio.get_running_loop()
+    chunks: asyncio.Queue = asyncio.Queue()
+    disconnected = threading.Event()
+
+    def _produce():
+        gen = _stream_errors(payload)
+        try:
+            for chunk in gen:
+                if disconnected.is_set():
+                    break
+                loop.call_soon_threadsafe(chunks.put_nowait, chunk)
+        finally:
+            gen.close()
+            loop.call_soon_threadsafe(chunks.put_nowait, _SENTINEL)
+
+    threading.Thread(target=_produce, name="asgi-stream", daemon=True).start()
+    try:
+        while True:
+            chunk = await chunks.get()
+            if chunk is _SENTINEL:
+                break
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+    except OSError:
+        disconnected.set()
+        raise
+
+
+async def _asgi_send(send, status: int, ctype: str, body: bytes) -> None:
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", ctype.encode()), (b"content-length", str(len(body)).encode())]})
+    await send({"type": "http.response.body", "body": body})
+
+
+def main(argv: Optional[list] = None) -> None:
+    parser = argparse.ArgumentParser(description="HealthKG headless pipeline server")
+    parser.add_argument("--host", default=os.getenv("HEALTHKG_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("HEALTHKG_PORT", "8080")))
+    args = parser.parse_args(argv)
+    metrics.maybe_enable()
+    serve(args.host, args.port)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,359 @@
+# tools/candidate_tables.py
+"""Materialized recommendation candidate tables.
+
+Both recommenders start from static hard filters (exercise: body part /
+injuries / equipment, diet: meal slot / dish types / labels / cautions).
+This module precomputes those candidate sets offline, once per night, so the
+request path only runs the personalized scoring:
+
+    python -m tools.candidate_tables                  # build into $CANDIDATE_TABLES_DIR
+    0 3 * * *  cd /srv/healthkg && python -m tools.candidate_tables --keep 3
+
+Layout (one directory per build, CURRENT names the live one):
+
+    <root>/CURRENT
+    <root>/<version>/manifest.json        vocabularies, kg versions, table index
+    <root>/<version>/t<i>.masks.npy        int64 [n, k] filter bitmasks (mmap)
+    <root>/<version>/t<i>.features.npy     float32 [n, m] numeric features (mmap)
+    <root>/<version>/t<i>.rows.json        id table: the row payloads, same shape as the KG query
+    <root>/<version>/recipes/              columnar recipe store (tools/diet_tools/recipe_store.py);
+                                           diet rows keep their scalar fields plus store_index
+"""
+import argparse
+import ast
+import json
+import os
+import shutil
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from core.resources import get_resource
+
+# ============================================================
+# 配置
+#   CANDIDATE_TABLES_DIR 默认 $DATA_DIR/materialized；设为 "" / "off" 关闭（直接查 KG）
+# ============================================================
+MANIFEST = "manifest.json"
+CURRENT = "CURRENT"
+DIET_BUILD_LIMIT = 100000     # 离线构建不截断，线上再按原来的 limit 取前 N 条
+MAX_MASK_TERMS = 63           # int64 位数；超出的词走原始字符串匹配
+
+EXERCISE_MASKS = ("equipment_mask", "injury_mask")
+DIET_MASKS = ("diet_mask", "caution_mask")
+DIET_FEATURES = ("calories", "servings")
+RECIPES = "recipes"
+RECIPE_DETAIL_FIELDS = ("ingredients", "nutrients", "daily_values")
+
+
+def tables_dir() -> Optional[str]:
+    root = os.getenv("CANDIDATE_TABLES_DIR")
+    if root is None:
+        root = os.path.join(os.getenv("DATA_DIR", "./data"), "materialized")
+    if root.strip().lower() in ("", "off"):
+        return None
+    return root
+
+
+def _as_list(raw: Any) -> List[str]:
+    """KG 里 label 类字段存的是 str(list)，bench 里是 list，两种都认"""
+    if isinstance(raw, (list, tuple)):
+        return [str(x) for x in raw]
+    if not raw:
+        return []
+    try:
+        value = ast.literal_eval(raw)
+        return [str(x) for x in value] if isinstance(value, (list, tuple)) else [str(raw)]
+    except Exception:
+        return [str(raw)]
+
+
+class _TermMask:
+    """
+    词表 -> 位；位 t 置 1 当且仅当 t in raw（与 Cypher 的 CONTAINS / list 成员判断一致，
+    所以掩码过滤与原来的查询结果完全相同）。词表外 / 超过 63 个的词由调用方回退到原始匹配
+    """
+
+    def __init__(self, terms: Sequence[str]):
+        self.terms = list(terms)[:MAX_MASK_TERMS]
+        self.bits = {t: 1 << i for i, t in enumerate(self.terms)}
+
+    def encode(self, raw: Any) -> int:
+        mask = 0
+        for t, bit in self.bits.items():
+            if raw and t in raw:
+                mask |= bit
+        return mask
+
+    def split(self, terms: Iterable[str]) -> Tuple[int, List[str]]:
+        """返回 (已知词的 mask, 词表外的词)"""
+        mask, unknown = 0, []
+        for t in terms or []:
+            bit = self.bits.get(t)
+            if bit is None:
+                unknown.append(t)
+            else:
+                mask |= bit
+        return mask, unknown
+
+
+# ============================================================
+# 离线构建
+# ============================================================
+def _write_table(out: str, name: str, rows: List[Dict[str, Any]],
+                 masks: np.ndarray, features: Optional[np.ndarray] = None) -> Dict[str, Any]:
+    np.save(os.path.join(out, f"{name}.masks.npy"), masks)
+    if features is not None:
+        np.save(os.path.join(out, f"{name}.features.npy"), features)
+    with open(os.path.join(out, f"{name}.rows.json"), "w", encoding="utf-8") as f:
+        json.dump(rows, f, ensure_ascii=False, separators=(",", ":"))
+    return {"file": name, "rows": len(rows)}
+
+
+def _build_exercise(kg, out: str, manifest: Dict[str, Any]) -> None:
+    from tools.exercise_tools.equipment import equipment_mask
+
+    body_parts = kg.fetch_all_training_body_parts()
+    per_part = {}
+    injury_terms = set()
+    for bp in body_parts:
+        rows = kg.fetch_candidates(bp, [], [])
+        involved = {r["id"]: r["body_parts"] for r in kg.fetch_instruction_body_parts(bp)}
+        for r in rows:
+            if r.get("equipment_mask") is None:
+                r["equipment_mask"] = equipment_mask(r.get("equipment"))
+            r["instruction_body_parts"] = sorted(involved.get(r["id"], []))
+            injury_terms.update(r["instruction_body_parts"])
+        per_part[bp] = rows
+
+    injuries = _TermMask(sorted(injury_terms))
+    manifest["vocab"]["injury"] = injuries.terms
+    for bp, rows in per_part.items():
+        masks = np.array(
+            [[r["equipment_mask"], injuries.encode(r["instruction_body_parts"])] for r in rows],
+            dtype=np.int64).reshape(len(rows), len(EXERCISE_MASKS))
+        name = f"t{len(manifest['tables'])}"
+        manifest["tables"][f"exercise/{bp}"] = _write_table(out, name, rows, masks)
+
+
+def _build_diet(kg, out: str, manifest: Dict[str, Any]) -> None:
+    from tools.diet_tools.diet_evaluator import DISH_CONSTRAINT, kg_meal_type
+
+    per_slot = {}
+    label_terms, caution_terms = set(), set()
+    for slot, dish_types in DISH_CONSTRAINT.items():
+        rows = kg.fetch_candidates_with_detail(
+            meal_type=kg_meal_type(slot), dish_types=dish_types,
+            diet_labels=[], health_labels=[], forbidden_cautions=[],
+            limit=DIET_BUILD_LIMIT,
+        )
+        for r in rows:
+            label_terms.update(_as_list(r.get("diet_labels")))
+            caution_terms.update(_as_list(r.get("cautions")))
+        per_slot[slot] = rows
+
+    labels, cautions = _TermMask(sorted(label_terms)), _TermMask(sorted(caution_terms))
+    manifest["vocab"]["diet_labels"] = labels.terms
+    manifest["vocab"]["cautions"] = cautions.terms
+
+    # 营养素 / 食材进列存，行里只留标量字段 + 下标
+    from tools.diet_tools.recipe_store import build_store
+
+    unique: Dict[str, Dict[str, Any]] = {}
+    for rows in per_slot.values():
+        for r in rows:
+            unique.setdefault(r["recipe_id"], r)
+    store_index = {rid: i for i, rid in enumerate(unique)}
+    build_store(unique.values(), os.path.join(out, RECIPES))
+    for rows in per_slot.values():
+        for r in rows:
+            for k in RECIPE_DETAIL_FIELDS:
+                r.pop(k, None)
+            r["store_index"] = store_index[r["recipe_id"]]
+
+    for slot, rows in per_slot.items():
+        n = len(rows)
+        masks = np.array([[labels.encode(r.get("diet_labels")), cautions.encode(r.get("cautions"))]
+                          for r in rows], dtype=np.int64).reshape(n, len(DIET_MASKS))
+        features = np.array([[float(r.get("calories") or 0), float(r.get("servings") or 1)]
+                             for r in rows], dtype=np.float32).reshape(n, len(DIET_FEATURES))
+        name = f"t{len(manifest['tables'])}"
+        manifest["tables"][f"diet/{slot}"] = _write_table(out, name, rows, masks, features)
+
+
+def build_tables(root: str, exercise_kg=None, diet_kg=None, keep: int = 2) -> str:
+    """构建一版新表并切换 CURRENT；返回版本目录名"""
+    version = time.strftime("%Y%m%dT%H%M%S")
+    out = os.path.join(root, version)
+    tmp = out + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    manifest: Dict[str, Any] = {"version": version, "built_at": time.time(),
+                                "kg_versions": {}, "vocab": {}, "tables": {}}
+    if exercise_kg is not None:
+        _build_exercise(exercise_kg, tmp, manifest)
+        manifest["kg_versions"]["exercise"] = _kg_version(exercise_kg)
+    if diet_kg is not None:
+        _build_diet(diet_kg, tmp, manifest)
+        manifest["kg_versions"]["diet"] = _kg_version(diet_kg)
+    with open(os.path.join(tmp, MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, out)
+
+    pointer = os.path.join(root, CURRENT)
+    with open(pointer + ".tmp", "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(pointer + ".tmp", pointer)
+
+    # 只保留最近 keep 版（正在读旧版的 worker 持有 mmap，删除目录不影响它们）
+    builds = sorted(d for d in os.listdir(root)
+                    if os.path.isdir(os.path.join(root, d)) and not d.endswith(".tmp"))
+    for old in builds[:-keep] if keep > 0 else []:
+        shutil.rmtree(os.path.join(root, old), ignore_errors=True)
+    return version
+
+
+def _kg_version(kg) -> Optional[int]:
+    try:
+        return kg.kg_version() if hasattr(kg, "kg_version") else None
+    except Exception:
+        return None
+
+
+# ============================================================
+# 线上读取（mmap，按需打开；CURRENT 变了自动换新版本）
+# ============================================================
+class CandidateTables:
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, MANIFEST), "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        vocab = self.manifest.get("vocab", {})
+        self.injuries = _TermMask(vocab.get("injury", []))
+        self.diet_labels = _TermMask(vocab.get("diet_labels", []))
+        self.cautions = _TermMask(vocab.get("cautions", []))
+        self._loaded: Dict[str, Tuple[np.ndarray, Optional[np.ndarray], List[Dict[str, Any]]]] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def version(self) -> str:
+        return self.manifest["version"]
+
+    @property
+    def recipes(self):
+        """同一版本的 RecipeStore（diet 行的 store_index 指向这里）"""
+        from tools.diet_tools.recipe_store import open_store
+        return open_store(os.path.join(self.path, RECIPES))
+
+    def has(self, table: str) -> bool:
+        return table in self.manifest["tables"]
+
+    def _table(self, table: str):
+        hit = self._loaded.get(table)
+        if hit is not None:
+            return hit
+        with self._lock:
+            if table not in self._loaded:
+                name = self.manifest["tables"][table]["file"]
+                base = os.path.join(self.path, name)
+                masks = np.load(base + ".masks.npy", mmap_mode="r")
+                features = (np.load(base + ".features.npy", mmap_mode="r")
+                            if os.path.exists(base + ".features.npy") else None)
+                with open(base + ".rows.json", "r", encoding="utf-8") as f:
+                    rows = json.load(f)
+                self._loaded[table] = (masks, features, rows)
+            return self._loaded[table]
+
+    def exercise_candidates(self, target_body_part: str, injury_body_part: Iterable[str],
+                            equipment_mask: Optional[int]) -> List[Dict[str, Any]]:
+        """与 ExerciseKGQuery.fetch_candidates(..., equipment_mask=...) 同样的结果"""
+        masks, _, rows = self._table(f"exercise/{target_body_part}")
+        injury_mask, unknown = self.injuries.split(injury_body_part)
+        keep = (masks[:, 1] & injury_mask) == 0
+        if equipment_mask is not None:
+            keep &= (masks[:, 0] & ~np.int64(equipment_mask)) == 0
+        out = []
+        for i in np.flatnonzero(keep):
+            r = rows[i]
+            if unknown and set(unknown) & set(r["instruction_body_parts"]):
+                continue
+            out.append({k: v for k, v in r.items() if k != "instruction_body_parts"})
+        return out
+
+    def diet_candidates(self, meal: str, diet_labels: Iterable[str],
+                        forbidden_cautions: Iterable[str], limit: int = 50) -> List[Dict[str, Any]]:
+        """
+        与 DietKGQuery.fetch_candidates_with_detail 同样的过滤，meal 是餐段（breakfast / lunch ...）；
+        返回的行不含 ingredients / nutrients / daily_values，按 store_index 去 self.recipes 取
+        """
+        masks, _, rows = self._table(f"diet/{meal}")
+        need, unknown_labels = self.diet_labels.split(diet_labels)
+        forbid, unknown_cautions = self.cautions.split(forbidden_cautions)
+        keep = ((masks[:, 0] & need) == need) & ((masks[:, 1] & forbid) == 0)
+        out = []
+        for i in np.flatnonzero(keep):
+            r = rows[i]
+            raw_labels, raw_cautions = r.get("diet_labels") or "", r.get("cautions") or ""
+            if any(dl not in raw_labels for dl in unknown_labels):
+                continue
+            if any(fc in raw_cautions for fc in unknown_cautions):
+                continue
+            out.append(dict(r))
+            if len(out) >= limit:
+                break
+        return out
+
+
+def get_tables(root: Optional[str] = None) -> Optional[CandidateTables]:
+    """没有构建过 / 已关闭时返回 None，调用方回退到 KG 查询"""
+    root = root or tables_dir()
+    if not root:
+        return None
+    try:
+        with open(os.path.join(root, CURRENT), "r", encoding="utf-8") as f:
+            version = f.read().strip()
+    except OSError:
+        return None
+    path = os.path.join(os.path.abspath(root), version)
+    try:
+        return get_resource(f"tables.{os.path.abspath(root)}", version,
+                            lambda: CandidateTables(path), exclusive=True)
+    except Exception as e:
+        print(f"[CandidateTables] load {path} failed: {e}")
+        return None
+
+
+# ============================================================
+# CLI（定时任务）
+# ============================================================
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description="Materialize recommendation candidate tables")
+    parser.add_argument("--out", default=None, help="默认 $CANDIDATE_TABLES_DIR 或 $DATA_DIR/materialized")
+    parser.add_argument("--keep", type=int, default=2, help="保留的历史版本数")
+    args = parser.parse_args(argv)
+
+    from core.config import configure, load_cfg_from_env
+    from tools.kg_clients import get_exercise_kg, get_diet_kg
+
+    root = args.out or tables_dir()
+    if not root:
+        parser.error("CANDIDATE_TABLES_DIR is off; pass --out")
+    os.makedirs(root, exist_ok=True)
+    configure(load_cfg_from_env())
+
+    t0 = time.perf_counter()
+    version = build_tables(
+        root,
+        exercise_kg=get_exercise_kg(),
+        diet_kg=get_diet_kg(),
+        keep=args.keep,
+    )
+    print(f"[CandidateTables] built {version} in {time.perf_counter() - t0:.1f}s -> {root}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,58 @@
+# tools/diet_tools/aho_corasick.py
+from collections import deque
+from typing import Dict, Iterable, Iterator, List
+
+# ============================================================
+# Aho-Corasick 多模式子串匹配
+#
+# 一次扫描文本就能找出其中出现过的全部模式（这里是候选菜名），
+# 代替「每个候选 × 每条日志」的 `cand in text`。纯 Python，模式数 ~50、文本很短。
+# ============================================================
+
+
+class AhoCorasick:
+    def __init__(self, patterns: Iterable[str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[int]] = [[]]     # 在该状态结束的模式下标（含 fail 链上的）
+
+        for pid, pattern in enumerate(patterns):
+            if not pattern:
+                continue
+            state = 0
+            for ch in pattern:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                state = nxt
+            self._out[state].append(pid)
+
+        # BFS 建 fail 指针，并把 fail 状态的输出并进来
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                f = self._fail[state]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[nxt] = self._goto[f].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def iter_matches(self, text: str) -> Iterator[int]:
+        """text 中出现的模式下标（同一模式出现多次会重复给出）"""
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            yield from out[state]
+
+    def matched(self, text: str) -> set:
+        """text 中出现过的模式下标集合"""
+        return set(self.iter_matches(text))
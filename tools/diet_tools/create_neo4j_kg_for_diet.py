@@ -1,9 +1,9 @@
 from neo4j import GraphDatabase
 import pandas as pd
+import argparse
 import json
 from tqdm import tqdm
 import ast
-from math import ceil
 
 # ============================================================
 # Neo4j Config
@@ -11,7 +11,118 @@ from math import ceil
 URI = "your neo4j url"
 AUTH = ("neo4j", "password")
 CSV_FILE = "./data/DietKG/DATA/chinese_recipes.csv"
-BATCH_SIZE = 100  # 可以调整
+BATCH_SIZE = 2000  # 每个事务写入的行数（有唯一约束后可以放心调大）
+
+# ============================================================
+# 唯一约束（同时会自动建立索引，MATCH/MERGE 不再全表扫描）
+# ============================================================
+CONSTRAINTS = [
+    "CREATE CONSTRAINT recipe_label IF NOT EXISTS FOR (n:Recipe) REQUIRE n.label IS UNIQUE",
+    "CREATE CONSTRAINT ingredient_name IF NOT EXISTS FOR (n:Ingredient) REQUIRE n.name IS UNIQUE",
+    "CREATE CONSTRAINT nutrient_name IF NOT EXISTS FOR (n:Nutrient) REQUIRE n.name IS UNIQUE",
+    "CREATE CONSTRAINT daily_value_name IF NOT EXISTS FOR (n:DailyValue) REQUIRE n.name IS UNIQUE",
+]
+
+# 菜名全文索引（DietKGQuery.search_items 探测到它就走索引，否则退回全标签扫描）
+INDEXES = [
+    "CREATE FULLTEXT INDEX recipe_name_fulltext IF NOT EXISTS FOR (n:Recipe) ON EACH [n.name]",
+]
+
+# ============================================================
+# Cypher
+# ============================================================
+# MERGE：可重复执行（增量更新）
+MERGE_QUERIES = {
+    "recipe": """
+        UNWIND $batch AS r
+        MERGE (recipe:Recipe {label: r.label})
+        SET recipe += r
+    """,
+    "ingredient": """
+        UNWIND $batch AS i
+        MERGE (:Ingredient {name: i.name})
+    """,
+    "uses": """
+        UNWIND $batch AS r
+        MATCH (rec:Recipe {label: r.recipe_label})
+        MATCH (ing:Ingredient {name: r.ingredient_name})
+        MERGE (rec)-[rel:USES]->(ing)
+        SET rel.quantity = r.quantity,
+            rel.measure = r.measure,
+            rel.weight = r.weight,
+            rel.text = r.text
+    """,
+    "nutrient": """
+        UNWIND $batch AS n
+        MERGE (nut:Nutrient {name: n.name})
+        SET nut.unit = n.unit,
+            nut.label = n.label
+    """,
+    "has_nutrient": """
+        UNWIND $batch AS r
+        MATCH (rec:Recipe {label: r.recipe_label})
+        MATCH (nut:Nutrient {name: r.nutrient_name})
+        MERGE (rec)-[rel:HAS_NUTRIENT]->(nut)
+        SET rel.quantity = r.quantity
+    """,
+    "daily_value": """
+        UNWIND $batch AS d
+        MERGE (dv:DailyValue {name: d.name})
+        SET dv.unit = d.unit,
+            dv.label = d.label
+    """,
+    "has_daily_value": """
+        UNWIND $batch AS r
+        MATCH (rec:Recipe {label: r.recipe_label})
+        MATCH (dv:DailyValue {name: r.dv_name})
+        MERGE (rec)-[rel:HAS_DAILY_VALUE]->(dv)
+        SET rel.quantity = r.quantity
+    """,
+}
+
+# CREATE：仅用于空库首次导入（--create-only），跳过 MERGE 的存在性检查
+CREATE_QUERIES = {
+    "recipe": """
+        UNWIND $batch AS r
+        CREATE (recipe:Recipe)
+        SET recipe = r
+    """,
+    "ingredient": """
+        UNWIND $batch AS i
+        CREATE (:Ingredient {name: i.name})
+    """,
+    "uses": """
+        UNWIND $batch AS r
+        MATCH (rec:Recipe {label: r.recipe_label})
+        MATCH (ing:Ingredient {name: r.ingredient_name})
+        CREATE (rec)-[:USES {
+            quantity: r.quantity,
+            measure: r.measure,
+            weight: r.weight,
+            text: r.text
+        }]->(ing)
+    """,
+    "nutrient": """
+        UNWIND $batch AS n
+        CREATE (:Nutrient {name: n.name, unit: n.unit, label: n.label})
+    """,
+    "has_nutrient": """
+        UNWIND $batch AS r
+        MATCH (rec:Recipe {label: r.recipe_label})
+        MATCH (nut:Nutrient {name: r.nutrient_name})
+        CREATE (rec)-[:HAS_NUTRIENT {quantity: r.quantity}]->(nut)
+    """,
+    "daily_value": """
+        UNWIND $batch AS d
+        CREATE (:DailyValue {name: d.name, unit: d.unit, label: d.label})
+    """,
+    "has_daily_value": """
+        UNWIND $batch AS r
+        MATCH (rec:Recipe {label: r.recipe_label})
+        MATCH (dv:DailyValue {name: r.dv_name})
+        CREATE (rec)-[:HAS_DAILY_VALUE {quantity: r.quantity}]->(dv)
+    """,
+}
 
 # ============================================================
 # CSV 解析
@@ -34,12 +145,12 @@ def parse_dict_column(x):
         except:
             return {}
 
-df = pd.read_csv(CSV_FILE)
-df['ingredients'] = df['ingredients'].apply(parse_list_column)
-df['total_nutrients'] = df['total_nutrients'].apply(parse_dict_column)
-df['daily_values'] = df['daily_values'].apply(parse_dict_column)
-
-driver = GraphDatabase.driver(URI, auth=AUTH)
+def read_recipes_csv(csv_file):
+    df = pd.read_csv(csv_file)
+    df['ingredients'] = df['ingredients'].apply(parse_list_column)
+    df['total_nutrients'] = df['total_nutrients'].apply(parse_dict_column)
+    df['daily_values'] = df['daily_values'].apply(parse_dict_column)
+    return df
 
 # ============================================================
 # 批量插入函数
@@ -49,7 +160,30 @@ def batch(iterable, n=1):
     for i in range(0, l, n):
         yield iterable[i:i+n]
 
-def load_recipes_to_neo4j(df, batch_size=BATCH_SIZE):
+def create_constraints(driver):
+    """导入前建立唯一约束，保证 MATCH / MERGE 走索引；顺带建菜名全文索引"""
+    with driver.session() as session:
+        for stmt in CONSTRAINTS + INDEXES:
+            session.run(stmt).consume()
+
+def _write_batch(tx, query, rows):
+    tx.run(query, batch=rows).consume()
+
+def run_batches(driver, query, rows, batch_size, desc):
+    """每个 batch 一个写事务（execute_write 自带瞬时错误重试）"""
+    with driver.session() as session:
+        for b in tqdm(list(batch(rows, batch_size)), desc=desc):
+            session.execute_write(_write_batch, query, b)
+
+def dedupe(rows, *key_fields):
+    """按 key 去重，后出现的覆盖前面的（与 MERGE + SET 的结果一致）"""
+    return list({tuple(r[k] for k in key_fields): r for r in rows}.values())
+
+def load_recipes_to_neo4j(driver, df, batch_size=BATCH_SIZE, create_only=False):
+    queries = CREATE_QUERIES if create_only else MERGE_QUERIES
+
+    create_constraints(driver)
+
     # 1️⃣ Recipe 节点
     recipes_data = []
     for _, row in df.iterrows():
@@ -68,15 +202,13 @@ def load_recipes_to_neo4j(df, batch_size=BATCH_SIZE):
             "dish_type": str(row['dish_type'])
         })
 
-    with driver.session() as session:
-        for r_batch in tqdm(list(batch(recipes_data, batch_size)), desc="Importing Recipes"):
-            session.run("""
-                UNWIND $batch AS r
-                MERGE (recipe:Recipe {label: r.label})
-                SET recipe += r
-            """, batch=r_batch)
-
-    # 2️⃣ Ingredient 节点 + HAS_INGREDIENT
+    if create_only:
+        # CREATE 不去重，空库导入时需要保证 label 唯一，否则会违反约束
+        recipes_data = dedupe(recipes_data, "label")
+
+    run_batches(driver, queries["recipe"], recipes_data, batch_size, "Importing Recipes")
+
+    # 2️⃣ Ingredient 节点 + USES
     ingredient_nodes = {}
     ingredient_rels = []
 
@@ -97,25 +229,11 @@ def load_recipes_to_neo4j(df, batch_size=BATCH_SIZE):
                 "text": ing.get("text")
             })
 
-    with driver.session() as session:
-        for b in tqdm(list(batch(list(ingredient_nodes.values()), batch_size)), desc="Importing Ingredients"):
-            session.run("""
-                UNWIND $batch AS i
-                MERGE (:Ingredient {name: i.name})
-            """, batch=b)
-
-        for b in tqdm(list(batch(ingredient_rels, batch_size)), desc="Creating USES relations"):
-            session.run("""
-                UNWIND $batch AS r
-                MATCH (rec:Recipe {label: r.recipe_label})
-                MATCH (ing:Ingredient {name: r.ingredient_name})
-                MERGE (rec)-[rel:USES]->(ing)
-                SET rel.quantity = r.quantity,
-                    rel.measure = r.measure,
-                    rel.weight = r.weight,
-                    rel.text = r.text
-            """, batch=b)
-
+    run_batches(driver, queries["ingredient"], list(ingredient_nodes.values()), batch_size, "Importing Ingredients")
+    if create_only:
+        # 关系同理：重复的 recipe label / 同一食材多行，MERGE 只会留一条边
+        ingredient_rels = dedupe(ingredient_rels, "recipe_label", "ingredient_name")
+    run_batches(driver, queries["uses"], ingredient_rels, batch_size, "Creating USES relations")
 
     # 3️⃣ Nutrient 节点 + HAS_NUTRIENT
     nutrient_nodes = {}
@@ -134,23 +252,10 @@ def load_recipes_to_neo4j(df, batch_size=BATCH_SIZE):
                 "quantity": val.get("quantity")
             })
 
-    with driver.session() as session:
-        for b in tqdm(list(batch(list(nutrient_nodes.values()), batch_size)), desc="Importing Nutrients"):
-            session.run("""
-                UNWIND $batch AS n
-                MERGE (nut:Nutrient {name: n.name})
-                SET nut.unit = n.unit,
-                    nut.label = n.label
-            """, batch=b)
-
-        for b in tqdm(list(batch(nutrient_rels, batch_size)), desc="Creating HAS_NUTRIENT relations"):
-            session.run("""
-                UNWIND $batch AS r
-                MATCH (rec:Recipe {label: r.recipe_label})
-                MATCH (nut:Nutrient {name: r.nutrient_name})
-                MERGE (rec)-[rel:HAS_NUTRIENT]->(nut)
-                SET rel.quantity = r.quantity
-            """, batch=b)
+    run_batches(driver, queries["nutrient"], list(nutrient_nodes.values()), batch_size, "Importing Nutrients")
+    if create_only:
+        nutrient_rels = dedupe(nutrient_rels, "recipe_label", "nutrient_name")
+    run_batches(driver, queries["has_nutrient"], nutrient_rels, batch_size, "Creating HAS_NUTRIENT relations")
 
     # 4️⃣ DailyValue 节点 + HAS_DAILY_VALUE
     dv_nodes = {}
@@ -169,27 +274,33 @@ def load_recipes_to_neo4j(df, batch_size=BATCH_SIZE):
                 "quantity": val.get("quantity")
             })
 
-    with driver.session() as session:
-        for b in tqdm(list(batch(list(dv_nodes.values()), batch_size)), desc="Importing DailyValues"):
-            session.run("""
-                UNWIND $batch AS d
-                MERGE (dv:DailyValue {name: d.name})
-                SET dv.unit = d.unit,
-                    dv.label = d.label
-            """, batch=b)
-
-        for b in tqdm(list(batch(dv_rels, batch_size)), desc="Creating HAS_DAILY_VALUE relations"):
-            session.run("""
-                UNWIND $batch AS r
-                MATCH (rec:Recipe {label: r.recipe_label})
-                MATCH (dv:DailyValue {name: r.dv_name})
-                MERGE (rec)-[rel:HAS_DAILY_VALUE]->(dv)
-                SET rel.quantity = r.quantity
-            """, batch=b)
+    run_batches(driver, queries["daily_value"], list(dv_nodes.values()), batch_size, "Importing DailyValues")
+    if create_only:
+        dv_rels = dedupe(dv_rels, "recipe_label", "dv_name")
+    run_batches(driver, queries["has_daily_value"], dv_rels, batch_size, "Creating HAS_DAILY_VALUE relations")
 
     print("✅ Finished loading all data into Neo4j")
 
 # ============================================================
 # 执行导入
 # ============================================================
-load_recipes_to_neo4j(df)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import chinese_recipes.csv into the Diet KG")
+    parser.add_argument("--csv", default=CSV_FILE)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument(
+        "--create-only", action="store_true",
+        help="空库快速导入：用 CREATE 代替 MERGE（库中已有数据时不要使用）"
+    )
+    cli = parser.parse_args()
+
+    driver = GraphDatabase.driver(URI, auth=AUTH)
+    try:
+        load_recipes_to_neo4j(
+            driver,
+            read_recipes_csv(cli.csv),
+            batch_size=cli.batch_size,
+            create_only=cli.create_only
+        )
+    finally:
+        driver.close()
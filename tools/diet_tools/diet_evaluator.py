@@ -4,10 +4,10 @@ from typing import List, Dict, Any
 from itertools import combinations
 from datetime import datetime, timedelta
 import math
-from tools.diet_tools.query import *
-from collections import defaultdict
+from collections import Counter, defaultdict
 import time
-import numpy
+import threading
+from core.tracing import traced, record_span, set_attrs
 
 
 MEAL_RATIOS = {
@@ -26,6 +26,85 @@ ACTIVITY_FACTOR = {
     "extreme": 1.9
 }
 
+# ---------- dish 约束（餐段 -> 菜品类型）----------
+DISH_CONSTRAINT = {
+    "breakfast": ["bread", "egg", "cereals"],
+    "lunch": ["main course", "salad", "soup"],
+    "dinner": ["main course", "salad", "soup"],
+    "snack": ["snack", "desserts", "drinks"],
+    "brunch": ["main course", "salad"]
+}
+
+
+# ---------- 宏量营养素（normalize_nutrients 的 key）----------
+MACRO_NUTRIENTS = {
+    "protein": "procnt",
+    "carbs": "chocdf",
+    "fat": "fat",
+}
+KCAL_PER_GRAM = {"protein": 4, "carbs": 4, "fat": 9}
+
+# ---------- 全天方案 ----------
+DAY_MEALS = ("breakfast", "lunch", "dinner", "snack")
+
+# 目标 -> 宏量热量占比；diet_profile 里有 daily_macro_targets 时以它为准
+MACRO_SPLIT = {
+    "bulking": {"protein": 0.30, "carbs": 0.45, "fat": 0.25},
+    "cutting": {"protein": 0.35, "carbs": 0.35, "fat": 0.30},
+    "maintenance": {"protein": 0.25, "carbs": 0.50, "fat": 0.25},
+}
+MACRO_TOLERANCE = 0.15      # 目标克数上下浮动 15% 内不扣分
+
+
+def kg_meal_type(meal: str) -> str:
+    """KG 里午餐 / 晚餐共用 "lunch/dinner" """
+    return meal if meal != "lunch" else "lunch/dinner"
+
+
+def fetch_meal_candidates(meal, kg, diet_labels, health_labels, forbidden_cautions, limit=50):
+    """
+    返回 (候选行, RecipeStore 或 None)。
+    物化表里的行只带标量字段 + store_index，营养素 / 食材从同一版本的列存里按下标取
+    """
+    from tools.candidate_tables import get_tables
+    from tools.diet_tools.recipe_store import get_recipe_store
+
+    tables = get_tables()
+    if tables is not None and tables.has(f"diet/{meal}"):
+        set_attrs(candidate_source="tables:" + tables.version)
+        return tables.diet_candidates(meal, diet_labels, forbidden_cautions, limit=limit), tables.recipes
+
+    set_attrs(candidate_source="kg")
+    rows = kg.fetch_candidates_with_detail(
+        meal_type=kg_meal_type(meal),
+        dish_types=DISH_CONSTRAINT[meal],
+        diet_labels=diet_labels,
+        health_labels=health_labels,
+        forbidden_cautions=forbidden_cautions,
+        limit=limit
+    )
+    return rows, get_recipe_store()
+
+
+def recipe_features(recipe, user, store=None):
+    """
+    每个候选只算一次：(每份系数, 规范化营养素 dict, 食材偏好分)。
+    列存里能找到就按下标取（store_index 或 recipe_id），否则解析行里的嵌套 list
+    """
+    i = recipe.get("store_index")
+    if i is None and store is not None:
+        i = store.index_of(recipe.get("recipe_id"))
+
+    if store is not None and i is not None:
+        nutrients = store.nutrients_of(i)
+        ingredient_score = ingredient_preference_score(
+            {"ingredients": store.ingredient_names_of(i)}, user)
+    else:
+        nutrients = normalize_nutrients(recipe.get("nutrients"))
+        ingredient_score = ingredient_preference_score(recipe, user)
+
+    return 1.0 / max(recipe["servings"], 1), nutrients, ingredient_score
+
 
 def compute_tdee(user):
     # 计算每日静止能量需求
@@ -89,17 +168,13 @@ def ingredient_preference_score(recipe, user):
     return score
 
 
-def history_penalty(candidate_names: List[str], history: List[Dict[str, Any]]) -> float:
+def recent_recipe_weights(history: List[Dict[str, Any]], now=None) -> Dict[str, float]:
     """
-    [Fixed] 适配 Graph Event 结构的历史惩罚计算
+    原始事件列表 -> {小写 summary: 衰减权重之和}（与 IntakeIndex.recent_recipes 同样的结果）
     history: list of events (from Neo4j graph)
-    candidate_names: list of recipe names (from KG candidates)
     """
-    now = datetime.now()
-    penalty = 0.0
-    
-    # 预处理 candidates 为小写，加速匹配
-    candidates_lower = [n.lower() for n in candidate_names if n]
+    now = now or datetime.now()
+    weights = defaultdict(float)
 
     for h in history:
         # 1. 过滤非饮食事件
@@ -119,27 +194,55 @@ def history_penalty(candidate_names: List[str], history: List[Dict[str, Any]]) -
         if days > 7:
             continue
 
-        # 3. 提取日志内容 (props.summary / props.description / props.foods)
+        # 3. 提取日志内容 (props.summary)
+        # 距离今天越近，权重越大 (1/(days+1))
+        # 昨天吃的: 1/2 = 0.5
+        # 今天吃的: 1/1 = 1.0
         props = h.get("props", {})
-        
-        # 拼接所有可能的文本字段进行模糊匹配
-        # 例如: summary="午餐", description="吃了番茄炒蛋", foods=["Tomato Egg"]
-        content_text = (
-            str(props.get("summary", ""))
-        ).lower()
-
-        # 4. 计算惩罚
-        # 如果候选菜名出现在了最近的日志里
-        for cand in candidates_lower:
-            if cand in content_text:
-                # 距离今天越近，惩罚越大 (1/(days+1))
-                # 昨天吃的: 1/2 = 0.5
-                # 今天吃的: 1/1 = 1.0
-                penalty += 1.0 / max(days + 1, 1)
+        weights[str(props.get("summary", "")).lower()] += 1.0 / max(days + 1, 1)
+
+    return dict(weights)
+
 
+def recent_recipe_penalty(candidate_names: List[str], recent: Dict[str, float]) -> float:
+    """候选菜名出现在最近的日志 summary 里就按该条的衰减权重扣分"""
+    penalty = 0.0
+    for cand in candidate_names:
+        if not cand:
+            continue
+        cand = cand.lower()
+        for text, weight in recent.items():
+            if cand in text:
+                penalty += weight
     return penalty
 
 
+def recipe_history_penalties(candidate_names: List[str], recent: Dict[str, float]) -> List[float]:
+    """
+    每个候选各自的历史惩罚（可加：组合的惩罚 = 成员之和）。
+    候选菜名建一个 Aho-Corasick 自动机，每条最近的 summary 只扫一遍
+    """
+    from tools.diet_tools.aho_corasick import AhoCorasick
+
+    penalties = [0.0] * len(candidate_names)
+    if not recent:
+        return penalties
+    matcher = AhoCorasick((n or "").lower() for n in candidate_names)
+    for text, weight in recent.items():
+        for i in matcher.matched(text):
+            penalties[i] += weight
+    return penalties
+
+
+def history_penalty(candidate_names: List[str], history: List[Dict[str, Any]]) -> float:
+    """
+    [Fixed] 适配 Graph Event 结构的历史惩罚计算
+    history: list of events (from Neo4j graph)
+    candidate_names: list of recipe names (from KG candidates)
+    """
+    return recent_recipe_penalty(candidate_names, recent_recipe_weights(history))
+
+
 def normalize_nutrients(nutrients):
     """
     将 nutrient list 转为 dict:
@@ -264,51 +367,40 @@ def diversity_penalty(
     return alpha * max_sim
 
 
-def recommend_meals(user, kg: "DietKGQuery", top_k=3):
-    start_time = time.time()
-    tdee = compute_tdee(user)
-    meal = user["current_context"]["meal_time"]
-
-    # ---------- 目标热量 ----------
+def meal_target_calories(user, meal, tdee):
+    """单餐目标热量：当天已有摄入时按剩余热量分配，否则按 MEAL_RATIOS"""
     if user["current_context"]["today_intake"]:
         remaining = remaining_calories_today(user, tdee)
         if meal == "breakfast":
-            target_cal = remaining * 0.25
+            return remaining * 0.25
         elif meal == "lunch" or meal == "brunch":
-            target_cal = remaining * 0.55
+            return remaining * 0.55
         elif meal == "dinner":
-            target_cal = remaining
+            return remaining
         else:
-            target_cal = remaining * MEAL_RATIOS.get(meal, 0.1)
-    else:
-        target_cal = tdee * MEAL_RATIOS.get(meal, 0.3)
-
-    # ---------- dish 约束 ----------
-    dish_constraint = {
-        "breakfast": ["bread", "egg", "cereals"],
-        "lunch": ["main course", "salad", "soup"],
-        "dinner": ["main course", "salad", "soup"],
-        "snack": ["snack", "desserts", "drinks"],
-        "brunch": ["main course", "salad"]
-    }
-
-    # ---------- KG 查询 ----------
-    candidates = kg.fetch_candidates_with_detail(
-        meal_type=meal if meal != "lunch" else "lunch/dinner",
-        dish_types=dish_constraint[meal],
-        diet_labels=user["diet_profile"]["diet_labels"],
-        health_labels=user["diet_profile"]["health_preferences"],
-        forbidden_cautions=user["diet_profile"]["forbidden_cautions"]
-    )
+            return remaining * MEAL_RATIOS.get(meal, 0.1)
+    return tdee * MEAL_RATIOS.get(meal, 0.3)
 
-    print("符合条件的候选数量有：", len(candidates))
-    print("搜索到候选的时间为：", time.time() - start_time)
 
-    # ---------- 1️⃣ 枚举所有组合，计算 base_score ----------
+def score_meal_plans(user, meal, target_cal, candidates, store=None, with_macros=False):
+    """
+    枚举 1~3 道菜的全部组合并打分，按 base_score 降序返回。
+    with_macros=True 时每个方案带上 macros（protein / carbs / fat 克数），全天预算用
+    """
     scored_plans = []
 
+    # 候选级特征提前算好，组合循环里只做累加
+    features = [recipe_features(r, user, store) for r in candidates]
+
+    # 最近吃过的菜（summary -> 衰减权重）：profile 里带了聚合结果就直接用，否则从原始事件算一次
+    recent = user.get("recent_recipes")
+    if recent is None:
+        recent = recent_recipe_weights(user.get("history", []))
+    penalties = recipe_history_penalties([r["recipe_name"] for r in candidates], recent)
+
     for k in (1, 2, 3):
-        for combo in combinations(candidates, k):
+        for combo_idx in combinations(range(len(candidates)), k):
+            combo = [candidates[i] for i in combo_idx]
             total_cal = sum(
                 r["calories"] / max(r["servings"], 1)
                 for r in combo
@@ -317,13 +409,12 @@ def recommend_meals(user, kg: "DietKGQuery", top_k=3):
             plan_nutrients = defaultdict(float)
             ingredient_score = 0.0
 
-            for r in combo:
-                factor = 1.0 / max(r["servings"], 1)
-                nutrients = normalize_nutrients(r["nutrients"])
+            for i in combo_idx:
+                factor, nutrients, ing_score = features[i]
                 for nk, nv in nutrients.items():
                     plan_nutrients[nk] += nv * factor
 
-                ingredient_score += ingredient_preference_score(r, user)
+                ingredient_score += ing_score
 
             score = 0.0
 
@@ -360,20 +451,12 @@ def recommend_meals(user, kg: "DietKGQuery", top_k=3):
             ) 
 
             # 历史惩罚
-            score -= history_penalty(
-                [r["recipe_name"] for r in combo],
-                user.get("history", []) 
-            ) * 0.15
+            score -= sum(penalties[i] for i in combo_idx) * 0.15
 
             plan_recipes = []
-            plan_nutrients = defaultdict(float)
 
             for r in combo:
                 per_serving_factor = 1.0 / max(r["servings"], 1)
-                nutrients = normalize_nutrients(r["nutrients"])
-
-                for k2, v2 in nutrients.items():
-                    plan_nutrients[k2] += v2 * per_serving_factor
 
                 plan_recipes.append({
                     "recipe_name": r["recipe_name"],
@@ -383,23 +466,28 @@ def recommend_meals(user, kg: "DietKGQuery", top_k=3):
                     "dish_type": r["dish_type"],
                 })
 
-            scored_plans.append({
+            plan = {
                 "meal_time": meal,
                 "target_calories": round(target_cal, 1),
                 "actual_calories": round(total_cal, 1),
                 "base_score": round(score, 4),
                 "recipes": plan_recipes,
-            })
+            }
+            if with_macros:
+                plan["macros"] = {
+                    m: round(plan_nutrients.get(key, 0.0), 1) for m, key in MACRO_NUTRIENTS.items()
+                }
+            scored_plans.append(plan)
 
-    # ---------- 2️⃣ 按 base_score 排序 ----------
     scored_plans.sort(key=lambda x: x["base_score"], reverse=True)
+    return scored_plans
 
-    # ---------- 3️⃣ 多样性约束：逐个选 Top-K ----------
+
+def select_diverse_plans(scored_plans, top_k, alpha=0.4):
+    """多样性约束：逐个选 Top-K（与已选方案的最大 Jaccard 相似度做惩罚）"""
     selected = []
     selected_recipe_sets = []
 
-    ALPHA = 0.4   # ⭐ 多样性惩罚强度（推荐 0.3–0.6）
-
     while len(selected) < top_k and scored_plans:
         best_plan = None
         best_final_score = -1e9
@@ -410,7 +498,7 @@ def recommend_meals(user, kg: "DietKGQuery", top_k=3):
             penalty = diversity_penalty(
                 recipe_names,
                 selected_recipe_sets,
-                alpha=ALPHA
+                alpha=alpha
             )
 
             final_score = plan["base_score"] - penalty
@@ -434,5 +522,232 @@ def recommend_meals(user, kg: "DietKGQuery", top_k=3):
             p for p in scored_plans if p is not best_plan
         ]
 
-    print("全部评分 + 多样性筛选完成，用时：", time.time() - start_time)
     return selected
+
+
+@traced("diet.recommend_meals")
+def recommend_meals(user, kg: "DietKGQuery", top_k=3):
+    tdee = compute_tdee(user)
+    meal = user["current_context"]["meal_time"]
+
+    # ---------- 目标热量 ----------
+    target_cal = meal_target_calories(user, meal, tdee)
+
+    # ---------- 候选：优先用离线物化表（tools/candidate_tables.py），没有再查 KG ----------
+    candidates, store = fetch_meal_candidates(
+        meal, kg,
+        diet_labels=user["diet_profile"]["diet_labels"],
+        health_labels=user["diet_profile"]["health_preferences"],
+        forbidden_cautions=user["diet_profile"]["forbidden_cautions"]
+    )
+
+    set_attrs(meal_time=meal, candidates=len(candidates))
+
+    # ---------- 1️⃣ 枚举所有组合，按 base_score 排序 ----------
+    t_score = time.perf_counter()
+    scored_plans = score_meal_plans(user, meal, target_cal, candidates, store)
+    record_span("diet.score_combinations", t_score, combos=len(scored_plans))
+
+    # ---------- 2️⃣ 多样性约束：逐个选 Top-K ----------
+    t_select = time.perf_counter()
+    ALPHA = 0.4   # ⭐ 多样性惩罚强度（推荐 0.3–0.6）
+    selected = select_diverse_plans(scored_plans, top_k, alpha=ALPHA)
+
+    record_span("diet.diversity_select", t_select, selected=len(selected))
+    return selected
+
+
+# ============================================================
+# 全天方案：四个餐段并发取候选，再在各餐段 Top-N 上联合满足全天热量 / 宏量预算
+# （recommend_day 排今天剩下的餐段；一周方案 week_planner.plan_week 逐天调用 select_day_plan）
+#
+# 线程池只并发 KG 查询（I/O，走共享 driver 的连接池）；打分是纯 Python 循环，多线程会被 GIL 串行化，
+# 所以在调用线程里按餐段依次打分，同时其余餐段的查询还在后台跑
+# ============================================================
+DAY_TOP_N = 8               # 每个餐段进入联合选择的方案数
+DAY_POOL = 200              # 多样性挑选前只看 base_score 前 DAY_POOL 个
+DAY_CAL_WEIGHT = 2.0        # 全天热量偏差（相对目标）的惩罚权重
+DAY_MACRO_WEIGHT = 1.0      # 宏量超出区间（相对上限）的惩罚权重
+DAY_REPEAT_PENALTY = 0.5    # 同一道菜在全天重复出现一次的惩罚
+DAY_CAL_BUCKET = 25.0       # DP 状态的分桶粒度：热量 kcal / 宏量 g
+DAY_MACRO_BUCKET = 5.0
+
+_slot_pool = None
+_slot_pool_lock = threading.Lock()
+
+
+def _get_slot_pool():
+    global _slot_pool
+    if _slot_pool is None:
+        with _slot_pool_lock:
+            if _slot_pool is None:
+                from concurrent.futures import ThreadPoolExecutor
+                _slot_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="diet-slot")
+    return _slot_pool
+
+
+def daily_macro_targets(user, tdee):
+    """{macro: (low, high)} 克数"""
+    targets = user["diet_profile"].get("daily_macro_targets")
+    if targets:
+        return {m: tuple(v) for m, v in targets.items()}
+    split = MACRO_SPLIT.get(user["activity"].get("user_goal", "maintenance"), MACRO_SPLIT["maintenance"])
+    out = {}
+    for m, ratio in split.items():
+        grams = tdee * ratio / KCAL_PER_GRAM[m]
+        out[m] = (grams * (1 - MACRO_TOLERANCE), grams * (1 + MACRO_TOLERANCE))
+    return out
+
+
+def cap_recipe_reuse(scored_plans, max_per_recipe):
+    """按 base_score 顺序保留方案，每道菜最多出现在 max_per_recipe 个方案里（不让一道高分菜占满候选池）"""
+    used = Counter()
+    kept = []
+    for plan in scored_plans:
+        names = [r["recipe_name"] for r in plan["recipes"]]
+        if all(used[n] < max_per_recipe for n in names):
+            kept.append(plan)
+            used.update(names)
+    return kept
+
+
+def _slot_candidates(user, meal, kg):
+    """单个餐段取候选（在线程池里跑）"""
+    t0 = time.perf_counter()
+    candidates, store = fetch_meal_candidates(
+        meal, kg,
+        diet_labels=user["diet_profile"]["diet_labels"],
+        health_labels=user["diet_profile"]["health_preferences"],
+        forbidden_cautions=user["diet_profile"]["forbidden_cautions"]
+    )
+    # 兜底：过敏 / 禁忌不依赖后端过滤是否生效（与 Cypher 的 r.cautions CONTAINS fc 一致）
+    forbidden = user["diet_profile"]["forbidden_cautions"] or []
+    candidates = [r for r in candidates
+                  if not any(fc in str(r.get("cautions") or "") for fc in forbidden)]
+    record_span("diet.day_slot_fetch", t0, meal=meal, candidates=len(candidates))
+    return candidates, store
+
+
+def _slot_options(user, meal, target_cal, candidates, store, top_n, max_per_recipe=None):
+    """单个餐段：打分 + 多样性挑 Top-N（纯 CPU，在调用线程里跑）"""
+    t0 = time.perf_counter()
+    scored = score_meal_plans(user, meal, target_cal, candidates, store, with_macros=True)
+    if not max_per_recipe:
+        options = select_diverse_plans(scored[:DAY_POOL], top_n)
+    else:
+        options = select_diverse_plans(cap_recipe_reuse(scored, max_per_recipe)[:DAY_POOL], top_n)
+        # 每道菜的单菜方案都带上：组合方案把菜用完时，总还能换成没用满的单菜
+        chosen = {id(p) for p in options}
+        for plan in scored:
+            if len(plan["recipes"]) == 1 and id(plan) not in chosen:
+                plan["score"] = plan["base_score"]
+                options.append(plan)
+    record_span("diet.day_slot_score", t0, meal=meal, combos=len(scored))
+    return options
+
+
+def fetch_slot_options(user, kg, targets, top_n, max_per_recipe=None):
+    """
+    {meal: 目标热量} -> {meal: Top-N 方案}；每个餐段的 KG 查询一个任务（copy_context 让 trace span 挂到当前 turn 上），
+    查询按餐段顺序取回后在当前线程打分
+    max_per_recipe：每道菜最多出现在几个方案里，并补上所有单菜方案（一周方案用，见 week_planner）
+    """
+    import contextvars
+
+    pool = _get_slot_pool()
+    futures = {
+        m: pool.submit(contextvars.copy_context().run, _slot_candidates, user, m, kg)
+        for m in targets
+    }
+    options = {}
+    for m, target in targets.items():
+        candidates, store = futures[m].result()
+        options[m] = _slot_options(user, m, target, candidates, store, top_n, max_per_recipe)
+    return options
+
+
+def day_meal_targets(tdee, meals=DAY_MEALS):
+    """全天热量按 MEAL_RATIOS 分到各餐段（只取 meals 里的餐段，比例重新归一）"""
+    ratio_sum = sum(MEAL_RATIOS.get(m, 0.1) for m in meals)
+    return {m: tdee * MEAL_RATIOS.get(m, 0.1) / ratio_sum for m in meals}
+
+
+def day_objective(state_score, totals, target_cal, macro_targets):
+    cal = totals[0]
+    obj = state_score - DAY_CAL_WEIGHT * abs(cal - target_cal) / max(target_cal, 1)
+    for (low, high), v in zip(macro_targets.values(), totals[1:]):
+        if v < low or v > high:
+            obj -= DAY_MACRO_WEIGHT * min(abs(v - low), abs(v - high)) / max(high, 1)
+    return obj
+
+
+def select_day_plan(slot_options, target_cal, macro_targets, extra_penalty=None):
+    """
+    每个餐段选一个方案，最大化 Σscore - 全天热量 / 宏量偏差惩罚。
+    DP 按餐段推进，状态 = (热量, 各宏量) 分桶后的累计值，同一桶只留分数最高的部分方案；
+    同一道菜在两个餐段重复出现按 DAY_REPEAT_PENALTY 扣分（候选池小时仍保证每个餐段都有方案）
+    extra_penalty(plan) -> float：调用方附加的单方案惩罚（一周计划里用来限制跨天重复）
+    """
+    macros = list(macro_targets)
+    # key -> (累计 score, 精确累计 totals, 已选方案列表)
+    states = {(): (0.0, (0.0,) * (1 + len(macros)), [])}
+    for meal, options in slot_options.items():
+        if not options:
+            continue
+        nxt = {}
+        for score, totals, picks in states.values():
+            used = {r["recipe_name"] for p in picks for r in p["recipes"]}
+            for plan in options:
+                repeats = sum(r["recipe_name"] in used for r in plan["recipes"])
+                t = (totals[0] + plan["actual_calories"],) + tuple(
+                    totals[1 + j] + plan["macros"].get(m, 0.0) for j, m in enumerate(macros))
+                key = (round(t[0] / DAY_CAL_BUCKET),) + tuple(round(v / DAY_MACRO_BUCKET) for v in t[1:])
+                gain = plan.get("score", plan["base_score"]) - DAY_REPEAT_PENALTY * repeats
+                if extra_penalty is not None:
+                    gain -= extra_penalty(plan)
+                cand = (score + gain, t, picks + [plan])
+                if key not in nxt or cand[0] > nxt[key][0]:
+                    nxt[key] = cand
+        states = nxt
+
+    best = max(states.values(), key=lambda st: day_objective(st[0], st[1], target_cal, macro_targets))
+    score, totals, picks = best
+    return {
+        "target_calories": round(target_cal, 1),
+        "actual_calories": round(totals[0], 1),
+        "macro_targets": {m: [round(lo, 1), round(hi, 1)] for m, (lo, hi) in macro_targets.items()},
+        "macros": {m: round(v, 1) for m, v in zip(macros, totals[1:])},
+        "score": round(day_objective(score, totals, target_cal, macro_targets), 4),
+        "meals": picks,
+    }
+
+
+@traced("diet.recommend_day")
+def recommend_day(user, kg: "DietKGQuery", meals=DAY_MEALS, top_n=DAY_TOP_N):
+    """
+    今天的全天方案：today_intake 里已经记录的餐段（skipped 除外）不再推荐，
+    剩下的餐段分今天剩余的热量，宏量目标按剩余热量占比缩放（摄入记录只有热量）。
+    返回 select_day_plan 的形状 + {daily_target_calories, eaten_calories, planned_meals}
+    """
+    tdee = compute_tdee(user)
+    intake = [m for m in user["current_context"].get("today_intake", []) if m.get("status") != "skipped"]
+    eaten_meals = {m.get("meal_time") for m in intake}
+    todo = [m for m in meals if m not in eaten_meals]
+    remaining = remaining_calories_today(user, tdee)
+    scale = remaining / tdee if tdee else 0.0
+    macro_targets = {m: (lo * scale, hi * scale) for m, (lo, hi) in daily_macro_targets(user, tdee).items()}
+    set_attrs(meals=len(todo))
+
+    slot_options = {}
+    if todo and remaining > 0:
+        slot_options = fetch_slot_options(user, kg, day_meal_targets(remaining, todo), top_n)
+
+    t_select = time.perf_counter()
+    day = select_day_plan(slot_options, remaining, macro_targets)
+    record_span("diet.day_select", t_select, meals=len(day["meals"]))
+    day.update(
+        daily_target_calories=round(tdee, 1),
+        eaten_calories=round(sum(m.get("calories", 0) for m in intake), 1),
+        planned_meals=[m for m in todo if m in slot_options and slot_options[m]],
+    )
+    return day
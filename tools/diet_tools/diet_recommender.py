@@ -1,21 +1,23 @@
 # code/tools/diet_tools/diet_recommender.py
 
 from typing import Dict, Any, List
-from tools.diet_tools.query import DietKGQuery
-from tools.diet_tools.diet_evaluator import recommend_meals
+from tools.kg_clients import get_diet_kg
+from tools.diet_tools.diet_evaluator import recommend_meals, recommend_day
 
 
-_NEO4J_URI = "your neo4j url"
-_NEO4J_AUTH = ("neo4j", "password")
+def diet_recommendation_tool(args: Dict[str, Any]) -> List[Dict[str, Any]]:
+    # 共享 driver，连接信息取 cfg 里的 diet_neo4j_*（见 tools.kg_clients）
+    results = recommend_meals(args, get_diet_kg())
 
-_kg = None
+    return results
 
 
-def diet_recommendation_tool(args: Dict[str, Any]) -> List[Dict[str, Any]]:
-    global _kg
-    if _kg is None:
-        _kg = DietKGQuery(_NEO4J_URI, _NEO4J_AUTH)
+def diet_day_recommendation_tool(args: Dict[str, Any]) -> Dict[str, Any]:
+    # 今天剩下的餐段：四个餐段并发取候选，联合满足剩余热量 / 宏量预算（已记录的餐段跳过）
+    return recommend_day(args, get_diet_kg())
 
-    results = recommend_meals(args, _kg)
 
-    return results
+def diet_week_plan_tool(args: Dict[str, Any]) -> Dict[str, Any]:
+    # 一周方案：本地贪心 + 局部搜索（见 week_planner.py），LLM 只负责讲解
+    from tools.diet_tools.week_planner import plan_week
+    return plan_week(args, get_diet_kg())
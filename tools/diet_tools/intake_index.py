@@ -0,0 +1,142 @@
+# tools/diet_tools/intake_index.py
+import threading
+from bisect import bisect_left, insort
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from core.resources import get_resource, LRUDict
+from core.metrics import record_cache
+
+# ============================================================
+# 饮食摄入滚动聚合（_construct_diet_user_profile / 历史惩罚用）
+#
+# 每个用户一个 IntakeIndex，按天分桶：
+#   calories / protein / carb / fat   —— 当天累计
+#   entries / meals[meal_type]        —— 当天的摄入条目（profile 里 today_intake 的形状）
+#   recipes                           —— (记录时间, 小写 summary)，最近 N 天的菜名多重集
+#
+# 事件列表只追加：每次查询只把上次之后新增的事件折进来（每条事件只解析一次时间戳），
+# 之后 today / window / recent_recipes 都只看窗口内的几个天桶。
+# 图谱被整体替换（已折叠的最后一条对不上）时从头重建。
+# ============================================================
+
+DIET_EVENT_TYPES = ("DietLog", "MealLog")
+MACROS = ("calories", "protein", "carb", "fat")
+RECENT_DAYS = 7              # 与 history_penalty 的窗口一致：days > 7 不再惩罚
+INDEX_CACHE_SIZE = 256
+
+
+def _num(value: Any) -> float:
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _fingerprint(event: Dict[str, Any]) -> Tuple:
+    props = event.get("props", {}) or {}
+    return event.get("type"), event.get("ts"), props.get("summary")
+
+
+def _new_day() -> Dict[str, Any]:
+    day = {k: 0.0 for k in MACROS}
+    day.update(entries=[], meals=defaultdict(list), recipes=[])
+    return day
+
+
+class IntakeIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self.days: Dict[str, Dict[str, Any]] = {}
+        self._dates: List[str] = []          # 有序的天桶 key（YYYY-MM-DD 字符串序即时间序）
+        self.consumed = 0                    # 已折叠的事件数
+        self._tail: Optional[Tuple] = None   # 最后一条已折叠事件的指纹
+
+    # ---------- 维护 ----------
+    def _fold(self, event: Dict[str, Any]) -> None:
+        if event.get("type") not in DIET_EVENT_TYPES:
+            return
+        props = event.get("props", {}) or {}
+        try:
+            logged = datetime.fromtimestamp(event.get("ts", 0))
+        except (TypeError, ValueError, OverflowError, OSError):
+            return
+
+        key = logged.strftime("%Y-%m-%d")
+        day = self.days.get(key)
+        if day is None:
+            day = self.days[key] = _new_day()
+            insort(self._dates, key)
+
+        for k in MACROS:
+            day[k] += _num(props.get(k))
+
+        entry = {
+            "meal_time": props.get("meal_type", "snack"),
+            "calories": props.get("calories", 0),
+            "timestamp": logged.isoformat(),
+            "recipes": [{"recipe_name": props.get("summary", "Unknown")}]
+        }
+        day["entries"].append(entry)
+        day["meals"][entry["meal_time"]].append(entry)
+        day["recipes"].append((logged, str(props.get("summary", "")).lower()))
+
+    def sync(self, events: List[Dict[str, Any]]) -> int:
+        """折叠新增事件，返回本次折叠的条数"""
+        with self._lock:
+            n = self.consumed
+            if n > len(events) or (n and _fingerprint(events[n - 1]) != self._tail):
+                self._reset()
+                n = 0
+            for ev in events[n:]:
+                self._fold(ev)
+            if events:
+                self._tail = _fingerprint(events[-1])
+            self.consumed = len(events)
+            return self.consumed - n
+
+    # ---------- 查询 ----------
+    def day(self, date: datetime) -> Dict[str, Any]:
+        return self.days.get(date.strftime("%Y-%m-%d")) or _new_day()
+
+    def today(self, now: Optional[datetime] = None) -> Dict[str, Any]:
+        return self.day(now or datetime.now())
+
+    def _window_dates(self, days: int, now: datetime) -> List[str]:
+        start = (now - timedelta(days=days)).strftime("%Y-%m-%d")
+        return self._dates[bisect_left(self._dates, start):]
+
+    def window(self, days: int = RECENT_DAYS, now: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """days 天前那天到今天的摄入条目，按天有序"""
+        now = now or datetime.now()
+        return [e for key in self._window_dates(days, now) for e in self.days[key]["entries"]]
+
+    def recent_recipes(self, now: Optional[datetime] = None, days: int = RECENT_DAYS) -> Dict[str, float]:
+        """
+        最近 days 天吃过的 summary -> 衰减权重之和，权重与 history_penalty 相同：1 / (距今天数 + 1)
+        """
+        now = now or datetime.now()
+        weights: Dict[str, float] = defaultdict(float)
+        for key in self._window_dates(days + 1, now):
+            for logged, text in self.days[key]["recipes"]:
+                ago = (now - logged).days
+                if ago > days:
+                    continue
+                weights[text] += 1.0 / max(ago + 1, 1)
+        return dict(weights)
+
+
+def get_intake_index(graph: Dict[str, Any], owner: Optional[str] = None) -> IntakeIndex:
+    """每个用户一份，跨轮次增量维护（新事件追加后只折叠新增部分）"""
+    cache = get_resource("profiles.diet_intake", INDEX_CACHE_SIZE,
+                         lambda: LRUDict(INDEX_CACHE_SIZE))
+    index = cache.get(owner)
+    if index is None:
+        index = cache[owner] = IntakeIndex()
+    folded = index.sync(graph.get("events", []) or [])
+    record_cache("diet_intake", folded == 0)
+    return index
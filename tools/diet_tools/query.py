@@ -1,5 +1,199 @@
+import re
+from functools import lru_cache
 from neo4j import GraphDatabase
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
+from core.tracing import run_query, set_attrs
+from tools.schema_probe import SchemaProbe
+
+# ============================================================
+# 查询变体（schema_probe 选好后预编译，不走「失败 -> 探测 -> 重试」）
+#
+#   - 菜名字段：导入脚本写的是 r.name，老库 / 其他数据源是 r.recipe_name
+#   - search_items：Recipe 菜名上有全文索引就走 db.index.fulltext.queryNodes，
+#     没有则退回 toLower(...) CONTAINS 全标签扫描（导入脚本会建这个索引）
+# 查询里的 __NAME__ 在编译时替换成实际字段
+# ============================================================
+
+NAME_PROPERTIES = ("name", "recipe_name")
+
+SEARCH_FULLTEXT_QUERY = """
+CALL db.index.fulltext.queryNodes($index, $q) YIELD node AS r, score
+WHERE r:Recipe
+RETURN
+  r.label         AS id,
+  r.__NAME__      AS name,
+  r.calories      AS calories,
+  r.servings      AS servings,
+  r.meal_type     AS meal_type,
+  r.diet_labels   AS diet_labels,
+  score
+ORDER BY score DESC
+LIMIT $limit
+"""
+
+SEARCH_SCAN_QUERY = """
+MATCH (r:Recipe)
+WHERE toLower(r.__NAME__) CONTAINS $keyword
+RETURN
+  r.label         AS id,
+  r.__NAME__      AS name,
+  r.calories      AS calories,
+  r.servings      AS servings,
+  r.meal_type     AS meal_type,
+  r.diet_labels   AS diet_labels,
+  null            AS score
+ORDER BY size(r.__NAME__)
+LIMIT $limit
+"""
+
+FETCH_CANDIDATES_QUERY = """
+MATCH (r:Recipe)
+WHERE
+  r.meal_type CONTAINS $meal_type
+  AND ANY(dt IN $dish_types WHERE r.dish_type CONTAINS dt)
+
+  AND (
+    size($diet_labels) = 0
+    OR ALL(dl IN $diet_labels WHERE r.diet_labels CONTAINS dl)
+  )
+
+  AND (
+    size($forbidden_cautions) = 0
+    OR NONE(fc IN $forbidden_cautions WHERE r.cautions CONTAINS fc)
+  )
+
+RETURN
+  r.label           AS recipe_id,
+  r.__NAME__        AS recipe_name,
+  r.calories        AS calories,
+  r.servings        AS servings,
+  r.cuisine_type    AS cuisine_type,
+  r.meal_type       AS meal_type,
+  r.dish_type       AS dish_type,
+  r.diet_labels     AS diet_labels,
+  r.health_labels   AS health_labels
+"""
+
+FETCH_CANDIDATES_WITH_DETAIL_QUERY = """
+MATCH (r:Recipe)
+WHERE
+  r.meal_type CONTAINS $meal_type
+  AND ANY(dt IN $dish_types WHERE r.dish_type CONTAINS dt)
+
+  AND (
+    size($diet_labels) = 0
+    OR ALL(dl IN $diet_labels WHERE r.diet_labels CONTAINS dl)
+  )
+
+  AND (
+    size($forbidden_cautions) = 0
+    OR NONE(fc IN $forbidden_cautions WHERE r.cautions CONTAINS fc)
+  )
+
+OPTIONAL MATCH (r)-[u:USES]->(ing:Ingredient)
+OPTIONAL MATCH (r)-[hn:HAS_NUTRIENT]->(nut:Nutrient)
+OPTIONAL MATCH (r)-[hd:HAS_DAILY_VALUE]->(dv:DailyValue)
+
+RETURN
+  r.label           AS recipe_id,
+  r.__NAME__        AS recipe_name,
+  r.servings        AS servings,
+  r.calories        AS calories,
+  r.cuisine_type    AS cuisine_type,
+  r.meal_type       AS meal_type,
+  r.dish_type       AS dish_type,
+  r.diet_labels     AS diet_labels,
+  r.health_labels   AS health_labels,
+  r.cautions        AS cautions,
+
+  collect(
+    DISTINCT {
+      name: ing.name,
+      quantity: u.quantity,
+      measure: u.measure,
+      weight: u.weight,
+      text: u.text
+    }
+  ) AS ingredients,
+
+  collect(
+    DISTINCT {
+      name: nut.name,
+      label: nut.label,
+      unit: nut.unit,
+      quantity: hn.quantity
+    }
+  ) AS nutrients,
+
+  collect(
+    DISTINCT {
+      name: dv.name,
+      label: dv.label,
+      unit: dv.unit,
+      quantity: hd.quantity
+    }
+  ) AS daily_values
+LIMIT $limit
+"""
+
+RECIPE_FULL_DETAIL_QUERY = """
+MATCH (r:Recipe {__NAME__: $recipe_name})
+
+OPTIONAL MATCH (r)-[u:USES]->(ing:Ingredient)
+OPTIONAL MATCH (r)-[hn:HAS_NUTRIENT]->(nut:Nutrient)
+OPTIONAL MATCH (r)-[hd:HAS_DAILY_VALUE]->(dv:DailyValue)
+
+RETURN
+  r {
+    .*,
+    ingredients: collect(
+      DISTINCT {
+        name: ing.name,
+        quantity: u.quantity,
+        measure: u.measure,
+        weight: u.weight,
+        text: u.text
+      }
+    ),
+    nutrients: collect(
+      DISTINCT {
+        name: nut.name,
+        label: nut.label,
+        unit: nut.unit,
+        quantity: hn.quantity
+      }
+    ),
+    daily_values: collect(
+      DISTINCT {
+        name: dv.name,
+        label: dv.label,
+        unit: dv.unit,
+        quantity: hd.quantity
+      }
+    )
+  } AS recipe
+"""
+
+
+@lru_cache(maxsize=None)
+def _compile_queries(name_prop: str, fulltext_index: Optional[str]) -> Dict[str, str]:
+    templates = {
+        "fetch_candidates": FETCH_CANDIDATES_QUERY,
+        "fetch_candidates_with_detail": FETCH_CANDIDATES_WITH_DETAIL_QUERY,
+        "get_recipe_full_detail_by_name": RECIPE_FULL_DETAIL_QUERY,
+        "search_items": SEARCH_FULLTEXT_QUERY if fulltext_index else SEARCH_SCAN_QUERY,
+    }
+    compiled = {k: q.replace("__NAME__", name_prop) for k, q in templates.items()}
+    compiled["name_property"] = name_prop
+    compiled["search_index"] = fulltext_index
+    return compiled
+
+_LUCENE_SPECIAL = re.compile(r'([+\-!(){}\[\]^"~*?:\\/]|&&|\|\|)')
+
+
+def _lucene_terms(keyword: str) -> str:
+    """关键词转成全文检索语句：转义特殊字符，小写（避免 AND / OR / NOT 被当成运算符）"""
+    return _LUCENE_SPECIAL.sub(r"\\\1", keyword.lower()).strip()
 
 
 class DietKGQuery:
@@ -8,10 +202,17 @@ class DietKGQuery:
         masked_uri = uri
         print(f"[DietKGQuery] Connecting to: {masked_uri} ...")
         self.driver = GraphDatabase.driver(uri, auth=auth)
+        self.schema = SchemaProbe(self.driver, key_labels=("Recipe",))
 
     def close(self):
         self.driver.close()
 
+    def _queries(self) -> Dict[str, str]:
+        schema = self.schema.get()
+        name_prop = schema.pick_property(NAME_PROPERTIES, label="Recipe")
+        fulltext = schema.find_index("Recipe", name_prop, types=("FULLTEXT",))
+        return _compile_queries(name_prop, fulltext["name"] if fulltext else None)
+
     # =====================================================
     # 1️⃣ 基础候选（只返回 Recipe 本身，不碰 ingredient）
     # =====================================================
@@ -27,36 +228,11 @@ class DietKGQuery:
         KG 只做硬约束过滤（不展开关系）
         """
 
-        query = """
-        MATCH (r:Recipe)
-        WHERE
-          r.meal_type CONTAINS $meal_type
-          AND ANY(dt IN $dish_types WHERE r.dish_type CONTAINS dt)
-
-          AND (
-            size($diet_labels) = 0
-            OR ALL(dl IN $diet_labels WHERE r.diet_labels CONTAINS dl)
-          )
-
-          AND (
-            size($forbidden_cautions) = 0
-            OR NONE(fc IN $forbidden_cautions WHERE r.cautions CONTAINS fc)
-          )
-
-        RETURN
-          r.label           AS recipe_id,
-          r.name            AS recipe_name,
-          r.calories        AS calories,
-          r.servings        AS servings,
-          r.cuisine_type    AS cuisine_type,
-          r.meal_type       AS meal_type,
-          r.dish_type       AS dish_type,
-          r.diet_labels     AS diet_labels,
-          r.health_labels   AS health_labels
-        """
+        query = self._queries()["fetch_candidates"]
 
         with self.driver.session() as session:
-            result = session.run(
+            return run_query(
+                session, "kg.diet.fetch_candidates",
                 query,
                 meal_type=meal_type,
                 dish_types=dish_types,
@@ -64,7 +240,6 @@ class DietKGQuery:
                 health_labels=health_labels,
                 forbidden_cautions=forbidden_cautions
             )
-            return [r.data() for r in result]
 
     # =====================================================
     # 2️⃣ 带 Ingredient / Nutrient / DailyValue 的完整展开
@@ -82,69 +257,11 @@ class DietKGQuery:
         Recipe + USES(ingredient) + HAS_NUTRIENT + HAS_DAILY_VALUE
         """
 
-        query = """
-        MATCH (r:Recipe)
-        WHERE
-          r.meal_type CONTAINS $meal_type
-          AND ANY(dt IN $dish_types WHERE r.dish_type CONTAINS dt)
-
-          AND (
-            size($diet_labels) = 0
-            OR ALL(dl IN $diet_labels WHERE r.diet_labels CONTAINS dl)
-          )
-
-          AND (
-            size($forbidden_cautions) = 0
-            OR NONE(fc IN $forbidden_cautions WHERE r.cautions CONTAINS fc)
-          )
-
-        OPTIONAL MATCH (r)-[u:USES]->(ing:Ingredient)
-        OPTIONAL MATCH (r)-[hn:HAS_NUTRIENT]->(nut:Nutrient)
-        OPTIONAL MATCH (r)-[hd:HAS_DAILY_VALUE]->(dv:DailyValue)
-
-        RETURN
-          r.label           AS recipe_id,
-          r.name            AS recipe_name,
-          r.servings        AS servings,
-          r.calories        AS calories,
-          r.cuisine_type    AS cuisine_type,
-          r.meal_type       AS meal_type,
-          r.dish_type       AS dish_type,
-          r.diet_labels     AS diet_labels,
-          r.health_labels   AS health_labels,
-
-          collect(
-            DISTINCT {
-              name: ing.name,
-              quantity: u.quantity,
-              measure: u.measure,
-              weight: u.weight,
-              text: u.text
-            }
-          ) AS ingredients,
-
-          collect(
-            DISTINCT {
-              name: nut.name,
-              label: nut.label,
-              unit: nut.unit,
-              quantity: hn.quantity
-            }
-          ) AS nutrients,
-
-          collect(
-            DISTINCT {
-              name: dv.name,
-              label: dv.label,
-              unit: dv.unit,
-              quantity: hd.quantity
-            }
-          ) AS daily_values
-        LIMIT $limit
-        """
+        query = self._queries()["fetch_candidates_with_detail"]
 
         with self.driver.session() as session:
-            result = session.run(
+            return run_query(
+                session, "kg.diet.fetch_candidates_with_detail",
                 query,
                 meal_type=meal_type,
                 dish_types=dish_types,
@@ -152,7 +269,13 @@ class DietKGQuery:
                 forbidden_cautions=forbidden_cautions,
                 limit=limit
             )
-            return [r.data() for r in result]
+
+    def fetch_all_recipes_with_detail(self):
+        """全部 Recipe 的完整展开（离线构建列存 recipe_store 用，不要在请求路径上调用）"""
+        return self.fetch_candidates_with_detail(
+            meal_type="", dish_types=[""], diet_labels=[], health_labels=[],
+            forbidden_cautions=[], limit=10_000_000,
+        )
 
     # =====================================================
     # 3️⃣ 按菜名精确获取完整 Recipe（✔ schema 对齐）
@@ -165,54 +288,20 @@ class DietKGQuery:
         单个 Recipe 的完整信息
         """
 
-        cypher = """
-        MATCH (r:Recipe {name: $recipe_name})
-
-        OPTIONAL MATCH (r)-[u:USES]->(ing:Ingredient)
-        OPTIONAL MATCH (r)-[hn:HAS_NUTRIENT]->(nut:Nutrient)
-        OPTIONAL MATCH (r)-[hd:HAS_DAILY_VALUE]->(dv:DailyValue)
-
-        RETURN
-          r {
-            .*,
-            ingredients: collect(
-              DISTINCT {
-                name: ing.name,
-                quantity: u.quantity,
-                measure: u.measure,
-                weight: u.weight,
-                text: u.text
-              }
-            ),
-            nutrients: collect(
-              DISTINCT {
-                name: nut.name,
-                label: nut.label,
-                unit: nut.unit,
-                quantity: hn.quantity
-              }
-            ),
-            daily_values: collect(
-              DISTINCT {
-                name: dv.name,
-                label: dv.label,
-                unit: dv.unit,
-                quantity: hd.quantity
-              }
-            )
-          } AS recipe
-        """
+        cypher = self._queries()["get_recipe_full_detail_by_name"]
 
         with self.driver.session() as session:
-            record = session.run(
+            rows = run_query(
+                session, "kg.diet.get_recipe_full_detail_by_name",
                 cypher,
                 recipe_name=recipe_name
-            ).single()
+            )
 
-        if not record:
+        if not rows:
             return None
 
-        recipe = record["recipe"]
+        recipe = rows[0]["recipe"]
+        recipe.setdefault("name", recipe.get(self._queries()["name_property"]))
 
         # 安全清洗
         recipe["ingredients"] = [i for i in recipe["ingredients"] if i.get("name")]
@@ -220,3 +309,34 @@ class DietKGQuery:
         recipe["daily_values"] = [d for d in recipe["daily_values"] if d.get("name")]
 
         return recipe
+
+    # =====================================================
+    # 4️⃣ 按关键词搜菜（FAQ 查热量用）
+    # =====================================================
+    def search_items(self, keyword: str, limit: int = 5) -> List[Dict[str, Any]]:
+        """
+        菜名关键词检索，返回 [{id, name, type, cal(每份), calories, servings, meal_type, diet_labels, score}]
+        """
+        keyword = (keyword or "").strip()
+        if not keyword:
+            return []
+
+        queries = self._queries()
+        index = queries["search_index"]
+        set_attrs(search_index=index or "scan")
+
+        with self.driver.session() as session:
+            if index:
+                terms = _lucene_terms(keyword)
+                if not terms:
+                    return []
+                rows = run_query(session, "kg.diet.search_items", queries["search_items"],
+                                 index=index, q=terms, limit=limit)
+            else:
+                rows = run_query(session, "kg.diet.search_items", queries["search_items"],
+                                 keyword=keyword.lower(), limit=limit)
+
+        for row in rows:
+            row["type"] = "Recipe"
+            row["cal"] = round((row.get("calories") or 0) / max(row.get("servings") or 1, 1), 1)
+        return rows
@@ -0,0 +1,326 @@
+# tools/diet_tools/recipe_store.py
+"""Memory-mapped columnar recipe store.
+
+Recipes reach the recommender as record.data() dicts with nested
+``{name, label, unit, quantity}`` lists, which normalize_nutrients /
+normalize_ingredients then walk per combination. The store keeps the same
+data as dense columns that every worker maps read-only (zero copy, shared
+page cache):
+
+    python -m tools.diet_tools.recipe_store --csv ./data/DietKG/DATA/chinese_recipes.csv
+    python -m tools.diet_tools.recipe_store --kg          # from the Diet KG (cfg from env)
+
+Layout of a store directory:
+
+    meta.json               column vocabularies + string tables
+    scalars.npy             float32 [n, 2]   calories, servings
+    nutrients.npy           float32 [n, N]   normalize_nutrients() columns, NaN = missing
+    daily_values.npy        float32 [n, D]
+    ing_offsets.npy         int32   [n + 1]  CSR row pointers into the ing_* arrays
+    ing_name.npy            int32   [nnz]    index into meta["ingredient_names"]
+    ing_weight.npy          float32 [nnz]
+    ing_quantity.npy        float32 [nnz]    NaN = None
+    ing_measure.npy         int32   [nnz]    index into meta["measures"]
+"""
+import argparse
+import ast
+import csv
+import json
+import os
+import shutil
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from core.resources import get_resource
+
+META = "meta.json"
+SCALARS = ("calories", "servings")
+# 原样保留的字符串字段（KG 里都是 str(list)）
+STRING_FIELDS = ("recipe_id", "recipe_name", "cuisine_type", "meal_type", "dish_type",
+                 "diet_labels", "health_labels", "cautions")
+
+
+def store_dir() -> Optional[str]:
+    root = os.getenv("RECIPE_STORE_DIR")
+    if root is None:
+        root = os.path.join(os.getenv("DATA_DIR", "./data"), "recipe_store")
+    if root.strip().lower() in ("", "off"):
+        return None
+    return root
+
+
+def _nutrient_key(n: Dict[str, Any]) -> Optional[str]:
+    # 与 diet_evaluator.normalize_nutrients 的 key 规则一致
+    raw_key = n.get("name") or n.get("label")
+    if not raw_key:
+        return None
+    return str(raw_key).lower().strip().replace(" ", "_").replace("-", "_")
+
+
+def _quantity(value: Any) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+# ============================================================
+# 构建
+# ============================================================
+def build_store(rows: Iterable[Dict[str, Any]], out: str) -> int:
+    """
+    rows: fetch_candidates_with_detail 形状的 dict（ingredients / nutrients / daily_values 为 list）。
+    先写临时目录再整体替换，正在读旧目录的 worker 不受影响。
+    """
+    rows = list(rows)
+    n = len(rows)
+
+    nutrient_cols: Dict[str, int] = {}
+    dv_cols: Dict[str, int] = {}
+    for r in rows:
+        for n_ in r.get("nutrients") or []:
+            key = _nutrient_key(n_) if isinstance(n_, dict) else None
+            if key:
+                nutrient_cols.setdefault(key, len(nutrient_cols))
+        for d in r.get("daily_values") or []:
+            key = _nutrient_key(d) if isinstance(d, dict) else None
+            if key:
+                dv_cols.setdefault(key, len(dv_cols))
+
+    scalars = np.zeros((n, len(SCALARS)), dtype=np.float32)
+    nutrients = np.full((n, len(nutrient_cols)), np.nan, dtype=np.float32)
+    daily_values = np.full((n, len(dv_cols)), np.nan, dtype=np.float32)
+    strings: Dict[str, List[Any]] = {f: [] for f in STRING_FIELDS}
+
+    ingredient_names: Dict[str, int] = {}
+    measures: Dict[str, int] = {"": 0}
+    ing_texts: List[str] = []
+    offsets = [0]
+    ing_name, ing_weight, ing_quantity, ing_measure = [], [], [], []
+
+    for i, r in enumerate(rows):
+        scalars[i] = (_quantity(r.get("calories")), _quantity(r.get("servings")))
+        for f in STRING_FIELDS:
+            v = r.get(f)
+            strings[f].append(v if v is None or isinstance(v, str) else str(v))
+        for n_ in r.get("nutrients") or []:
+            key = _nutrient_key(n_) if isinstance(n_, dict) else None
+            if key:
+                q = _quantity(n_.get("quantity"))
+                # normalize_nutrients 保留两位小数；float32 读回时再 round 即可还原
+                nutrients[i, nutrient_cols[key]] = q if q != q else round(q, 2)
+        for d in r.get("daily_values") or []:
+            key = _nutrient_key(d) if isinstance(d, dict) else None
+            if key:
+                daily_values[i, dv_cols[key]] = _quantity(d.get("quantity"))
+        for ing in r.get("ingredients") or []:
+            if not isinstance(ing, dict) or not ing.get("name"):
+                continue
+            ing_name.append(ingredient_names.setdefault(ing["name"], len(ingredient_names)))
+            ing_weight.append(_quantity(ing.get("weight")))
+            ing_quantity.append(_quantity(ing.get("quantity")))
+            ing_measure.append(measures.setdefault(ing.get("measure") or "", len(measures)))
+            ing_texts.append(ing.get("text") or "")
+        offsets.append(len(ing_name))
+
+    meta = {
+        "count": n,
+        "nutrient_columns": list(nutrient_cols),
+        "daily_value_columns": list(dv_cols),
+        "ingredient_names": list(ingredient_names),
+        "measures": list(measures),
+        "ingredient_texts": ing_texts,
+        "strings": strings,
+    }
+
+    tmp = out.rstrip("/") + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    arrays = {
+        "scalars": scalars,
+        "nutrients": nutrients,
+        "daily_values": daily_values,
+        "ing_offsets": np.asarray(offsets, dtype=np.int32),
+        "ing_name": np.asarray(ing_name, dtype=np.int32),
+        "ing_weight": np.asarray(ing_weight, dtype=np.float32),
+        "ing_quantity": np.asarray(ing_quantity, dtype=np.float32),
+        "ing_measure": np.asarray(ing_measure, dtype=np.int32),
+    }
+    for name, arr in arrays.items():
+        np.save(os.path.join(tmp, f"{name}.npy"), arr)
+    with open(os.path.join(tmp, META), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, separators=(",", ":"))
+
+    old = out.rstrip("/") + ".old"
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(out):
+        os.replace(out, old)
+    os.replace(tmp, out)
+    shutil.rmtree(old, ignore_errors=True)
+    return n
+
+
+def rows_from_csv(csv_file: str) -> Iterable[Dict[str, Any]]:
+    """chinese_recipes.csv -> 与 KG 查询相同形状的行（字段含义见 create_neo4j_kg_for_diet.py）"""
+
+    def _parse(x, default):
+        try:
+            return json.loads(x)
+        except Exception:
+            try:
+                return ast.literal_eval(x)
+            except Exception:
+                return default
+
+    with open(csv_file, "r", encoding="utf-8-sig") as f:
+        for row in csv.DictReader(f):
+            nutrients = _parse(row.get("total_nutrients") or "{}", {})
+            daily_values = _parse(row.get("daily_values") or "{}", {})
+            yield {
+                "recipe_id": row["label"],
+                "recipe_name": row["recipe_name"],
+                "servings": row.get("servings"),
+                "calories": row.get("calories"),
+                "cuisine_type": row.get("cuisine_type"),
+                "meal_type": row.get("meal_type"),
+                "dish_type": row.get("dish_type"),
+                "diet_labels": row.get("diet_labels"),
+                "health_labels": row.get("health_labels"),
+                "cautions": row.get("cautions"),
+                "ingredients": [
+                    {"name": i.get("food"), "quantity": i.get("quantity"), "measure": i.get("measure"),
+                     "weight": i.get("weight"), "text": i.get("text")}
+                    for i in _parse(row.get("ingredients") or "[]", [])
+                    if isinstance(i, dict)
+                ],
+                "nutrients": [
+                    {"name": k, "label": v.get("label"), "unit": v.get("unit"), "quantity": v.get("quantity")}
+                    for k, v in nutrients.items()
+                ],
+                "daily_values": [
+                    {"name": k, "label": v.get("label"), "unit": v.get("unit"), "quantity": v.get("quantity")}
+                    for k, v in daily_values.items()
+                ],
+            }
+
+
+# ============================================================
+# 读取
+# ============================================================
+class RecipeStore:
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, META), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+
+        def _load(name):
+            return np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+
+        self.scalars = _load("scalars")
+        self.nutrients = _load("nutrients")
+        self.daily_values = _load("daily_values")
+        self.ing_offsets = _load("ing_offsets")
+        self.ing_name = _load("ing_name")
+        self.ing_weight = _load("ing_weight")
+        self.ing_quantity = _load("ing_quantity")
+        self.ing_measure = _load("ing_measure")
+
+        self.nutrient_columns: List[str] = self.meta["nutrient_columns"]
+        self.ingredient_names: List[str] = self.meta["ingredient_names"]
+        self._strings: Dict[str, List[Any]] = self.meta["strings"]
+        self._index: Optional[Dict[str, int]] = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self.meta["count"]
+
+    def index_of(self, recipe_id: Optional[str]) -> Optional[int]:
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    self._index = {rid: i for i, rid in enumerate(self._strings["recipe_id"])}
+        return self._index.get(recipe_id)
+
+    def nutrients_of(self, i: int) -> Dict[str, float]:
+        """等价于 normalize_nutrients(row["nutrients"])"""
+        row = self.nutrients[i]
+        return {c: round(float(v), 2) for c, v in zip(self.nutrient_columns, row) if v == v}
+
+    def ingredient_names_of(self, i: int) -> List[str]:
+        lo, hi = int(self.ing_offsets[i]), int(self.ing_offsets[i + 1])
+        names = self.ingredient_names
+        return [names[j] for j in self.ing_name[lo:hi]]
+
+    def ingredients_of(self, i: int) -> List[Dict[str, Any]]:
+        """等价于 normalize_ingredients(row["ingredients"])"""
+        lo, hi = int(self.ing_offsets[i]), int(self.ing_offsets[i + 1])
+        measures, texts = self.meta["measures"], self.meta["ingredient_texts"]
+        out = []
+        for j in range(lo, hi):
+            q = float(self.ing_quantity[j])
+            w = float(self.ing_weight[j])
+            out.append({
+                "name": self.ingredient_names[self.ing_name[j]],
+                "quantity": None if q != q else q,
+                "measure": measures[self.ing_measure[j]],
+                "weight_g": round(0.0 if w != w else w, 1),
+                "text": texts[j],
+            })
+        return out
+
+    def row(self, i: int, detail: bool = False) -> Dict[str, Any]:
+        """标量 + 字符串字段（detail=True 时附带规范化后的食材 / 营养素）"""
+        out = {f: self._strings[f][i] for f in STRING_FIELDS}
+        out["calories"] = float(self.scalars[i, 0])
+        out["servings"] = float(self.scalars[i, 1])
+        out["store_index"] = i
+        if detail:
+            out["ingredients"] = self.ingredients_of(i)
+            out["nutrients"] = self.nutrients_of(i)
+        return out
+
+
+def open_store(path: str) -> Optional[RecipeStore]:
+    """按 meta.json 的 mtime 缓存；目录被重建后自动换新"""
+    try:
+        mtime = os.stat(os.path.join(path, META)).st_mtime_ns
+    except OSError:
+        return None
+    return get_resource(f"recipes.{os.path.abspath(path)}", mtime,
+                        lambda: RecipeStore(path), exclusive=True)
+
+
+def get_recipe_store() -> Optional[RecipeStore]:
+    root = store_dir()
+    return open_store(root) if root else None
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description="Build the columnar recipe store")
+    src = parser.add_mutually_exclusive_group(required=True)
+    src.add_argument("--csv", help="chinese_recipes.csv")
+    src.add_argument("--kg", action="store_true", help="从 Diet KG 读取（cfg 取环境变量）")
+    parser.add_argument("--out", default=None, help="默认 $RECIPE_STORE_DIR 或 $DATA_DIR/recipe_store")
+    args = parser.parse_args(argv)
+
+    out = args.out or store_dir()
+    if not out:
+        parser.error("RECIPE_STORE_DIR is off; pass --out")
+
+    if args.csv:
+        rows = rows_from_csv(args.csv)
+    else:
+        from core.config import configure, load_cfg_from_env
+        from tools.kg_clients import get_diet_kg
+        configure(load_cfg_from_env())
+        rows = get_diet_kg().fetch_all_recipes_with_detail()
+
+    n = build_store(rows, out)
+    print(f"[RecipeStore] {n} recipes -> {out}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,269 @@
+# tools/diet_tools/week_planner.py
+import random
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from core.tracing import traced, record_span, set_attrs
+from tools.diet_tools.diet_evaluator import (
+    DAY_MEALS, DAY_REPEAT_PENALTY,
+    compute_tdee, daily_macro_targets, day_meal_targets, day_objective,
+    fetch_slot_options, select_day_plan,
+)
+
+# ============================================================
+# 一周饮食方案（本地优化，LLM 只负责讲解）
+#
+#   1️⃣ 各餐段并发查一次候选（打分在当前线程，见 fetch_slot_options），留 Top-N 方案（与单餐推荐同一套打分）
+#   2️⃣ 贪心：逐天跑 select_day_plan（每个餐段先按「方案分 - 重复代价」取前 GREEDY_SHORTLIST 个，控制 DP 规模）
+#   3️⃣ 局部搜索：随机挑 (天, 餐段) 换成该餐段的其他方案，目标变好才接受，
+#      直到一整轮没有改进或用完 time_budget_s
+#   4️⃣ 修复：重复上限是硬约束。仍有菜超出 max_repeats 时逐步替换（见 _repair_over_cap，不受 time_budget_s 限制）；
+#      修完还剩的 over_cap 说明候选菜本身不够轮换，由调用方如实告诉用户
+#   5️⃣ 校验：每天的热量 / 宏量不在目标区间的记进 macro_gaps（宏量在目标里只是软约束，
+#      候选菜普遍偏碳水时蛋白质怎么换都够不着，加大权重只会把热量一起压低），同样由调用方告诉用户
+#
+# 候选池按菜去重：每道菜最多出现在 POOL_RECIPE_CAP 个方案里（否则 Top-N 会被同一道高分菜的各种搭配占满，
+# 怎么换都绕不开它），另外带上每道菜的单菜方案，保证修复时有地方可换
+# 目标 = Σ 每天的 day_objective（方案分 - 热量 / 宏量偏差）- 重复代价
+# 重复代价 = 每道菜第 2 次起 REUSE_PENALTY / 次 + 超出上限部分 OVER_CAP_PENALTY / 次
+# forbidden_cautions 在取候选时就过滤掉（后端过滤之外还有一道兜底，见 diet_evaluator._slot_options）
+# ============================================================
+
+WEEK_DAYS = 7
+WEEK_TOP_N = 24             # 每个餐段的候选方案数（一周要轮换，比单日多）
+POOL_RECIPE_CAP = 3         # 每个餐段的候选池里，同一道菜最多出现在几个方案中
+GREEDY_SHORTLIST = 5        # 贪心每天每个餐段进 DP 的方案数（5^4 个组合），其余交给局部搜索
+MAX_REPEATS = 2             # 同一道菜一周最多出现几次
+OVER_CAP_PENALTY = 5.0      # 贪心 / 局部搜索里每超出一次上限的惩罚；搜索后还超的由 4️⃣ 修复
+REUSE_PENALTY = 0.2         # 上限以内的重复也轻微扣分，鼓励轮换
+WEEK_TIME_BUDGET_S = 0.3
+SEARCH_SEED = 0             # 固定种子：同样的输入得到同样的计划
+CAL_TOLERANCE = 0.10        # 全天热量偏离目标超过 10% 记进 macro_gaps（宏量用 daily_macro_targets 的区间）
+
+
+def _names(plan: Dict[str, Any]) -> List[str]:
+    return [r["recipe_name"] for r in plan["recipes"]]
+
+
+def _day_value(picks: List[Dict[str, Any]], target_cal: float, macro_targets: Dict[str, tuple]) -> float:
+    """与 select_day_plan 相同的单日目标：方案分 - 同日重复 - 热量 / 宏量偏差"""
+    score, seen = 0.0, set()
+    totals = [0.0] * (1 + len(macro_targets))
+    for plan in picks:
+        names = _names(plan)
+        score += plan.get("score", plan["base_score"]) - DAY_REPEAT_PENALTY * sum(n in seen for n in names)
+        seen.update(names)
+        totals[0] += plan["actual_calories"]
+        for j, m in enumerate(macro_targets):
+            totals[1 + j] += plan["macros"].get(m, 0.0)
+    return day_objective(score, totals, target_cal, macro_targets)
+
+
+def _repeat_cost(counts: Counter, max_repeats: int) -> float:
+    return sum(REUSE_PENALTY * max(0, c - 1) + OVER_CAP_PENALTY * max(0, c - max_repeats)
+               for c in counts.values())
+
+
+def _excess(counts: Counter, max_repeats: int) -> int:
+    return sum(max(0, c - max_repeats) for c in counts.values())
+
+
+def _over_cap(counts: Counter, max_repeats: int) -> Dict[str, int]:
+    return {n: c for n, c in counts.items() if c > max_repeats}
+
+
+def _summarize_day(index: int, picks: List[Dict[str, Any]], target_cal: float,
+                   macro_targets: Dict[str, tuple]) -> Dict[str, Any]:
+    macros = {m: round(sum(p["macros"].get(m, 0.0) for p in picks), 1) for m in macro_targets}
+    return {
+        "day": index + 1,
+        "target_calories": round(target_cal, 1),
+        "actual_calories": round(sum(p["actual_calories"] for p in picks), 1),
+        "macro_targets": {m: [round(lo, 1), round(hi, 1)] for m, (lo, hi) in macro_targets.items()},
+        "macros": macros,
+        "score": round(_day_value(picks, target_cal, macro_targets), 4),
+        "meals": [dict(p) for p in picks],
+    }
+
+
+def _macro_gaps(days: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+    """{营养素: [{day, actual, target: [low, high]}]}，只列不在目标区间的天（calories 按 CAL_TOLERANCE）"""
+    gaps: Dict[str, List[Dict[str, Any]]] = {}
+    for day in days:
+        target = day["target_calories"]
+        bands = {"calories": (day["actual_calories"],
+                              [round(target * (1 - CAL_TOLERANCE), 1), round(target * (1 + CAL_TOLERANCE), 1)])}
+        bands.update((m, (day["macros"][m], band)) for m, band in day["macro_targets"].items())
+        for nutrient, (actual, (low, high)) in bands.items():
+            if actual < low or actual > high:
+                gaps.setdefault(nutrient, []).append({"day": day["day"], "actual": actual, "target": [low, high]})
+    return gaps
+
+
+def _repair_over_cap(week: List[List[Dict[str, Any]]], slot_options: List[List[Dict[str, Any]]],
+                     counts: Counter, max_repeats: int, day_values: List[float], day_value) -> int:
+    """
+    每步在「超出次数减少」或「超出次数不变、总菜次减少（给超限的菜腾出替代品）」的替换里
+    选目标损失最小的一个，直到没有这样的替换；(超出次数, 总菜次) 单调下降，一定会停。
+    只动候选池里有超限菜的餐段；最后一段没换来超出次数减少的腾位置替换会撤销。返回替换次数
+    """
+    repairs = 0
+    undo = []       # 上一次超出次数减少之后的腾位置替换：(d, s, 原方案, 原目标)
+    while True:
+        over = {n for n, c in counts.items() if c > max_repeats}
+        if not over:
+            break
+        excess = _excess(counts, max_repeats)
+        best = None
+        for s, options in enumerate(slot_options):
+            if not any(n in over for p in options for n in _names(p)):
+                continue
+            for d, picks in enumerate(week):
+                current = picks[s]
+                cur_names = _names(current)
+                for option in options:
+                    new_names = _names(option)
+                    counts.subtract(cur_names)
+                    counts.update(new_names)
+                    new_excess = _excess(counts, max_repeats)
+                    counts.subtract(new_names)
+                    counts.update(cur_names)
+                    if not (new_excess < excess
+                            or (new_excess == excess and len(new_names) < len(cur_names))):
+                        continue
+                    picks[s] = option
+                    value = day_value(picks)
+                    picks[s] = current
+                    key = (new_excess, day_values[d] - value)
+                    if best is None or key < best[0]:
+                        best = (key, d, s, option, value)
+        if best is None:
+            break
+        (new_excess, _), d, s, option, value = best
+        undo = [] if new_excess < excess else undo + [(d, s, week[d][s], day_values[d])]
+        _swap(week, counts, d, s, option)
+        day_values[d] = value
+        repairs += 1
+
+    for d, s, option, value in reversed(undo):
+        _swap(week, counts, d, s, option)
+        day_values[d] = value
+    return repairs - len(undo)
+
+
+def _swap(week: List[List[Dict[str, Any]]], counts: Counter, d: int, s: int, option: Dict[str, Any]) -> None:
+    counts.subtract(_names(week[d][s]))
+    counts.update(_names(option))
+    week[d][s] = option
+
+
+@traced("diet.plan_week")
+def plan_week(user, kg: "DietKGQuery", days: int = WEEK_DAYS, meals=DAY_MEALS,
+              max_repeats: int = MAX_REPEATS, time_budget_s: float = WEEK_TIME_BUDGET_S,
+              top_n: int = WEEK_TOP_N, seed: Optional[int] = SEARCH_SEED) -> Dict[str, Any]:
+    """
+    返回 {target_calories, macro_targets, max_repeats, days: [select_day_plan 形状 + day], repeats, over_cap,
+          macro_gaps, search}
+    """
+    tdee = compute_tdee(user)
+    macro_targets = daily_macro_targets(user, tdee)
+    slot_options = fetch_slot_options(user, kg, day_meal_targets(tdee, meals), top_n,
+                                      max_per_recipe=POOL_RECIPE_CAP)
+    slots = [m for m in meals if slot_options.get(m)]
+    set_attrs(days=days, meals=len(slots))
+
+    # ---------- 2️⃣ 贪心：逐天选，已经用过的菜按重复代价扣分 ----------
+    t_greedy = time.perf_counter()
+    counts: Counter = Counter()
+    week: List[List[Dict[str, Any]]] = []
+
+    def reuse_cost(plan):
+        cost = 0.0
+        for n in _names(plan):
+            cost += REUSE_PENALTY * (counts[n] >= 1) + OVER_CAP_PENALTY * (counts[n] >= max_repeats)
+        return cost
+
+    for _ in range(days):
+        shortlist = {
+            m: sorted(slot_options[m], key=lambda p: reuse_cost(p) - p["score"])[:GREEDY_SHORTLIST]
+            for m in slots
+        }
+        # select_day_plan 按餐段顺序给出，每个餐段恰好一个
+        picks = select_day_plan(shortlist, tdee, macro_targets, extra_penalty=reuse_cost)["meals"]
+        week.append(list(picks))
+        counts.update(n for p in picks for n in _names(p))
+    record_span("diet.week_greedy", t_greedy, days=days)
+
+    # ---------- 3️⃣ 局部搜索：单点替换 ----------
+    t_search = time.perf_counter()
+    deadline = t_search + time_budget_s
+    rng = random.Random(seed)
+    day_values = [_day_value(picks, tdee, macro_targets) for picks in week]
+    moves = [(d, s) for d in range(days) for s in range(len(slots))]
+    iterations = improvements = 0
+
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        rng.shuffle(moves)
+        for d, s in moves:
+            if time.perf_counter() >= deadline:
+                break
+            current = week[d][s]
+            cur_names = _names(current)
+            cost_before = _repeat_cost(counts, max_repeats)
+            for option in slot_options[slots[s]]:
+                if option is current:
+                    continue
+                iterations += 1
+                new_names = _names(option)
+                counts.subtract(cur_names)
+                counts.update(new_names)
+                cost_after = _repeat_cost(counts, max_repeats)
+
+                week[d][s] = option
+                value = _day_value(week[d], tdee, macro_targets)
+                delta = (value - day_values[d]) - (cost_after - cost_before)
+                if delta > 1e-9:
+                    day_values[d] = value
+                    current, cur_names, cost_before = option, new_names, cost_after
+                    improvements += 1
+                    improved = True
+                else:
+                    week[d][s] = current
+                    counts.subtract(new_names)
+                    counts.update(cur_names)
+    record_span("diet.week_search", t_search, iterations=iterations, improvements=improvements)
+
+    # ---------- 4️⃣ 修复：超出上限是硬约束，局部搜索没消掉的逐个换掉 ----------
+    t_repair = time.perf_counter()
+    repairs = _repair_over_cap(week, [slot_options[m] for m in slots], counts, max_repeats, day_values,
+                               lambda picks: _day_value(picks, tdee, macro_targets))
+    record_span("diet.week_repair", t_repair, repairs=repairs, excess=_excess(counts, max_repeats))
+
+    counts = +counts
+    over_cap = _over_cap(counts, max_repeats)
+    if over_cap:
+        print(f"[WeekPlan] repeat cap {max_repeats} not satisfiable with current candidates: {over_cap}")
+
+    # ---------- 5️⃣ 校验：热量 / 宏量不达标的天 ----------
+    day_summaries = [_summarize_day(i, picks, tdee, macro_targets) for i, picks in enumerate(week)]
+    macro_gaps = _macro_gaps(day_summaries)
+    if macro_gaps:
+        print(f"[WeekPlan] off-target days: { {n: [g['day'] for g in v] for n, v in macro_gaps.items()} }")
+    return {
+        "target_calories": round(tdee, 1),
+        "macro_targets": {m: [round(lo, 1), round(hi, 1)] for m, (lo, hi) in macro_targets.items()},
+        "max_repeats": max_repeats,
+        "days": day_summaries,
+        "repeats": dict(counts.most_common()),
+        "over_cap": over_cap,
+        "macro_gaps": macro_gaps,
+        "search": {
+            "iterations": iterations,
+            "improvements": improvements,
+            "repairs": repairs,
+            "elapsed_ms": round((time.perf_counter() - t_greedy) * 1000, 1),
+        },
+    }
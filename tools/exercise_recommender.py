@@ -1,37 +1,11 @@
 # code/tools/exercise_recommender.py
 
 from typing import Dict, Any, List, Optional
-from threading import Lock
 
-from core.config import get_cfg
-from tools.exercise_tools.query import ExerciseKGQuery
+from tools.kg_clients import get_exercise_kg
 from tools.exercise_tools.recommender_exrx import recommend_exercises
 
 
-# ============================================================
-# Neo4j Client (Exercise)
-# ============================================================
-
-cfg = get_cfg()
-_NEO4J_URI = cfg["neo4j_uri"]
-_NEO4J_AUTH = (cfg["neo4j_user"], cfg["neo4j_password"])
-
-_kg_client: Optional[ExerciseKGQuery] = None
-_kg_lock = Lock()
-
-
-def _get_kg_client() -> ExerciseKGQuery:
-    """
-    Lazy-loaded singleton for Neo4j KG client
-    """
-    global _kg_client
-    if _kg_client is None:
-        with _kg_lock:
-            if _kg_client is None:
-                _kg_client = ExerciseKGQuery(_NEO4J_URI, _NEO4J_AUTH)
-    return _kg_client
-
-
 # ============================================================
 # MAS Tool Interface
 # ============================================================
@@ -48,6 +22,7 @@ def recommend_exercise_tool(
         "injury_body_part": List[str],
         "available_equipment": List[str],
         "history": List[dict],
+        "history_profile": HistoryProfile (optional, 同一轮共用，见 history_profile.py),
         "topk": int (optional)
     }
 
@@ -80,11 +55,13 @@ def recommend_exercise_tool(
         "injury_body_part": injury_body_part,
         "available_equipment": available_equipment,
         "history": history,
+        "history_profile": args.get("history_profile"),
     }
 
 
     try:
-        kg = _get_kg_client()
+        # 共享 driver（按当前 cfg 缓存，见 tools.kg_clients）
+        kg = get_exercise_kg()
         results = recommend_exercises(
             user_profile=user_profile,
             kg_query=kg,
@@ -112,6 +89,7 @@ def recommend_exercise_tool(
                 "target_body_part": target_body_part,
                 "utility": r.get("utility"),
                 "force": r.get("force"),
+                "equipment": _equipment_of(r),
                 "target muscles": r.get("target_muscles")
             },
             "source": "Exercise_Recommender"
@@ -125,6 +103,46 @@ def recommend_exercise_tool(
     return evidences
 
 
+def build_program_tool(args: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    MAS Tool: 一周训练计划（见 exercise_tools/program_builder.py）
+
+    Expected args:
+    {
+        "body_parts": List[str],
+        "days_per_week": int,
+        "time_min": float,
+        "goal": str,
+        "injury_body_part": List[str],
+        "available_equipment": List[str],
+        "history": List[dict],
+        "history_profile": HistoryProfile (optional)
+    }
+    Returns:
+    workout_draft 形状的 dict（{split, schedule, sessions, notes}），失败时返回 {}
+    """
+    if not args or not args.get("body_parts") or not args.get("available_equipment"):
+        return {}
+
+    from tools.exercise_tools.program_builder import build_weekly_program
+
+    try:
+        return build_weekly_program(
+            get_exercise_kg(),
+            body_parts=args["body_parts"],
+            days_per_week=args.get("days_per_week"),
+            time_min=args.get("time_min"),
+            goal=args.get("goal"),
+            injury_body_part=args.get("injury_body_part", []),
+            available_equipment=args["available_equipment"],
+            history=args.get("history", []),
+            history_profile=args.get("history_profile"),
+        )
+    except Exception as e:
+        print(f"[ProgramBuilder] Failed: {e}")
+        return {}
+
+
 # ============================================================
 # Utils
 # ============================================================
@@ -139,3 +157,15 @@ def _truncate_text(text: Any, max_len: int = 120) -> str:
     if len(s) <= max_len:
         return s
     return s[:max_len] + "..."
+
+
+def _equipment_of(row: Dict[str, Any]) -> List[str]:
+    """
+    器械名称；老的物化表只存了 mask（equipment 为空），按 mask 还原父类名兜底
+    """
+    if row.get("equipment"):
+        return list(row["equipment"])
+    if row.get("equipment_mask"):
+        from tools.exercise_tools.equipment import equipment_names
+        return equipment_names(row["equipment_mask"])
+    return []
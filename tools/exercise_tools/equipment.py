@@ -0,0 +1,80 @@
+# tools/exercise_tools/equipment.py
+from functools import lru_cache
+from typing import Iterable, Optional, Tuple
+
+# ============================================================
+# 器械可行性位掩码
+#
+# 每个 ExerciseVariant 在 KG 导入时存一个 equipment_mask（需要的「真实器械」父类），
+# 用户的可用器械同样折成一个 mask，可行性 = 一次按位与：
+#     exercise_mask & ~user_mask == 0
+# Cypher 没有按位运算，下推到 Neo4j 时改用「user_mask 的全部子集」做 IN 过滤（≤ 2^8 个值）。
+#
+# ⚠️ 位的顺序会写进 KG，只能在末尾追加，不要调整已有顺序。
+# ============================================================
+
+EQUIPMENT_BITS: Tuple[str, ...] = (
+    "Barbell",
+    "Dumbbell",
+    "Cable",
+    "Smith",
+    "Lever",
+    "Suspended",
+    "Sled",
+    "Band Resistive",
+)
+
+# =========================
+# Real physical equipment
+# =========================
+REAL_EQUIPMENT = set(EQUIPMENT_BITS)
+
+# =========================
+# Equipment subtype mapping
+# =========================
+EQUIPMENT_PARENT = {
+    "Lever (plate loaded)": "Lever",
+    "Lever (selectorized)": "Lever",
+    "Sled (plate loaded)": "Sled",
+    "Sled (selectorized)": "Sled",
+    "Suspension": "Suspended",
+}
+
+_BIT = {name: 1 << i for i, name in enumerate(EQUIPMENT_BITS)}
+
+
+def equipment_mask(exercise_equipment: Optional[Iterable[str]]) -> int:
+    """动作需要的真实器械（子类型归到父类；徒手 / Weighted 等不占位）"""
+    mask = 0
+    for eq in exercise_equipment or []:
+        mask |= _BIT.get(EQUIPMENT_PARENT.get(eq, eq), 0)
+    return mask
+
+
+def equipment_names(mask: int) -> list:
+    """mask 还原成父类器械名（只用于兜底展示：徒手 / Weighted 等不占位的信息已丢失）"""
+    return [name for name, bit in _BIT.items() if mask & bit]
+
+
+def user_equipment_mask(user_equipment: Optional[Iterable[str]]) -> int:
+    """用户拥有的真实器械；与原来的集合判断一致，只认父类名"""
+    mask = 0
+    for eq in user_equipment or []:
+        mask |= _BIT.get(eq, 0)
+    return mask
+
+
+def is_feasible_mask(exercise_mask: int, user_mask: int) -> bool:
+    return exercise_mask & ~user_mask == 0
+
+
+@lru_cache(maxsize=256)
+def feasible_masks(user_mask: int) -> Tuple[int, ...]:
+    """user_mask 的全部子集 —— Cypher 里 ev.equipment_mask IN $masks 即可行"""
+    out = []
+    sub = user_mask
+    while True:
+        out.append(sub)
+        if sub == 0:
+            return tuple(out)
+        sub = (sub - 1) & user_mask
@@ -0,0 +1,172 @@
+# tools/exercise_tools/history_profile.py
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from core.resources import get_resource, LRUDict
+from core.metrics import record_cache
+
+# ============================================================
+# 训练历史特征（score_exercises 的预计算版本）
+#
+# 每轮对话只解析一次历史（ISO 时间戳 / 频次统计），得到按全局词表下标排列的向量：
+#   exercise_freq / exercise_penalty   —— 动作频次、动作级冷却
+#   muscle_freq   / muscle_penalty     —— 肌肉频次、肌肉级疲劳
+# 打分 = 按候选的下标 gather 再求和 / 取最大，多部位计划共用同一个 profile。
+#
+# get_history_profile(graph, owner) 按 (owner, 图谱 version, 事件数) 缓存；
+# 时间衰减是分段的，PROFILE_TTL_S 之后按当前时间重建。
+# ============================================================
+
+PROFILE_TTL_S = 300
+PROFILE_CACHE_SIZE = 256
+
+# 与 recommender_exrx.score_exercises 的原始权重一致
+MUSCLE_FREQ_WEIGHT = 0.3
+_DECAY_BOUNDS = np.array([1.0, 3.0, 7.0])          # days_ago < 1 / < 3 / < 7
+_DECAY_VALUES = np.array([2.0, 1.5, 0.5, 0.0])
+
+
+class _Vocab:
+    """全局的 名称 -> 下标（只增不减，动作 / 肌肉数量受 KG 规模限制）"""
+
+    def __init__(self):
+        self._index: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str) -> int:
+        idx = self._index.get(name)
+        if idx is None:
+            with self._lock:
+                idx = self._index.setdefault(name, len(self._index))
+        return idx
+
+    def get(self, name: str, default: int = -1) -> int:
+        return self._index.get(name, default)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+
+EXERCISE_VOCAB = _Vocab()
+MUSCLE_VOCAB = _Vocab()
+
+
+def time_penalty(days_ago: np.ndarray) -> np.ndarray:
+    """muscle_time_penalty 的向量版"""
+    return _DECAY_VALUES[np.searchsorted(_DECAY_BOUNDS, days_ago, side="right")]
+
+
+def _parse_ts(value: Any) -> Optional[float]:
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except Exception:
+        return None
+
+
+def _entry(h: Dict[str, Any], ts: Any = None):
+    # 工具参数里是 id / timestamp；记忆图谱的 WorkoutLog 是 exercise_id + 事件 ts
+    eid = h.get("id") or h.get("exercise_id")
+    return eid, _parse_ts(h.get("timestamp") or ts), h.get("target_muscles") or []
+
+
+class HistoryProfile:
+    def __init__(self, entries: Iterable[tuple], now: Optional[float] = None):
+        self.built_at = time.time() if now is None else now
+
+        ex_count: List[int] = []          # 每条记录的动作下标（可缺失）
+        ex_ts: List[tuple] = []           # (动作下标, 时间戳)
+        mu_ts: List[tuple] = []           # (肌肉下标, 时间戳)
+        for eid, ts, muscles in entries:
+            if eid:
+                ex_count.append(EXERCISE_VOCAB.add(eid))
+            if ts is None:
+                continue
+            if eid:
+                ex_ts.append((EXERCISE_VOCAB.get(eid), ts))
+            for m in muscles:
+                mu_ts.append((MUSCLE_VOCAB.add(m), ts))
+
+        # 多留一个恒为 0 的槽位，词表外 / padding 的下标都指向它
+        n_ex, n_mu = len(EXERCISE_VOCAB) + 1, len(MUSCLE_VOCAB) + 1
+        self._ex_pad, self._mu_pad = n_ex - 1, n_mu - 1
+
+        self.exercise_freq = np.bincount(np.asarray(ex_count, dtype=np.int64), minlength=n_ex).astype(float)
+        self.exercise_penalty = self._decayed(ex_ts, n_ex)
+        mu_idx = np.asarray([i for i, _ in mu_ts], dtype=np.int64)
+        self.muscle_freq = np.bincount(mu_idx, minlength=n_mu).astype(float)
+        self.muscle_penalty = self._decayed(mu_ts, n_mu)
+        self.size = len(ex_count)
+
+    def _decayed(self, pairs: Sequence[tuple], n: int) -> np.ndarray:
+        if not pairs:
+            return np.zeros(n)
+        idx = np.fromiter((i for i, _ in pairs), dtype=np.int64, count=len(pairs))
+        ts = np.fromiter((t for _, t in pairs), dtype=float, count=len(pairs))
+        days_ago = (self.built_at - ts) / 86400.0
+        return np.bincount(idx, weights=time_penalty(days_ago), minlength=n)
+
+    @classmethod
+    def from_history(cls, history: List[Dict[str, Any]], now: Optional[float] = None) -> "HistoryProfile":
+        return cls((_entry(h) for h in history or []), now=now)
+
+    @classmethod
+    def from_events(cls, events: List[Dict[str, Any]], now: Optional[float] = None) -> "HistoryProfile":
+        return cls((_entry(e.get("props", {}) or {}, e.get("ts"))
+                    for e in events or [] if e.get("type") == "WorkoutLog"), now=now)
+
+    def expired(self, ttl: float = PROFILE_TTL_S) -> bool:
+        return time.time() - self.built_at > ttl
+
+    def score(self, candidates: List[Dict[str, Any]]) -> Dict[str, float]:
+        """与 score_exercises 同样的打分，返回 {id: score}"""
+        if not candidates:
+            return {}
+        ex_idx = np.fromiter(
+            (self._index(EXERCISE_VOCAB, ev["id"], self._ex_pad) for ev in candidates),
+            dtype=np.int64, count=len(candidates))
+
+        # 候选的肌肉下标补齐成矩阵，padding 指向 0 槽位
+        width = max(1, max(len(ev.get("target_muscles") or []) for ev in candidates))
+        mu_idx = np.full((len(candidates), width), self._mu_pad, dtype=np.int64)
+        for row, ev in enumerate(candidates):
+            for col, m in enumerate(ev.get("target_muscles") or []):
+                mu_idx[row, col] = self._index(MUSCLE_VOCAB, m, self._mu_pad)
+
+        # 1️⃣ 长期偏好 2️⃣ 动作级冷却 3️⃣ 肌肉级疲劳（取最大）
+        scores = (self.muscle_freq[mu_idx].sum(axis=1) * MUSCLE_FREQ_WEIGHT
+                  - self.exercise_penalty[ex_idx]
+                  - self.muscle_penalty[mu_idx].max(axis=1))
+        return {ev["id"]: float(s) for ev, s in zip(candidates, scores)}
+
+    @staticmethod
+    def _index(vocab: _Vocab, name: str, pad: int) -> int:
+        idx = vocab.get(name)
+        return idx if 0 <= idx < pad else pad
+
+
+def get_history_profile(graph: Dict[str, Any], owner: Optional[str] = None) -> HistoryProfile:
+    """
+    同一用户、同一图谱版本复用；
+    事件数也进 key：页面打卡会先在 session 里的图谱追加事件，落盘（version+1）稍后才发生
+    """
+    from memory.persistence import graph_version
+
+    events = graph.get("events", []) or []
+    key = (owner, graph_version(graph), len(events))
+    cache = get_resource("profiles.exercise_history", PROFILE_CACHE_SIZE,
+                         lambda: LRUDict(PROFILE_CACHE_SIZE))
+    profile = cache.get(key)
+    hit = profile is not None and not profile.expired()
+    record_cache("exercise_history", hit)
+    if not hit:
+        profile = HistoryProfile.from_events(events)
+        cache[key] = profile
+    return profile
@@ -0,0 +1,283 @@
+# tools/exercise_tools/program_builder.py
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence
+
+from core.tracing import traced, set_attrs
+from tools.exercise_tools.recommender_exrx import recommend_exercises, muscle_time_penalty
+
+# ============================================================
+# 一周训练计划（确定性生成，LLM 只做审核 / 补充说明）
+#
+#   1️⃣ 部位分配：部位数 ≥ 训练天数时分组合练，否则按顺序轮换（同部位间隔最大）
+#   2️⃣ 候选池：每个部位调一次 recommend_exercises（硬约束 + 历史打分），取全部可行动作，
+#      去掉拉伸 / 没有 utility 的条目（它们不是做组的训练动作）
+#   3️⃣ 逐天选动作：历史分 + Basic / 复合动作先验 - 肌肉疲劳（按 muscle_time_penalty 的时间窗，
+#      看本计划里该肌肉上次练的是哪天）- 同部位上次用过的变式 - 同一节课里重复的肌肉
+#   4️⃣ 组数 / 次数 / 休息按目标给出，动作数由单次时长反推
+#
+# 输出与 PLAN_DRAFT_RESPONSE_FORMAT 的 workout_draft 一致：{split, sessions[], notes[]}，
+# 额外带 schedule（"每周N次"，记忆图谱里的计划进度按它解析）。
+# ============================================================
+
+WEEKDAYS = ("周一", "周二", "周三", "周四", "周五", "周六", "周日")
+
+# 每周训练天数 -> 一周里的训练日（0 = 周一），尽量隔天
+TRAINING_DAYS = {
+    1: (0,),
+    2: (0, 3),
+    3: (0, 2, 4),
+    4: (0, 1, 3, 4),
+    5: (0, 1, 2, 4, 5),
+    6: (0, 1, 2, 3, 4, 5),
+    7: (0, 1, 2, 3, 4, 5, 6),
+}
+
+PRESCRIPTIONS = {
+    "strength": {"sets": 5, "reps": "3-5", "intensity": "RPE 8（约 85% 1RM）", "rest_sec": 180},
+    "hypertrophy": {"sets": 3, "reps": "8-12", "intensity": "RPE 7-8", "rest_sec": 90},
+    "endurance": {"sets": 3, "reps": "12-15", "intensity": "RPE 6-7", "rest_sec": 60},
+}
+
+DEFAULT_DAYS = 3
+DEFAULT_TIME_MIN = 45
+WARMUP_MIN = 8
+SET_WORK_S = 45             # 每组做功时间（估算时长用）
+TRANSITION_MIN = 1          # 换动作 / 调器械
+MIN_EXERCISES, MAX_EXERCISES = 2, 8
+POOL_SIZE = None            # None = 全部可行候选（recommend_exercises 同分随机，截断会让计划不确定）
+
+BASIC_BONUS = {"basic": 0.3, "basic or auxiliary": 0.15}   # 没有历史时同分，靠它先排主项
+COMPOUND_BONUS = 0.15       # mechanics = Compound（多关节）
+FATIGUE_WEIGHT = 1.0        # muscle_time_penalty 的权重
+ROTATE_PENALTY = 1.0        # 同一动作（按展示名，只是器械不同的同名变式算一个）在本周每多用一次
+SESSION_OVERLAP_PENALTY = 0.3   # 同一节课里目标肌肉重复
+
+# exrx URL 末尾常带的训练方式 / 缩写（ASTricepsDipSelf、WtNeckHarnessExt、BWGluteHamRaiseHead）：
+# 不是动作名的一部分（"Hands Behind Head" 这种完整短语除外）
+SLUG_SUFFIXES = frozenset({"self", "band", "partner", "rings", "hammer", "plate", "loaded",
+                           "ext", "tech", "head", "hips"})
+SLUG_PREPOSITIONS = frozenset({"behind", "on", "with"})
+# 动作名中间的缩写，拼展示名时展开（DBSingleLegRevCalfRaise、BBStrBackStrLegDeadlift）
+SLUG_ABBREVIATIONS = {"Rev": "Reverse", "Str": "Straight", "Ext": "Extension",
+                      "Alt": "Alternating", "Tri": "Triceps"}
+
+
+def goal_type(goal_text: Optional[str]) -> str:
+    text = (goal_text or "").lower()
+    if "力量" in text or "strength" in text:
+        return "strength"
+    if any(k in text for k in ("减脂", "耐力", "fat", "cutting", "endurance", "cardio")):
+        return "endurance"
+    return "hypertrophy"
+
+
+def allocate_body_parts(body_parts: Sequence[str], days: int) -> List[List[str]]:
+    """每个训练日练哪些部位"""
+    parts = list(dict.fromkeys(p for p in body_parts if p))
+    if not parts:
+        return [[] for _ in range(days)]
+    if days >= len(parts):
+        return [[parts[i % len(parts)]] for i in range(days)]
+    return [parts[i::days] for i in range(days)]
+
+
+def _minutes_per_exercise(rx: Dict[str, Any]) -> float:
+    return rx["sets"] * (SET_WORK_S + rx["rest_sec"]) / 60 + TRANSITION_MIN
+
+
+def _slug_words(url: Optional[str]) -> List[str]:
+    """exrx URL 最后一段（如 CBUprightRowRope）拆成单词，去掉器械前缀、PL / X / 2 这类缩写和训练方式后缀"""
+    slug = (url or "").rstrip("/").rsplit("/", 1)[-1]
+    slug = re.sub(r"^[A-Z][A-Za-z](?=[A-Z0-9])", "", slug)         # BB / DB / CB / LV / Wt ...
+    words = re.findall(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+", slug)
+    while words and words[-1].isdigit():
+        words.pop()
+    words = [w for w in words if not (w.isupper() and len(w) <= 2)]
+    while (len(words) > 1 and words[-1].lower() in SLUG_SUFFIXES
+           and words[-2].lower() not in SLUG_PREPOSITIONS):
+        words.pop()
+    return words
+
+
+def _join(words: List[str]) -> str:
+    return " ".join(SLUG_ABBREVIATIONS.get(w, w) for w in words)
+
+
+@lru_cache(maxsize=4096)
+def display_name(name: str, url: Optional[str]) -> str:
+    """
+    计划里展示的动作名。exrx 的变式只记了变化的部分（"arms crossed" / "One Arm" / "Seated"），
+    父动作名从 URL 里取：
+      - 说明片段（带小写单词，或 URL 里没有的单个词）-> "Crunch (arms crossed)" / "Pullup Open (Standing)"
+      - 名称是 URL 动作名的一部分 -> 用完整的 "One Arm Upright Row"
+      - URL 只多了训练方式 / 缩写后缀（Triceps Dip Self）-> 原名不动
+    """
+    name = name.replace("\xa0", " ").strip()
+    words = _slug_words(url)
+    if not words:
+        return name
+    slug = "".join(words).lower()
+    head = [t for t in re.split(r"[\s,]+", re.sub(r"\(.*?\)", "", name)) if t]
+    if (any(t[:1].islower() for t in head)
+            or (len(head) == 1 and "-" not in head[0]
+                and re.sub(r"[^a-z0-9]", "", head[0].lower()) not in slug)):
+        # 每个片段词只抵掉 URL 里的一个词（StrBackStrLeg -> "Straight Leg"）
+        frag = [w.lower() for w in re.findall(r"[A-Za-z]+", name)]
+        parent = []
+        for w in words:
+            hit = next((f for f in frag if f.startswith(w.lower()) or w.lower().startswith(f)), None)
+            if hit is None:
+                parent.append(w)
+            else:
+                frag.remove(hit)
+        return f"{_join(parent)} ({name})" if parent else name
+    full = _join(words)
+    if len(full) > len(name) and all(w.lower() in slug for w in re.findall(r"[A-Za-z]+", name)):
+        return full
+    return name
+
+
+def _label(ev: Dict[str, Any]) -> str:
+    """展示名带父动作（"Crunch (arms crossed)"），老数据没有 url 时用 name"""
+    return display_name(ev.get("name") or "", ev.get("url"))
+
+
+def _is_work_set(ev: Dict[str, Any]) -> bool:
+    """拉伸 / 没有 utility 的条目不按 组 × 次数 开处方"""
+    return bool(ev.get("utility")) and "stretch" not in _label(ev).lower()
+
+
+def _prior(ev: Dict[str, Any]) -> float:
+    bonus = BASIC_BONUS.get((ev.get("utility") or "").lower(), 0.0)
+    if (ev.get("mechanics") or "").lower() == "compound":
+        bonus += COMPOUND_BONUS
+    return bonus
+
+
+def _fatigue(ev: Dict[str, Any], day: int, muscle_last: Dict[str, int]) -> float:
+    muscles = [m for m in ev.get("target_muscles") or [] if m in muscle_last]
+    if not muscles:
+        return 0.0
+    return max(muscle_time_penalty(day - muscle_last[m]) for m in muscles)
+
+
+@traced("exercise.build_program")
+def build_weekly_program(
+    kg_query,
+    body_parts: Sequence[str],
+    days_per_week: Optional[int] = None,
+    time_min: Optional[float] = None,
+    goal: Optional[str] = None,
+    injury_body_part: Optional[List[str]] = None,
+    available_equipment: Optional[List[str]] = None,
+    history: Optional[List[Dict[str, Any]]] = None,
+    history_profile=None,
+) -> Dict[str, Any]:
+    days = int(days_per_week or DEFAULT_DAYS)
+    days = min(max(days, 1), 7)
+    time_min = float(time_min or DEFAULT_TIME_MIN)
+    rx = PRESCRIPTIONS[goal_type(goal)]
+
+    allocation = allocate_body_parts(body_parts, days)
+    offsets = TRAINING_DAYS[days]
+
+    # ---------- 2️⃣ 每个部位一个候选池 ----------
+    pools: Dict[str, List[Dict[str, Any]]] = {}
+    base: Dict[str, float] = {}
+    for part in dict.fromkeys(p for group in allocation for p in group):
+        pool = recommend_exercises({
+            "target_body_part": part,
+            "injury_body_part": injury_body_part or [],
+            "available_equipment": available_equipment or [],
+            "history": history or [],
+            "history_profile": history_profile,
+        }, kg_query, top_k=POOL_SIZE)
+        pool = [ev for ev in pool if _is_work_set(ev)]
+        pools[part] = pool
+        if history_profile is not None:
+            base.update(history_profile.score(pool))
+    set_attrs(days=days, body_parts=len(pools))
+
+    # ---------- 3️⃣ 逐天选动作 ----------
+    per_ex_min = _minutes_per_exercise(rx)
+    n_exercises = int((time_min - WARMUP_MIN) // per_ex_min)
+    n_exercises = min(max(n_exercises, MIN_EXERCISES), MAX_EXERCISES)
+
+    muscle_last: Dict[str, int] = {}
+    used: Dict[str, int] = {}
+    sessions = []
+    for idx, (day, parts) in enumerate(zip(offsets, allocation)):
+        chosen: List[Dict[str, Any]] = []
+        session_muscles = set()
+        session_names = set()
+        # 部位轮流出动作，直到凑够 n_exercises 或候选用完
+        remaining = {p: list(pools.get(p, [])) for p in parts}
+        while len(chosen) < n_exercises and any(remaining.values()):
+            for part in parts:
+                # 同一节课不出现同名动作
+                remaining[part] = [ev for ev in remaining[part] if _label(ev) not in session_names]
+                if len(chosen) >= n_exercises or not remaining[part]:
+                    continue
+
+                def adjusted(ev):
+                    overlap = len(session_muscles & set(ev.get("target_muscles") or []))
+                    return (base.get(ev["id"], 0.0)
+                            + _prior(ev)
+                            - FATIGUE_WEIGHT * _fatigue(ev, day, muscle_last)
+                            - ROTATE_PENALTY * used.get(_label(ev), 0)
+                            - SESSION_OVERLAP_PENALTY * overlap)
+
+                # 同分取 id 最小的，保证同样的输入得到同样的计划
+                best = min(remaining[part], key=lambda ev: (-adjusted(ev), str(ev["id"])))
+                remaining[part].remove(best)
+                chosen.append({"ev": best, "part": part, "fatigue": _fatigue(best, day, muscle_last)})
+                session_muscles.update(best.get("target_muscles") or [])
+                session_names.add(_label(best))
+
+        for c in chosen:
+            ev = c["ev"]
+            used[_label(ev)] = used.get(_label(ev), 0) + 1
+            for m in ev.get("target_muscles") or []:
+                muscle_last[m] = day
+
+        # 多关节（Basic）动作排在前面
+        chosen.sort(key=lambda c: 0 if (c["ev"].get("utility") or "").lower().startswith("basic") else 1)
+
+        items = []
+        for c in chosen:
+            ev = c["ev"]
+            notes = [f"部位: {c['part']}"]
+            if ev.get("equipment"):
+                notes.append("器械: " + ", ".join(ev["equipment"]))
+            if ev.get("target_muscles"):
+                notes.append("目标肌群: " + ", ".join(ev["target_muscles"]))
+            if c["fatigue"] > 0:
+                notes.append("该肌群近几天刚练过，控制强度、留 1-2 次余力")
+            items.append({
+                "exercise": _label(ev),
+                "sets": rx["sets"],
+                "reps": rx["reps"],
+                "intensity": rx["intensity"],
+                "rest_sec": rx["rest_sec"],
+                "notes": notes,
+            })
+
+        sessions.append({
+            "name": f"Day {idx + 1} {WEEKDAYS[day]} - {' + '.join(parts) or '自由训练'}",
+            "duration_min": round(WARMUP_MIN + len(items) * per_ex_min),
+            "items": items,
+            "notes": [f"热身 {WARMUP_MIN} 分钟（动态拉伸 + 轻重量激活）"]
+                     + ([] if items else ["候选动作不足，建议当天做低强度有氧或灵活性训练"]),
+        })
+
+    weekdays = "/".join(WEEKDAYS[d] for d in offsets)
+    return {
+        "split": " / ".join("+".join(g) for g in allocation if g),
+        "schedule": f"每周{days}次（{weekdays}）",
+        "sessions": sessions,
+        "notes": [
+            f"目标: {goal_type(goal)}，每个动作 {rx['sets']} 组 × {rx['reps']}，组间休息 {rx['rest_sec']} 秒",
+            "同一部位的训练日之间轮换动作变式，重复肌群按疲劳时间窗（1 / 3 / 7 天）降权",
+        ],
+    }
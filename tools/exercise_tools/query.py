@@ -1,32 +1,67 @@
 from neo4j import GraphDatabase
 import neo4j
+from core.tracing import run_query
+from tools.kg_cache import VersionedResultCache, KG_VERSION_QUERY, bump_kg_version
+
+KG_NAME = "exercise"
+
+CANDIDATE_COLUMNS = (
+    "id", "name", "url", "instructions", "utility", "mechanics", "force",
+    "equipment_mask", "equipment",
+    "target_muscles", "synergist_muscles", "stabilizer_muscles",
+)
+
 
 class ExerciseKGQuery:
 
     def __init__(self, uri, auth):
         self.driver = GraphDatabase.driver(uri, auth=auth)
+        # (body part, 伤病集合, 器械 mask) 的取值空间很小，结果所有用户共享
+        self._candidate_cache = VersionedResultCache(
+            "exercise_candidates", CANDIDATE_COLUMNS, self.kg_version)
 
     def close(self):
         self.driver.close()
 
+    def kg_version(self):
+        with self.driver.session() as session:
+            rows = run_query(session, "kg.exercise.version", KG_VERSION_QUERY, name=KG_NAME)
+        return rows[0]["version"] if rows else None
+
     def fetch_candidates(
         self,
         target_body_part,
         injury_body_part,      # 🔁 改成复数，list
         available_equipment,
+        equipment_mask=None,   # 用户器械位掩码（见 equipment.py），None 不过滤
     ):
-        query = """
+        injuries = frozenset(injury_body_part or [])
+        key = (target_body_part, injuries, equipment_mask)
+        return self._candidate_cache.get(
+            key,
+            lambda: self._query_candidates(target_body_part, sorted(injuries),
+                                           available_equipment, equipment_mask),
+        )
+
+    def _query_candidates(self, target_body_part, injury_body_part, available_equipment,
+                          equipment_mask=None):
+        # 器械过滤下推：ev.equipment_mask 是 user_mask 的子集即可做；
+        # 未回填 mask 的老节点放行，由 Python 层按 equipment 列表判断。
+        # equipment 名称总是带回：证据 / 训练计划要展示，同名变式（Standing / Seated ...）靠它区分
+        equipment_clause = ""
+        if equipment_mask is not None:
+            equipment_clause = "AND (ev.equipment_mask IS NULL OR ev.equipment_mask IN $feasible_masks)"
+
+        query = f"""
             MATCH (ev:ExerciseVariant)
-            MATCH (ev)-[:TRAINS_BODY_PART]->(:TrainingBodyPart {name: $target_body_part})
+            MATCH (ev)-[:TRAINS_BODY_PART]->(:TrainingBodyPart {{name: $target_body_part}})
 
             /* 排除 instruction 中涉及任一受伤部位 */
-            WHERE NOT EXISTS {
+            WHERE NOT EXISTS {{
                 MATCH (ev)-[:INVOLVES_BODY_PART]->(ibp:InstructionBodyPart)
                 WHERE ibp.name IN $injury_body_part
-            }
-
-            /* equipment */
-            OPTIONAL MATCH (ev)-[:USES_EQUIPMENT]->(eq:Equipment)
+            }}
+            {equipment_clause}
 
             /* muscles */
             OPTIONAL MATCH (ev)-[:TARGETS]->(tm:Muscle)
@@ -36,12 +71,15 @@ class ExerciseKGQuery:
             RETURN
                 ev.id           AS id,
                 ev.name         AS name,
+                ev.url          AS url,
                 ev.instructions AS instructions,
                 ev.utility      AS utility,
+                ev.mechanics    AS mechanics,
                 ev.force        AS force,
 
-                /* equipment list */
-                collect(DISTINCT eq.name) AS equipment,
+                /* equipment：mask 用于过滤，名称用于展示 */
+                ev.equipment_mask AS equipment_mask,
+                [(ev)-[:USES_EQUIPMENT]->(eq:Equipment) | eq.name] AS equipment,
 
                 /* muscle groups */
                 collect(DISTINCT tm.name)  AS target_muscles,
@@ -49,14 +87,53 @@ class ExerciseKGQuery:
                 collect(DISTINCT stm.name) AS stabilizer_muscles
         """
 
+        params = {}
+        if equipment_mask is not None:
+            from tools.exercise_tools.equipment import feasible_masks
+            params["feasible_masks"] = list(feasible_masks(equipment_mask))
+
         with self.driver.session() as session:
-            result = session.run(
+            return run_query(
+                session, "kg.exercise.fetch_candidates",
                 query,
                 target_body_part=target_body_part,
                 injury_body_part=injury_body_part,  # 🔁 注意参数名
                 available_equipment=available_equipment,
+                **params,
             )
-            return [record.data() for record in result]
+
+    def fetch_instruction_body_parts(self, target_body_part):
+        """动作说明里涉及的身体部位（离线物化候选表用来算 injury mask）"""
+        query = """
+        MATCH (ev:ExerciseVariant)-[:TRAINS_BODY_PART]->(:TrainingBodyPart {name: $target_body_part})
+        OPTIONAL MATCH (ev)-[:INVOLVES_BODY_PART]->(ibp:InstructionBodyPart)
+        RETURN ev.id AS id, collect(DISTINCT ibp.name) AS body_parts
+        """
+        with self.driver.session() as session:
+            return run_query(session, "kg.exercise.fetch_instruction_body_parts",
+                             query, target_body_part=target_body_part)
+
+    def store_equipment_masks(self, batch_size: int = 500) -> int:
+        """给已有 KG 回填 ev.equipment_mask（新导入的数据在 exercise_kg.py 里直接写入）"""
+        from tools.exercise_tools.equipment import equipment_mask
+
+        read = """
+        MATCH (ev:ExerciseVariant)
+        OPTIONAL MATCH (ev)-[:USES_EQUIPMENT]->(eq:Equipment)
+        RETURN ev.id AS id, collect(DISTINCT eq.name) AS equipment
+        """
+        write = """
+        UNWIND $rows AS row
+        MATCH (ev:ExerciseVariant {id: row.id})
+        SET ev.equipment_mask = row.mask
+        """
+        with self.driver.session() as session:
+            rows = [{"id": r["id"], "mask": equipment_mask(r["equipment"])}
+                    for r in session.run(read)]
+            for i in range(0, len(rows), batch_size):
+                session.run(write, rows=rows[i:i + batch_size])
+            bump_kg_version(session, KG_NAME)
+        return len(rows)
 
 
     def fetch_all_training_body_parts(self):
@@ -131,13 +208,13 @@ class ExerciseKGQuery:
         """
 
         with self.driver.session() as session:
-            result = session.run(
+            return run_query(
+                session, "kg.exercise.search_exercises",
                 query,
                 target_part=target_part,
                 exercise_text=exercise_text,
                 limit=limit
             )
-            return [r.data() for r in result]
 
 
 
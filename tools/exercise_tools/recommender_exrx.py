@@ -1,44 +1,24 @@
 # recommender.py
 
-from datetime import datetime, timedelta
-from collections import Counter, defaultdict
+from collections import defaultdict
 import random
-from tools.exercise_tools.query import ExerciseKGQuery
-
-
-# =========================
-# Real physical equipment
-# =========================
-REAL_EQUIPMENT = {
-    "Barbell",
-    "Dumbbell",
-    "Cable",
-    "Smith",
-    "Lever",
-    "Suspended",
-    "Sled",
-    "Band Resistive",
-}
-
-# =========================
-# Equipment subtype mapping
-# =========================
-EQUIPMENT_PARENT = {
-    "Lever (plate loaded)": "Lever",
-    "Lever (selectorized)": "Lever",
-    "Sled (plate loaded)": "Sled",
-    "Sled (selectorized)": "Sled",
-    "Suspension": "Suspended",
-}
+import time
+from core.tracing import traced, record_span, set_attrs
 
 
+# 器械词表 / 位掩码见 equipment.py（REAL_EQUIPMENT / EQUIPMENT_PARENT 仍可从这里 import）
+from tools.exercise_tools.equipment import (
+    REAL_EQUIPMENT,
+    EQUIPMENT_PARENT,
+    equipment_mask,
+    user_equipment_mask,
+    is_feasible_mask,
+)
 
 
 # ============================================================
-# History-based scoring
+# History-based scoring（向量化实现见 history_profile.py）
 # ============================================================
-from datetime import datetime
-from collections import Counter, defaultdict
 
 
 def muscle_time_penalty(days_ago: float) -> float:
@@ -53,7 +33,7 @@ def muscle_time_penalty(days_ago: float) -> float:
         return 0.0
 
 
-def score_exercises(candidates, history):
+def score_exercises(candidates, history, profile=None):
     """
     candidates: List of dicts
       {
@@ -68,71 +48,16 @@ def score_exercises(candidates, history):
         "timestamp": str,
         "target_muscles": List[str]
       }
-    """
-
-    now = datetime.now()
-
-    # === Long-term statistics ===
-    exercise_freq = Counter()
-    muscle_freq = Counter()
-
-    # === Recent muscle usage ===
-    muscle_recent_penalty = defaultdict(float)
-    exercise_recent_penalty = defaultdict(float)
-
-    for h in history:
-        eid = h.get("id")
-        ts = h.get("timestamp")
-        muscles = h.get("target_muscles", [])
-
-        if eid:
-            exercise_freq[eid] += 1
-
-        if not ts:
-            continue
-
-        try:
-            t = datetime.fromisoformat(ts)
-        except Exception:
-            continue
-
-        days_ago = (now - t).total_seconds() / 86400.0
-
-        # 动作级冷却（更强）
-        if eid:
-            exercise_recent_penalty[eid] += muscle_time_penalty(days_ago)
-
-        # 肌肉级疲劳
-        for m in muscles:
-            muscle_freq[m] += 1
-            muscle_recent_penalty[m] += muscle_time_penalty(days_ago)
 
-    # === Score candidates ===
-    scores = {}
-
-    for ev in candidates:
-        score = 0.0
-        ev_id = ev["id"]
-        ev_muscles = ev.get("target_muscles", [])
-
-        # 1️⃣ 长期偏好（肌肉频次）
-        for m in ev_muscles:
-            score += muscle_freq.get(m, 0) * 0.3
-
-        # 2️⃣ 动作级冷却惩罚
-        score -= exercise_recent_penalty.get(ev_id, 0.0)
-
-        # 3️⃣ 肌肉级疲劳惩罚（取最大，避免过度惩罚）
-        if ev_muscles:
-            max_penalty = max(
-                muscle_recent_penalty.get(m, 0.0)
-                for m in ev_muscles
-            )
-            score -= max_penalty
-
-        scores[ev_id] = score
+    profile: 预先构建好的 HistoryProfile（同一轮多个部位共用），
+             不传时按 history 现算
+    """
+    if profile is None:
+        from tools.exercise_tools.history_profile import HistoryProfile
+        profile = HistoryProfile.from_history(history)
 
-    return scores
+    # 1️⃣ 长期偏好（肌肉频次）2️⃣ 动作级冷却 3️⃣ 肌肉级疲劳（取最大，避免过度惩罚）
+    return profile.score(candidates)
 
 
 def is_exercise_feasible(exercise_equipment, user_equipment):
@@ -141,25 +66,22 @@ def is_exercise_feasible(exercise_equipment, user_equipment):
 
     exercise_equipment: List[str]  # 来自 KG
     user_equipment: Set[str]       # 用户真实拥有的器械
-    """
 
-    if not exercise_equipment:
-        # 没声明任何 equipment → 默认可做
-        return True
-
-    for eq in exercise_equipment:
-        parent = EQUIPMENT_PARENT.get(eq, eq)
+    没声明任何 equipment → 默认可做；只在「真实器械」且用户没有时排除
+    """
+    return is_feasible_mask(equipment_mask(exercise_equipment), user_equipment_mask(user_equipment))
 
-        # 只在「真实器械」且用户没有时排除
-        if parent in REAL_EQUIPMENT and parent not in user_equipment:
-            return False
 
-    return True
+def _candidate_mask(ev) -> int:
+    # KG 里已存 equipment_mask 的直接用；老数据（未回填）按 equipment 列表现算
+    mask = ev.get("equipment_mask")
+    return equipment_mask(ev.get("equipment", [])) if mask is None else mask
 
 
 # ============================================================
 # Main recommendation pipeline
 # ============================================================
+@traced("exercise.recommend_exercises")
 def recommend_exercises(
     user_profile: dict,
     kg_query,
@@ -171,7 +93,8 @@ def recommend_exercises(
       "target_body_part": "Chest",
       "injury_body_part": "Neck",
       "available_equipment": ["Barbell", "Dumbbell"],
-      "history": [...]
+      "history": [...],
+      "history_profile": HistoryProfile (可选，优先于 history)
     }
     """
 
@@ -179,33 +102,42 @@ def recommend_exercises(
     # Step 0️⃣ 用户输入准备
     # =========================
     target_body_part = user_profile.get("target_body_part")
-    injury_body_part = user_profile.get("injury_body_part")
+    injury_body_part = user_profile.get("injury_body_part") or []
+    if isinstance(injury_body_part, str):
+        injury_body_part = [injury_body_part]
 
-    user_equipment = set(user_profile.get("available_equipment", []))
+    user_mask = user_equipment_mask(user_profile.get("available_equipment", []))
     history = user_profile.get("history", [])
+    profile = user_profile.get("history_profile")
 
     # =========================
-    # Step 1️⃣ KG 初筛（只做硬约束）
+    # Step 1️⃣ 初筛（硬约束 + 器械 mask）：优先离线物化表，没有再查 KG
     # =========================
-    candidates = kg_query.fetch_candidates(
-        target_body_part=target_body_part,
-        injury_body_part=injury_body_part,
-        available_equipment=[],  # ❗这里不再做 equipment 硬过滤
-    )
+    from tools.candidate_tables import get_tables
 
+    tables = get_tables()
+    if tables is not None and tables.has(f"exercise/{target_body_part}"):
+        source = "tables:" + tables.version
+        candidates = tables.exercise_candidates(target_body_part, injury_body_part, user_mask)
+    else:
+        source = "kg"
+        candidates = kg_query.fetch_candidates(
+            target_body_part=target_body_part,
+            injury_body_part=injury_body_part,
+            available_equipment=[],  # ❗器械名不再参与 Cypher 过滤，只用 mask
+            equipment_mask=user_mask,
+        )
+
+    set_attrs(target_body_part=target_body_part, candidates=len(candidates), candidate_source=source)
     if not candidates:
         return []
 
     # =========================
-    # Step 2️⃣ 设备可行性过滤（Python 层）
+    # Step 2️⃣ 设备可行性过滤（一次按位与；KG 已过滤过的行这里恒为 True）
     # =========================
-    feasible = [
-        ev for ev in candidates
-        if is_exercise_feasible(
-            ev.get("equipment", []),
-            user_equipment
-        )
-    ]
+    t_score = time.perf_counter()
+    missing = ~user_mask
+    feasible = [ev for ev in candidates if _candidate_mask(ev) & missing == 0]
 
     if not feasible:
         return []
@@ -213,7 +145,8 @@ def recommend_exercises(
     # =========================
     # Step 3️⃣ 基于历史的打分
     # =========================
-    scores = score_exercises(feasible, history)
+    scores = score_exercises(feasible, history, profile=profile)
+    record_span("exercise.filter_and_score", t_score, feasible=len(feasible))
 
     # =========================
     # Step 4️⃣ 排序 & Top-K（同分随机，return 不变）
@@ -0,0 +1,93 @@
+# tools/kg_cache.py
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+
+from core.resources import LRUDict
+from core.metrics import record_cache
+
+# ============================================================
+# KG 查询结果缓存（所有用户共享，挂在共享的 KG 客户端上）
+#
+#   - 行存成紧凑 tuple（固定列序），命中时再拼回 dict，调用方拿到的仍是 record.data() 形状
+#   - 失效：KG 里的 (:KGVersion {name}) 节点。导入 / 回填脚本改数据后 bump_kg_version，
+#     这里最多每 VERSION_CHECK_S 秒查一次版本，变了就整体清空
+#   - invalidate("kg.") 关闭客户端时缓存随之丢弃
+# ============================================================
+
+VERSION_CHECK_S = 30.0
+
+KG_VERSION_QUERY = """
+OPTIONAL MATCH (v:KGVersion {name: $name})
+RETURN v.version AS version
+"""
+
+BUMP_KG_VERSION_QUERY = """
+MERGE (v:KGVersion {name: $name})
+SET v.version = coalesce(v.version, 0) + 1,
+    v.updated_at = timestamp()
+RETURN v.version AS version
+"""
+
+
+def bump_kg_version(session, name: str) -> int:
+    """导入 / 回填结束后调用，让所有进程里的结果缓存失效"""
+    return session.run(BUMP_KG_VERSION_QUERY, name=name).single()["version"]
+
+
+def _freeze(value: Any) -> Any:
+    return tuple(value) if isinstance(value, list) else value
+
+
+def _thaw(value: Any) -> Any:
+    return list(value) if isinstance(value, tuple) else value
+
+
+class VersionedResultCache:
+    def __init__(self, name: str, columns: Sequence[str],
+                 fetch_version: Callable[[], Optional[int]],
+                 maxsize: int = 512, check_interval: float = VERSION_CHECK_S):
+        self.name = name
+        self.columns = tuple(columns)
+        self._fetch_version = fetch_version
+        self._rows = LRUDict(maxsize)
+        self._check_interval = check_interval
+        self._version: Optional[int] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _check_version(self) -> None:
+        now = time.monotonic()
+        if now - self._checked_at < self._check_interval:
+            return
+        with self._lock:
+            if now - self._checked_at < self._check_interval:
+                return
+            try:
+                version = self._fetch_version()
+            except Exception as e:
+                # 查不到版本不影响服务：保留缓存，下个周期再试
+                print(f"[KGCache] {self.name} version check failed: {e}")
+                version = self._version
+            if version != self._version:
+                self._rows = LRUDict(self._rows.maxsize)
+                self._version = version
+            self._checked_at = now
+
+    def get(self, key: Hashable, load: Callable[[], List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        self._check_version()
+        rows = self._rows
+        packed: Optional[Tuple[tuple, ...]] = rows.get(key)
+        record_cache(self.name, packed is not None)
+        if packed is None:
+            packed = tuple(tuple(_freeze(r.get(c)) for c in self.columns) for r in load())
+            rows[key] = packed
+        return [{c: _thaw(v) for c, v in zip(self.columns, row)} for row in packed]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._rows = LRUDict(self._rows.maxsize)
+            self._checked_at = 0.0
+
+    def __len__(self) -> int:
+        return len(self._rows)
@@ -0,0 +1,43 @@
+# tools/kg_clients.py
+from typing import TYPE_CHECKING
+
+from core.config import get_cfg
+from core.resources import get_resource
+
+if TYPE_CHECKING:
+    from tools.exercise_tools.query import ExerciseKGQuery
+    from tools.diet_tools.query import DietKGQuery
+
+# ============================================================
+# 共享的 Neo4j 客户端（driver 自带连接池，线程安全）
+#
+# 按当前 cfg 里的连接信息缓存：所有 session / 请求共用一个 driver，
+# 设置页改了连接串就得到新的 driver；core.resources.invalidate("kg.") 关闭全部。
+# 构造走模块属性（exercise_query.ExerciseKGQuery），bench 可以直接替换成内存实现。
+# neo4j 只在第一次取客户端时才 import（整个包约 0.5s，且会连带 import pandas）。
+# ============================================================
+
+
+def _close(client) -> None:
+    if hasattr(client, "close"):
+        client.close()
+
+
+def get_exercise_kg() -> "ExerciseKGQuery":
+    from tools.exercise_tools import query as exercise_query
+
+    cfg = get_cfg()
+    uri = cfg["neo4j_uri"]
+    auth = (cfg["neo4j_user"], cfg["neo4j_password"])
+    return get_resource("kg.exercise", (uri, auth),
+                        lambda: exercise_query.ExerciseKGQuery(uri, auth), close=_close)
+
+
+def get_diet_kg() -> "DietKGQuery":
+    from tools.diet_tools import query as diet_query
+
+    cfg = get_cfg()
+    uri = cfg["diet_neo4j_uri"]
+    auth = (cfg["diet_neo4j_user"], cfg["diet_neo4j_password"])
+    return get_resource("kg.diet", (uri, auth),
+                        lambda: diet_query.DietKGQuery(uri, auth), close=_close)
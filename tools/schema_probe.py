@@ -0,0 +1,145 @@
+# tools/schema_probe.py
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+from core.tracing import run_query
+
+# ============================================================
+# Schema Probe：图谱元数据探测（每个 driver 一份，带 TTL）
+#
+#   db.labels() / db.propertyKeys() / 索引列表 在第一次查询前跑一次，
+#   KG 客户端据此预先选好查询变体（如 Recipe 的菜名字段是 name 还是 recipe_name、
+#   有没有全文索引），之后的查询不需要「失败 -> 探测 -> 重试」。
+#
+#   - db.propertyKeys() 是全库的：Ingredient / Nutrient 有 name，不代表 Recipe 有。
+#     客户端关心的 label 另外抽样 LABEL_KEYS_SAMPLE 个节点，取它们自己的属性名
+#   - 索引：Neo4j 5 用 SHOW INDEXES（db.indexes() 已移除），4.x 回退到 CALL db.indexes()
+#   - 探测失败不影响查询：沿用上一份结果（第一次则用导入脚本写入的默认字段），
+#     SCHEMA_RETRY_S 秒后再试
+# ============================================================
+
+SCHEMA_TTL_S = float(os.getenv("KG_SCHEMA_TTL_S", "600"))
+SCHEMA_RETRY_S = 30.0
+LABEL_KEYS_SAMPLE = 100
+
+LABELS_QUERY = "CALL db.labels() YIELD label RETURN collect(label) AS labels"
+PROPERTY_KEYS_QUERY = "CALL db.propertyKeys() YIELD propertyKey RETURN collect(propertyKey) AS keys"
+INDEXES_QUERY = """
+SHOW INDEXES YIELD name, type, entityType, labelsOrTypes, properties, state
+RETURN name, type, entityType, labelsOrTypes, properties, state
+"""
+# label 不能参数化；只对 db.labels() 里真实存在的 label 拼接，反引号转义
+LABEL_KEYS_QUERY = """
+MATCH (n:`{label}`) WITH n LIMIT $sample
+UNWIND keys(n) AS key
+RETURN collect(DISTINCT key) AS keys
+"""
+LEGACY_INDEXES_QUERY = """
+CALL db.indexes() YIELD name, type, entityType, labelsOrTypes, properties, state
+RETURN name, type, entityType, labelsOrTypes, properties, state
+"""
+
+
+class GraphSchema:
+    def __init__(self, labels: Sequence[str] = (), property_keys: Sequence[str] = (),
+                 indexes: Sequence[Dict[str, Any]] = (), probed: bool = True,
+                 label_keys: Optional[Dict[str, Sequence[str]]] = None):
+        self.labels = frozenset(labels)
+        self.property_keys = frozenset(property_keys)
+        self.label_keys = {label: frozenset(keys) for label, keys in (label_keys or {}).items()}
+        self.indexes = [dict(ix) for ix in indexes]
+        self.probed = probed            # False = 探测失败时的占位
+
+    def pick_property(self, candidates: Sequence[str], label: Optional[str] = None) -> str:
+        """
+        candidates 里第一个在库中存在的属性；label 上有索引的优先。都没有时返回 candidates[0]。
+        label 探测过自己的属性名时只看它的，否则退回全库的 db.propertyKeys()
+        """
+        keys = self.label_keys.get(label, self.property_keys) if label else self.property_keys
+        present = [p for p in candidates if p in keys]
+        if label:
+            for p in present:
+                if self.find_index(label, p):
+                    return p
+        return present[0] if present else candidates[0]
+
+    def find_index(self, label: str, prop: str,
+                   types: Sequence[str] = ("RANGE", "TEXT", "BTREE", "FULLTEXT")) -> Optional[Dict[str, Any]]:
+        """label.prop 上第一个可用（ONLINE）的节点索引"""
+        for ix in self.indexes:
+            if (ix.get("entityType") == "NODE"
+                    and ix.get("state") == "ONLINE"
+                    and (ix.get("type") or "").upper() in types
+                    and label in (ix.get("labelsOrTypes") or [])
+                    and prop in (ix.get("properties") or [])):
+                return ix
+        return None
+
+
+def probe_schema(driver, key_labels: Sequence[str] = ()) -> GraphSchema:
+    with driver.session() as session:
+        labels = run_query(session, "kg.schema.labels", LABELS_QUERY)
+        keys = run_query(session, "kg.schema.property_keys", PROPERTY_KEYS_QUERY)
+        labels = labels[0]["labels"] if labels else []
+        label_keys = {}
+        for label in key_labels:
+            if label not in labels:
+                continue
+            rows = run_query(session, "kg.schema.label_keys",
+                             LABEL_KEYS_QUERY.format(label=label.replace("`", "``")),
+                             sample=LABEL_KEYS_SAMPLE)
+            label_keys[label] = rows[0]["keys"] if rows else []
+    # SHOW INDEXES 失败时 session 不可复用，另开一个
+    indexes: List[Dict[str, Any]] = []
+    for name, query in (("kg.schema.indexes", INDEXES_QUERY),
+                        ("kg.schema.indexes_legacy", LEGACY_INDEXES_QUERY)):
+        try:
+            with driver.session() as session:
+                indexes = run_query(session, name, query)
+            break
+        except Exception as e:
+            print(f"[SchemaProbe] {name} failed: {e}")
+    return GraphSchema(
+        labels=labels,
+        property_keys=keys[0]["keys"] if keys else [],
+        indexes=indexes,
+        label_keys=label_keys,
+    )
+
+
+class SchemaProbe:
+    """
+    挂在 KG 客户端上（客户端按连接信息共享，即每个 driver 一份）。
+    key_labels：要单独探测属性名的 label（pick_property(label=...) 会用到的）
+    """
+
+    def __init__(self, driver, key_labels: Sequence[str] = (), ttl_s: float = SCHEMA_TTL_S):
+        self._driver = driver
+        self._key_labels = tuple(key_labels)
+        self._ttl_s = ttl_s
+        self._schema: Optional[GraphSchema] = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self) -> GraphSchema:
+        now = time.monotonic()
+        if self._schema is not None and now < self._expires_at:
+            return self._schema
+        with self._lock:
+            if self._schema is not None and now < self._expires_at:
+                return self._schema
+            try:
+                self._schema = probe_schema(self._driver, self._key_labels)
+                self._expires_at = now + self._ttl_s
+            except Exception as e:
+                print(f"[SchemaProbe] probe failed: {e}")
+                if self._schema is None:
+                    self._schema = GraphSchema(probed=False)
+                self._expires_at = now + SCHEMA_RETRY_S
+            return self._schema
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._expires_at = 0.0